@@ -1,10 +1,10 @@
 import argparse
 import os
 from lxml import etree
-from itertools import chain
 from tqdm import tqdm
 import glob 
 from svgnet.data.svg import SVG_CATEGORIES
+from svgnet.data.svg_tree import PRIMITIVE_TAGS, iter_primitives, stream_rewrite
 
 
 CLASS_NAMES = {x["id"] : x["name"] for x in SVG_CATEGORIES}
@@ -30,38 +30,38 @@ def get_args():
         help="Directory for output results.",
         default="./clean_results",
     )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Filter incrementally with bounded memory, for very large svgs.",
+    )
     
     args = parser.parse_args()
     return args
 
 
+KEEP_IDS = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 28, 33, 34]
+
+
 def clear_xml(svg_file, out_folder):
     tree = etree.parse(svg_file)
     root = tree.getroot()
-    ns = root.tag[:-3] # Extracts XML namespace from root tag
 
-    keep_ids = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 28, 33, 34]
-    keep_ids = list(map(str, keep_ids))
+    keep_ids = list(map(str, KEEP_IDS))
 
     remove_count = {i: 0 for i in range(37) if str(i) not in keep_ids}
     keep_count = {int(i): 0 for i in keep_ids}
 
     keep_count 
     to_remove = {}
-    for g in root.iter(ns + "g"):  # Iterates through all <g> (group) elements in the SVG
-        # Looks for path, circle and ellipse
-        for _path in chain(
-            g.iter(ns + "path"), 
-            g.iter(ns + "circle"), 
-            g.iter(ns + "ellipse")
-        ):
-            
-            if "semanticId" in _path.attrib:
-                id = _path.attrib["semanticId"]
-                if not(id in keep_ids):
-                    to_remove.update({_path : int(id)})
-                else:
-                    keep_count[int(id)] += 1
+    # Looks for path, circle and ellipse, each visited once even in nested <g>
+    for _, _path, _, _ in iter_primitives(root):
+        if "semanticId" in _path.attrib:
+            id = _path.attrib["semanticId"]
+            if not(id in keep_ids):
+                to_remove.update({_path : int(id)})
+            else:
+                keep_count[int(id)] += 1
         
     for path, id in to_remove.items(): 
         parent = path.getparent()
@@ -74,6 +74,27 @@ def clear_xml(svg_file, out_folder):
     for id, count in keep_count.items(): print(f"Class {id} : {CLASS_NAMES[id]}, {count} elements found and kept")
     tree.write(os.path.join(out_folder, os.path.basename(svg_file)))
 
+def clear_xml_stream(svg_file, out_folder):
+    """Streaming clear_xml: the output is written while the input is parsed, with bounded memory."""
+    keep_ids = list(map(str, KEEP_IDS))
+    remove_count = {i: 0 for i in range(37) if str(i) not in keep_ids}
+    keep_count = {int(i): 0 for i in keep_ids}
+
+    def transform(_path):
+        if etree.QName(_path).localname not in PRIMITIVE_TAGS or "semanticId" not in _path.attrib:
+            return _path
+        id = _path.attrib["semanticId"]
+        if not(id in keep_ids):
+            remove_count[int(id)] += 1
+            return None
+        keep_count[int(id)] += 1
+        return _path
+
+    stream_rewrite(svg_file, os.path.join(out_folder, os.path.basename(svg_file)), transform)
+
+    for id, count in remove_count.items(): print(f"Class {id} : {CLASS_NAMES[id]}, {count} elements removed")
+    for id, count in keep_count.items(): print(f"Class {id} : {CLASS_NAMES[id]}, {count} elements found and kept")
+
 def process():
     args = get_args()
     os.makedirs(args.input_dir, exist_ok=True)
@@ -83,7 +104,10 @@ def process():
     print(f"{args.input_dir}")
     for file in tqdm(svg_paths):
         print(f"File {file}")
-        clear_xml(file, args.output_dir)
+        if args.stream:
+            clear_xml_stream(file, args.output_dir)
+        else:
+            clear_xml(file, args.output_dir)
         print(f"-------------------------------------------------------------------")
 
 def main():
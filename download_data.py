@@ -1,8 +1,13 @@
 """Download FloorPlanCAD dataset."""
 import os
 import argparse
+import zipfile
 import gdown
 
+from svgnet.data.manifest import MANIFEST_NAME, Manifest
+
+DOWNLOAD_VERSION = 1
+
 def parse_args():
     '''
     Arguments
@@ -23,9 +28,31 @@ def parse_args():
                         default="1Hc4-ggsUMoB_5uqJdqYRn9K73QS8rOgG",
                         help='google drive id'
                         )
+    parser.add_argument('--overwrite', action='store_true',
+                        help='download the archives again even if they exist'
+                        )
     args = parser.parse_args()
     return args
 
+def extract(zip_path, unzip_dir, manifest):
+    """Extracts the files of zip_path that are new or changed since the last extraction.
+
+    Files of a previous version of the archive that it no longer contains are deleted.
+    """
+    with zipfile.ZipFile(zip_path) as zf:
+        members = [info for info in zf.infolist() if not info.is_dir()]
+        extracted = 0
+        for info in members:
+            output = os.path.join(unzip_dir, info.filename)
+            digest = f"crc32:{info.CRC:08x}"
+            if manifest.is_current(info.filename, digest, output):
+                continue
+            zf.extract(info, unzip_dir)
+            manifest.record(info.filename, digest, output)
+            extracted += 1
+    removed = manifest.prune(info.filename for info in members)
+    print(f"{extracted} of {len(members)} files extracted, {len(removed)} removed files deleted")
+
 def main():
     '''
     Main entrance
@@ -33,35 +60,27 @@ def main():
     args = parse_args()
     os.makedirs(args.data_save_dir, exist_ok=True)
 
-    # download
-    print(f'downloading train...')
-    url = f"https://drive.google.com/uc?id={args.train_url}"
-    gdown.download(url, f"{args.data_save_dir}/train.zip")
-    print(f'downloading val...')
-    url = f"https://drive.google.com/uc?id={args.val_url}"
-    gdown.download(url, f"{args.data_save_dir}/val.zip")
-    print(f'downloading test...')
-    url = f"https://drive.google.com/uc?id={args.test_url}"
-    gdown.download(url, f"{args.data_save_dir}/test.zip")
-
-    # unzip
-    zip_path = os.path.join(args.data_save_dir, "train.zip")
-    unzip_dir = os.path.join(args.data_save_dir, "train")
-    os.makedirs(unzip_dir, exist_ok=True)
-    cmd = f"unzip {zip_path} -d {unzip_dir}"
-    os.system(cmd)
+    for split, drive_id in [("train", args.train_url), ("val", args.val_url), ("test", args.test_url)]:
+        zip_path = os.path.join(args.data_save_dir, f"{split}.zip")
+        unzip_dir = os.path.join(args.data_save_dir, split)
+        os.makedirs(unzip_dir, exist_ok=True)
 
-    zip_path = os.path.join(args.data_save_dir, "val.zip")
-    unzip_dir = os.path.join(args.data_save_dir, "val")
-    os.makedirs(unzip_dir, exist_ok=True)
-    cmd = f"unzip {zip_path} -d {unzip_dir}"
-    os.system(cmd)
+        # download
+        if args.overwrite or not os.path.exists(zip_path):
+            print(f'downloading {split}...')
+            url = f"https://drive.google.com/uc?id={drive_id}"
+            gdown.download(url, zip_path + ".tmp")
+            os.replace(zip_path + ".tmp", zip_path)
+        else:
+            # the remote archive is not checked, a newer release needs --overwrite
+            print(f'reusing {zip_path}, pass --overwrite to download {split} again')
 
-    zip_path = os.path.join(args.data_save_dir, "test.zip")
-    unzip_dir = os.path.join(args.data_save_dir, "test")
-    os.makedirs(unzip_dir, exist_ok=True)
-    cmd = f"unzip {zip_path} -d {unzip_dir}"
-    os.system(cmd)
+        # unzip, only the files that changed
+        manifest = Manifest(os.path.join(unzip_dir, MANIFEST_NAME), "download_data", DOWNLOAD_VERSION)
+        try:
+            extract(zip_path, unzip_dir, manifest)
+        finally:
+            manifest.save()
 
 if __name__ == '__main__':
     main()
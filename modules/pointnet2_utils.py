@@ -17,7 +17,7 @@ def sample_and_group(stride, nsample, xyz, points, offset, return_idx=False, num
         for i in range(1, offset.shape[0]):
             sample_idx += (offset[i].item() - offset[i - 1].item()) // stride
             new_offset.append(sample_idx)
-        new_offset = torch.cuda.IntTensor(new_offset)
+        new_offset = torch.tensor(new_offset, dtype=torch.int32, device=offset.device)
         if num_sector > 1:
             fps_idx = pointops.sectorized_fps(xyz, offset, new_offset, num_sector)  # [M]
         else:
@@ -108,7 +108,7 @@ class PointNetFeaturePropagation(nn.Module):
         norm = torch.sum(dist_recip, dim=1, keepdim=True)
         weight = dist_recip / norm  # [M, 3]
         
-        interpolated_points = torch.cuda.FloatTensor(xyz1.shape[0], points2.shape[1]).zero_()
+        interpolated_points = points2.new_zeros(xyz1.shape[0], points2.shape[1])
         for i in range(3):
             interpolated_points += points2[idx[:, i].long(), :] * weight[:, i].unsqueeze(-1)
 
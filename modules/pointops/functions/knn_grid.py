@@ -0,0 +1,139 @@
+"""Exact k nearest neighbors from a uniform grid over every cloud, for any device.
+
+Each cloud of the offset batch gets its own grid, with a cell size from the
+density of its bounding box, so a cell holds about ``points_per_cell``
+points. Axes without extent in any cloud (z of the drawings) are left out of
+the grid. The points are sorted by cell once; a query then only measures the
+points of the cells within ``r`` cells of its own, and is done once its k-th
+distance is within the searched box, else it searches again with ``r``
+doubled. The result follows ``knnquery``: (m, nsample) int32 indices and
+squared distances sorted by distance, padded with the first point of the
+cloud at 1e10 when the cloud has fewer than nsample points.
+"""
+import itertools
+
+import torch
+
+# candidate (query, point) pairs measured at once
+CHUNK_ELEMENTS = 1 << 22
+
+
+def _segment_ids(offset):
+    counts = torch.diff(offset, prepend=offset.new_zeros(1))
+    return counts, torch.repeat_interleave(torch.arange(offset.shape[0], device=offset.device), counts)
+
+
+def _segment_bounds(xyz, offset, counts, seg):
+    """(b, d) lowest and highest coordinates of every cloud, 0 for empty clouds.
+
+    The clouds are padded to (b, n_max, d) instead of scatter_reduce, which needs torch 1.12.
+    """
+    b, dims = counts.shape[0], xyz.shape[1]
+    pos = torch.arange(xyz.shape[0], device=xyz.device) - (offset - counts)[seg]
+    n_max = int(counts.max()) if b else 0
+    padded = xyz.new_full((b, n_max, dims), float("inf"))
+    padded[seg, pos] = xyz
+    lo = padded.amin(1)
+    padded[seg, pos] = -xyz
+    hi = -padded.amin(1)
+    empty = counts == 0
+    lo[empty], hi[empty] = 0, 0
+    return lo, hi
+
+
+def knnquery_grid(nsample, xyz, new_xyz, offset, new_offset, points_per_cell=None):
+    """
+    input: xyz: (n, d), new_xyz: (m, d), offset: (b), new_offset: (b)
+    output: idx: (m, nsample), dist2: (m, nsample)
+    """
+    device, k = xyz.device, nsample
+    if points_per_cell is None:
+        points_per_cell = max(k / 2, 1)
+    offset, new_offset = offset.long(), new_offset.long()
+    b, m, dims = offset.shape[0], new_xyz.shape[0], xyz.shape[1]
+    counts, seg = _segment_ids(offset)
+    _, new_seg = _segment_ids(new_offset)
+    starts = offset - counts
+
+    # bounds of every cloud, on the axes with extent
+    lo, hi = _segment_bounds(xyz, offset, counts, seg)
+    empty = counts == 0
+    active = ((hi - lo) > 0).any(0)
+    if not active.any():
+        active[0] = True
+    lo, ext = lo[:, active], (hi - lo)[:, active]
+    has_ext = ext > 0
+    volume = torch.where(has_ext, ext, torch.ones_like(ext)).prod(1)
+    dims = has_ext.sum(1).clamp(min=1)
+    size = (volume * points_per_cell / counts.clamp(min=1)) ** (1.0 / dims)
+    size = torch.where(has_ext.any(1), size, torch.ones_like(size)).clamp(min=1e-12)
+    grid = torch.floor(ext / size[:, None]).long() + 1  # (b, d) cells per axis
+    stride = torch.cumprod(torch.cat([grid.new_ones(b, 1), grid.flip(1)[:, :-1]], 1), 1).flip(1)
+    base = torch.cumsum(grid.prod(1), 0) - grid.prod(1)
+
+    def cell_of(p, s):
+        c = torch.floor((p[:, active] - lo[s]) / size[s, None]).long()
+        return torch.minimum(c.clamp(min=0), grid[s] - 1)
+
+    point_key = base[seg] + (cell_of(xyz, seg) * stride[seg]).sum(1)
+    point_key, order = torch.sort(point_key)
+
+    idx = starts[new_seg][:, None].repeat(1, k).int()
+    dist2 = new_xyz.new_full((m, k), 1e10)
+    pending = torch.arange(m, device=device)[~empty[new_seg]]
+    radius = 1
+    while pending.numel() > 0:
+        s = new_seg[pending]
+        cell = cell_of(new_xyz[pending], s)
+        shifts = torch.tensor(list(itertools.product(range(-radius, radius + 1), repeat=cell.shape[1])),
+                              device=device)
+        near = cell[:, None, :] + shifts[None]  # (p, cells, d)
+        valid = ((near >= 0) & (near < grid[s][:, None, :])).all(-1)
+        near_key = base[s][:, None] + (near * stride[s][:, None, :]).sum(-1)
+        first = torch.searchsorted(point_key, near_key)
+        count = torch.where(valid, torch.searchsorted(point_key, near_key, right=True) - first, 0)
+
+        # the box of cells searched, a point outside is at least margin away
+        box_lo = lo[s] + (cell - radius) * size[s, None]
+        box_hi = lo[s] + (cell + radius + 1) * size[s, None]
+        q = new_xyz[pending][:, active]
+        margin = torch.minimum(q - box_lo, box_hi - q)
+        covered = (cell - radius <= 0) & (cell + radius >= grid[s] - 1)
+        margin = torch.where(covered, torch.full_like(margin, float("inf")), margin).amin(1)
+
+        done = torch.zeros(pending.shape[0], dtype=torch.bool, device=device)
+        total = count.sum(1)
+        bounds = torch.cumsum(total, 0)
+        chunk_start = 0
+        while chunk_start < pending.shape[0]:
+            # queries whose candidates fit in a chunk, at least one
+            limit = (int(bounds[chunk_start - 1]) if chunk_start > 0 else 0) + CHUNK_ELEMENTS
+            chunk_end = int(torch.searchsorted(bounds, bounds.new_tensor(limit), right=True))
+            chunk_end = max(chunk_end, chunk_start + 1)
+            chunk = slice(chunk_start, chunk_end)
+            chunk_start = chunk_end
+
+            c_count, c_first = count[chunk].reshape(-1), first[chunk].reshape(-1)
+            num = c_count.sum()
+            pair = torch.repeat_interleave(torch.arange(c_count.shape[0], device=device), c_count)
+            local = torch.arange(int(num), device=device) - (torch.cumsum(c_count, 0) - c_count)[pair]
+            point = order[c_first[pair] + local]
+            query = pair // count.shape[1]  # within the chunk
+            d = ((new_xyz[pending[chunk]][query] - xyz[point]) ** 2).sum(-1)
+
+            # sort by query, then by distance: the bits of a float >= 0 sort like the float
+            key = (query << 32) | d.float().view(torch.int32).long()
+            by_key = torch.argsort(key)
+            query, point, d = query[by_key], point[by_key], d[by_key]
+            found = total[chunk]
+            rank = torch.arange(query.shape[0], device=device) - (torch.cumsum(found, 0) - found)[query]
+            keep = rank < k
+            rows = pending[chunk][query[keep]]
+            idx[rows, rank[keep]] = point[keep].int()
+            dist2[rows, rank[keep]] = d[keep]
+
+            kth = torch.where(found >= k, dist2[pending[chunk], k - 1], torch.full_like(margin[chunk], float("inf")))
+            done[chunk] = (kth <= margin[chunk].clamp(min=0) ** 2) | torch.isinf(margin[chunk])
+        pending = pending[~done]
+        radius *= 2
+    return idx, dist2
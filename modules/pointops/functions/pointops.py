@@ -4,6 +4,13 @@ import torch
 from torch.autograd import Function
 import torch.nn as nn
 
+from . import pointops_cpu
+from .knn_grid import knnquery_grid
+from .subsampling import gridsampling, randomsampling  # alternatives to furthestsampling
+
+# CUDA tensors go to the pointops_cuda kernels, CPU tensors to its OpenMP kernels when
+# the extension was built with them (setup.py), else to the pure PyTorch pointops_cpu.
+# Coordinates are (n, 3), or (n, 2) for drawings handled in the plane (model.coord_dims)
 try:
     import pointops_cuda
 except ImportError:
@@ -13,37 +20,70 @@ except ImportError:
 
     warnings.warn("Unable to load pointops_cuda cpp extension.")
     pointops_cuda_src = os.path.join(os.path.dirname(__file__), "../src")
-    pointops_cuda = load('pointops_cuda', [
-        pointops_cuda_src + '/pointops_api.cpp',
-        pointops_cuda_src + '/knnquery/knnquery_cuda.cpp',
-        pointops_cuda_src + '/knnquery/knnquery_cuda_kernel.cu',
-        pointops_cuda_src + '/interpolation/interpolation_cuda.cpp',
-        pointops_cuda_src + '/interpolation/interpolation_cuda_kernel.cu',
-        pointops_cuda_src + '/sampling/sampling_cuda.cpp',
-        pointops_cuda_src + '/sampling/sampling_cuda_kernel.cu',
-        pointops_cuda_src + '/subtraction/subtraction_cuda.cpp',
-        pointops_cuda_src + '/subtraction/subtraction_cuda_kernel.cu',
-        pointops_cuda_src + '/aggregation/aggregation_cuda.cpp',
-        pointops_cuda_src + '/aggregation/aggregation_cuda_kernel.cu',
-    ], build_directory=pointops_cuda_src, verbose=False)
+    pointops_cuda = None
+    if torch.cuda.is_available():
+        pointops_cuda = load('pointops_cuda', [
+            pointops_cuda_src + '/pointops_api.cpp',
+            pointops_cuda_src + '/knnquery/knnquery_cpu.cpp',
+            pointops_cuda_src + '/sampling/sampling_cpu.cpp',
+            pointops_cuda_src + '/grouping/grouping_cpu.cpp',
+            pointops_cuda_src + '/interpolation/interpolation_cpu.cpp',
+            pointops_cuda_src + '/knnquery/knnquery_cuda.cpp',
+            pointops_cuda_src + '/knnquery/knnquery_cuda_kernel.cu',
+            pointops_cuda_src + '/interpolation/interpolation_cuda.cpp',
+            pointops_cuda_src + '/interpolation/interpolation_cuda_kernel.cu',
+            pointops_cuda_src + '/sampling/sampling_cuda.cpp',
+            pointops_cuda_src + '/sampling/sampling_cuda_kernel.cu',
+            pointops_cuda_src + '/grouping/grouping_cuda.cpp',
+            pointops_cuda_src + '/grouping/grouping_cuda_kernel.cu',
+            pointops_cuda_src + '/subtraction/subtraction_cuda.cpp',
+            pointops_cuda_src + '/subtraction/subtraction_cuda_kernel.cu',
+            pointops_cuda_src + '/aggregation/aggregation_cuda.cpp',
+            pointops_cuda_src + '/aggregation/aggregation_cuda_kernel.cu',
+        ], build_directory=pointops_cuda_src, verbose=False,
+           extra_cflags=['-DWITH_CUDA', '-fopenmp'], extra_ldflags=['-fopenmp'])
+
+
+# knnquery searches a grid over the clouds instead of all their points when one of them
+# has at least this many points, 0 keeps the brute force
+GRID_KNN_MIN_POINTS = 0
+
+
+def set_grid_knn(min_points):
+    global GRID_KNN_MIN_POINTS
+    GRID_KNN_MIN_POINTS = min_points
+
+
+def _native_cpu(*tensors):
+    """Whether the OpenMP kernels of the extension can take these CPU tensors."""
+    return hasattr(pointops_cuda, "knnquery_cpu") and all(t.dtype == torch.float32 for t in tensors)
 
 
 class FurthestSampling(Function):
     @staticmethod
     def forward(ctx, xyz, offset, new_offset):
         """
-        input: xyz: (n, 3), offset: (b), new_offset: (b)
+        input: xyz: (n, 3) or (n, 2), offset: (b), new_offset: (b)
         output: idx: (m)
         """
         assert xyz.is_contiguous()
-        n, b, n_max = xyz.shape[0], offset.shape[0], offset[0]
-        for i in range(1, b):
-            n_max = max(offset[i] - offset[i - 1], n_max)
-        idx = torch.cuda.IntTensor(new_offset[b - 1].item()).zero_()
-        tmp = torch.cuda.FloatTensor(n).fill_(1e10)
+        return _furthestsampling(xyz, offset, new_offset)
+
+
+def _furthestsampling(xyz, offset, new_offset):
+    if not xyz.is_cuda and not _native_cpu(xyz):
+        return pointops_cpu.furthestsampling(xyz, offset, new_offset)
+    n, b, n_max = xyz.shape[0], offset.shape[0], offset[0]
+    for i in range(1, b):
+        n_max = max(offset[i] - offset[i - 1], n_max)
+    idx = xyz.new_zeros(new_offset[b - 1].item(), dtype=torch.int32)
+    tmp = xyz.new_full((n,), 1e10)
+    if xyz.is_cuda:
         pointops_cuda.furthestsampling_cuda(b, n_max, xyz, offset, new_offset, tmp, idx)
-        del tmp
-        return idx
+    else:
+        pointops_cuda.furthestsampling_cpu(b, n_max, xyz, offset.int().contiguous(), new_offset.int().contiguous(), tmp, idx)
+    del tmp
+    return idx
 
 
 furthestsampling = FurthestSampling.apply
@@ -94,16 +134,8 @@ class SectorizedFurthestSampling(Function):
         sector_xyz = xyz[indices].contiguous()
 
         # transform to sectors
-        new_xyz = []
-        n, b, n_max = sector_xyz.shape[0], sector_offset.shape[0], sector_offset[0]
-        for i in range(1, b):
-            n_max = max(sector_offset[i] - sector_offset[i - 1], n_max)
-        idx = torch.cuda.IntTensor(new_sector_offset[b - 1].item()).zero_()
-        tmp = torch.cuda.FloatTensor(n).fill_(1e10)
-        pointops_cuda.furthestsampling_cuda(b, n_max, sector_xyz, sector_offset.int(), new_sector_offset.int(), tmp,
-                                            idx)
+        idx = _furthestsampling(sector_xyz, sector_offset.int(), new_sector_offset.int())
         idx = indices[idx.long()]
-        del tmp
         del sector_xyz
         return idx
 
@@ -115,15 +147,25 @@ class KNNQuery(Function):
     @staticmethod
     def forward(ctx, nsample, xyz, new_xyz, offset, new_offset):
         """
-        input: xyz: (n, 3), new_xyz: (m, 3), offset: (b), new_offset: (b)
+        input: xyz: (n, 3) or (n, 2), new_xyz: (m, 3) or (m, 2), offset: (b), new_offset: (b)
         output: idx: (m, nsample), dist2: (m, nsample)
         """
         if new_xyz is None: new_xyz = xyz
         assert xyz.is_contiguous() and new_xyz.is_contiguous()
+        if GRID_KNN_MIN_POINTS > 0 and torch.diff(offset, prepend=offset.new_zeros(1)).max() >= GRID_KNN_MIN_POINTS:
+            idx, dist2 = knnquery_grid(nsample, xyz, new_xyz, offset, new_offset)
+            return idx, torch.sqrt(dist2)
+        if not xyz.is_cuda and not _native_cpu(xyz, new_xyz):
+            idx, dist2 = pointops_cpu.knnquery(nsample, xyz, new_xyz, offset, new_offset)
+            return idx, torch.sqrt(dist2)
         m = new_xyz.shape[0]
-        idx = torch.cuda.IntTensor(m, nsample).zero_()
-        dist2 = torch.cuda.FloatTensor(m, nsample).zero_()
-        pointops_cuda.knnquery_cuda(m, nsample, xyz, new_xyz, offset, new_offset, idx, dist2)
+        idx = xyz.new_zeros((m, nsample), dtype=torch.int32)
+        dist2 = xyz.new_zeros((m, nsample))
+        if xyz.is_cuda:
+            pointops_cuda.knnquery_cuda(m, nsample, xyz, new_xyz, offset, new_offset, idx, dist2)
+        else:
+            pointops_cuda.knnquery_cpu(m, nsample, xyz, new_xyz, offset.int().contiguous(), new_offset.int().contiguous(),
+                                       idx, dist2)
         return idx, torch.sqrt(dist2)
 
 
@@ -139,8 +181,14 @@ class Grouping(Function):
         """
         assert input.is_contiguous() and idx.is_contiguous()
         m, nsample, n, c = idx.shape[0], idx.shape[1], input.shape[0], input.shape[1]
-        output = torch.cuda.FloatTensor(m, nsample, c)
-        pointops_cuda.grouping_forward_cuda(m, nsample, c, input, idx, output)
+        if input.is_cuda:
+            output = torch.cuda.FloatTensor(m, nsample, c)
+            pointops_cuda.grouping_forward_cuda(m, nsample, c, input, idx, output)
+        elif _native_cpu(input) and idx.dtype == torch.int32:
+            output = input.new_empty(m, nsample, c)
+            pointops_cuda.grouping_forward_cpu(m, nsample, c, input, idx, output)
+        else:
+            output = pointops_cpu.grouping_forward(input, idx)
         ctx.n = n
         ctx.save_for_backward(idx)
         return output
@@ -154,6 +202,12 @@ class Grouping(Function):
         n = ctx.n
         idx, = ctx.saved_tensors
         m, nsample, c = grad_output.shape
+        if not grad_output.is_cuda:
+            if not (_native_cpu(grad_output) and idx.dtype == torch.int32):
+                return pointops_cpu.grouping_backward(grad_output, idx, n), None
+            grad_input = grad_output.new_zeros(n, c)
+            pointops_cuda.grouping_backward_cpu(m, nsample, c, grad_output.contiguous(), idx, grad_input)
+            return grad_input, None
         grad_input = torch.cuda.FloatTensor(n, c).zero_()
         pointops_cuda.grouping_backward_cuda(m, nsample, c, grad_output, idx, grad_input)
         return grad_input, None
@@ -164,8 +218,8 @@ grouping = Grouping.apply
 
 def queryandgroup(nsample, xyz, new_xyz, feat, idx, offset, new_offset, use_xyz=True):
     """
-    input: xyz: (n, 3), new_xyz: (m, 3), feat: (n, c), idx: (m, nsample), offset: (b), new_offset: (b)
-    output: new_feat: (m, c+3, nsample), grouped_idx: (m, nsample)
+    input: xyz: (n, d), new_xyz: (m, d), feat: (n, c), idx: (m, nsample), offset: (b), new_offset: (b), d = 3 or 2
+    output: new_feat: (m, nsample, d+c), grouped_idx: (m, nsample)
     """
     assert xyz.is_contiguous() and new_xyz.is_contiguous() and feat.is_contiguous()
     if new_xyz is None:
@@ -173,15 +227,15 @@ def queryandgroup(nsample, xyz, new_xyz, feat, idx, offset, new_offset, use_xyz=
     if idx is None:
         idx, _ = knnquery(nsample, xyz, new_xyz, offset, new_offset)  # (m, nsample)
 
-    n, m, c = xyz.shape[0], new_xyz.shape[0], feat.shape[1]
-    grouped_xyz = xyz[idx.view(-1).long(), :].view(m, nsample, 3)  # (m, nsample, 3)
-    # grouped_xyz = grouping(xyz, idx) # (m, nsample, 3)
-    grouped_xyz -= new_xyz.unsqueeze(1)  # (m, nsample, 3)
+    n, m, c, d = xyz.shape[0], new_xyz.shape[0], feat.shape[1], xyz.shape[1]
+    grouped_xyz = xyz[idx.view(-1).long(), :].view(m, nsample, d)  # (m, nsample, d)
+    # grouped_xyz = grouping(xyz, idx) # (m, nsample, d)
+    grouped_xyz -= new_xyz.unsqueeze(1)  # (m, nsample, d)
     grouped_feat = feat[idx.view(-1).long(), :].view(m, nsample, c)  # (m, nsample, c)
     # grouped_feat = grouping(feat, idx) # (m, nsample, c)
 
     if use_xyz:
-        return torch.cat((grouped_xyz, grouped_feat), -1),idx.long()  # (m, nsample, 3+c)
+        return torch.cat((grouped_xyz, grouped_feat), -1),idx.long()  # (m, nsample, d+c)
     else:
         return grouped_feat
 
@@ -196,8 +250,11 @@ class Subtraction(Function):
         assert input1.is_contiguous() and input2.is_contiguous()
         n, c = input1.shape;
         nsample = idx.shape[-1]
-        output = torch.cuda.FloatTensor(n, nsample, c).zero_()
-        pointops_cuda.subtraction_forward_cuda(n, nsample, c, input1, input2, idx, output)
+        if input1.is_cuda:
+            output = torch.cuda.FloatTensor(n, nsample, c).zero_()
+            pointops_cuda.subtraction_forward_cuda(n, nsample, c, input1, input2, idx, output)
+        else:
+            output = pointops_cpu.subtraction_forward(input1, input2, idx)
         ctx.save_for_backward(idx)
         return output
 
@@ -209,6 +266,8 @@ class Subtraction(Function):
         """
         idx, = ctx.saved_tensors
         n, nsample, c = grad_output.shape
+        if not grad_output.is_cuda:
+            return (*pointops_cpu.subtraction_backward(idx, grad_output), None)
         grad_input1 = torch.cuda.FloatTensor(n, c).zero_()
         grad_input2 = torch.cuda.FloatTensor(n, c).zero_()
         pointops_cuda.subtraction_backward_cuda(n, nsample, c, idx, grad_output, grad_input1, grad_input2)
@@ -228,8 +287,11 @@ class Aggregation(Function):
         assert input.is_contiguous() and position.is_contiguous() and weight.is_contiguous()
         n, nsample, c = position.shape;
         w_c = weight.shape[-1]
-        output = torch.cuda.FloatTensor(n, c).zero_()
-        pointops_cuda.aggregation_forward_cuda(n, nsample, c, w_c, input, position, weight, idx, output)
+        if input.is_cuda:
+            output = torch.cuda.FloatTensor(n, c).zero_()
+            pointops_cuda.aggregation_forward_cuda(n, nsample, c, w_c, input, position, weight, idx, output)
+        else:
+            output = pointops_cpu.aggregation_forward(input, position, weight, idx)
         ctx.save_for_backward(input, position, weight, idx)
         return output
 
@@ -242,6 +304,8 @@ class Aggregation(Function):
         input, position, weight, idx = ctx.saved_tensors
         n, nsample, c = position.shape;
         w_c = weight.shape[-1]
+        if not grad_output.is_cuda:
+            return (*pointops_cpu.aggregation_backward(input, position, weight, idx, grad_output), None)
         grad_input = torch.cuda.FloatTensor(n, c).zero_()
         grad_position = torch.cuda.FloatTensor(n, nsample, c).zero_()
         grad_weight = torch.cuda.FloatTensor(n, nsample, w_c).zero_()
@@ -276,7 +340,7 @@ def interpolation(xyz, new_xyz, feat, offset, new_offset, k=3):
     norm = torch.sum(dist_recip, dim=1, keepdim=True)
     weight = dist_recip / norm  # (n, 3)
 
-    new_feat = torch.cuda.FloatTensor(new_xyz.shape[0], feat.shape[1]).zero_()
+    new_feat = feat.new_zeros(new_xyz.shape[0], feat.shape[1])
     for i in range(k):
         new_feat += feat[idx[:, i].long(), :] * weight[:, i].unsqueeze(-1)
     return new_feat
@@ -296,8 +360,14 @@ class Interpolation(Function):
         weight = dist_recip / norm  # (n, k)
 
         n, c, m = new_xyz.shape[0], input.shape[1], input.shape[0]
-        output = torch.cuda.FloatTensor(n, c).zero_()
-        pointops_cuda.interpolation_forward_cuda(n, c, k, input, idx, weight, output)
+        if input.is_cuda:
+            output = torch.cuda.FloatTensor(n, c).zero_()
+            pointops_cuda.interpolation_forward_cuda(n, c, k, input, idx, weight, output)
+        elif _native_cpu(input, weight):
+            output = input.new_zeros(n, c)
+            pointops_cuda.interpolation_forward_cpu(n, c, k, input, idx, weight, output)
+        else:
+            output = pointops_cpu.interpolation_forward(input, idx, weight)
         ctx.m, ctx.k = m, k
         ctx.save_for_backward(idx, weight)
         return output
@@ -311,6 +381,12 @@ class Interpolation(Function):
         m, k = ctx.m, ctx.k
         idx, weight = ctx.saved_tensors
         n, c = grad_output.shape
+        if not grad_output.is_cuda:
+            if not _native_cpu(grad_output, weight):
+                return None, None, pointops_cpu.interpolation_backward(grad_output, idx, weight, m), None, None, None
+            grad_input = grad_output.new_zeros(m, c)
+            pointops_cuda.interpolation_backward_cpu(n, c, k, grad_output.contiguous(), idx, weight, grad_input)
+            return None, None, grad_input, None, None, None
         grad_input = torch.cuda.FloatTensor(m, c).zero_()
         pointops_cuda.interpolation_backward_cuda(n, c, k, grad_output, idx, weight, grad_input)
         return None, None, grad_input, None, None, None
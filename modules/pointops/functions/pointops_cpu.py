@@ -0,0 +1,150 @@
+"""Pure PyTorch versions of the pointops_cuda kernels, used for tensors on the CPU.
+
+Every function follows its CUDA kernel: clouds are batched by offsets, indices
+are int32 and a knn query in a cloud with fewer than nsample points is padded
+with the first point of the cloud at a squared distance of 1e10.
+"""
+import torch
+
+# elements of a (queries, points) distance block computed at once
+CHUNK_ELEMENTS = 1 << 24
+
+
+def _segments(offset):
+    offset = offset.long().tolist()
+    return zip([0] + offset[:-1], offset)
+
+
+def furthestsampling(xyz, offset, new_offset):
+    """
+    input: xyz: (n, d), offset: (b), new_offset: (b)
+    output: idx: (m)
+    """
+    starts = [start for start, _ in _segments(offset)]
+    counts = [end - start for start, end in _segments(offset)]
+    new_counts = [end - start for start, end in _segments(new_offset)]
+    b, n_max, m_max = len(counts), max(counts), max(new_counts)
+    # the clouds are padded to n_max and sampled together, padding never gets picked
+    cloud = torch.repeat_interleave(torch.arange(b), torch.tensor(counts))
+    local = torch.arange(xyz.shape[0]) - torch.tensor(starts)[cloud]
+    points = xyz.new_zeros(b, n_max, xyz.shape[1])
+    points[cloud, local] = xyz
+    tmp = xyz.new_full((b, n_max), -1.0)
+    tmp[cloud, local] = 1e10
+    idx = torch.zeros(b, m_max, dtype=torch.long)
+    old = torch.zeros(b, dtype=torch.long)
+    batch = torch.arange(b)
+    for j in range(1, m_max):
+        d = ((points - points[batch, old].unsqueeze(1)) ** 2).sum(-1)
+        tmp = torch.minimum(tmp, d)
+        old = torch.argmax(tmp, dim=1)
+        idx[:, j] = old
+    idx = torch.cat([idx[i, :new_counts[i]] + starts[i] for i in range(b)])
+    return idx.int()
+
+
+def knnquery(nsample, xyz, new_xyz, offset, new_offset):
+    """
+    input: xyz: (n, d), new_xyz: (m, d), offset: (b), new_offset: (b)
+    output: idx: (m, nsample), dist2: (m, nsample)
+    """
+    m = new_xyz.shape[0]
+    idx = torch.empty(m, nsample, dtype=torch.int32)
+    dist2 = new_xyz.new_empty(m, nsample)
+    for (start, end), (new_start, new_end) in zip(_segments(offset), _segments(new_offset)):
+        points, k = xyz[start:end], min(nsample, end - start)
+        # padding of the CUDA kernel
+        idx[new_start:new_end] = start
+        dist2[new_start:new_end] = 1e10
+        step = max(1, CHUNK_ELEMENTS // max(end - start, 1))
+        for i in range(new_start, new_end, step):
+            queries = new_xyz[i:min(i + step, new_end)]
+            d = ((queries.unsqueeze(1) - points.unsqueeze(0)) ** 2).sum(-1)
+            best, best_idx = torch.topk(d, k, dim=1, largest=False, sorted=True)
+            idx[i:i + queries.shape[0], :k] = best_idx.int() + start
+            dist2[i:i + queries.shape[0], :k] = best
+    return idx, dist2
+
+
+def grouping_forward(input, idx):
+    """
+    input: input: (n, c), idx: (m, nsample)
+    output: (m, nsample, c)
+    """
+    return input[idx.long()]
+
+
+def grouping_backward(grad_output, idx, n):
+    """
+    input: grad_output: (m, nsample, c), idx: (m, nsample)
+    output: grad_input: (n, c)
+    """
+    c = grad_output.shape[-1]
+    grad_input = grad_output.new_zeros(n, c)
+    return grad_input.index_add_(0, idx.reshape(-1).long(), grad_output.reshape(-1, c))
+
+
+def subtraction_forward(input1, input2, idx):
+    """
+    input: input1: (n, c), input2: (n, c), idx: (n, nsample)
+    output: (n, nsample, c)
+    """
+    return input1.unsqueeze(1) - input2[idx.long()]
+
+
+def subtraction_backward(idx, grad_output):
+    """
+    input: idx: (n, nsample), grad_output: (n, nsample, c)
+    output: grad_input1: (n, c), grad_input2: (n, c)
+    """
+    n, c = grad_output.shape[0], grad_output.shape[-1]
+    grad_input1 = grad_output.sum(1)
+    grad_input2 = grad_output.new_zeros(n, c).index_add_(0, idx.reshape(-1).long(), -grad_output.reshape(-1, c))
+    return grad_input1, grad_input2
+
+
+def _expand_weight(weight, c):
+    # channel i of the features uses channel i % w_c of the weights
+    return weight[:, :, torch.arange(c) % weight.shape[-1]]
+
+
+def aggregation_forward(input, position, weight, idx):
+    """
+    input: input: (n, c), position: (n, nsample, c), weight: (n, nsample, w_c), idx: (n, nsample)
+    output: (n, c)
+    """
+    c = input.shape[1]
+    return ((input[idx.long()] + position) * _expand_weight(weight, c)).sum(1)
+
+
+def aggregation_backward(input, position, weight, idx, grad_output):
+    """
+    input: grad_output: (n, c)
+    output: grad_input: (n, c), grad_position: (n, nsample, c), grad_weight: (n, nsample, w_c)
+    """
+    n, nsample, c = position.shape
+    w_c = weight.shape[-1]
+    idx = idx.long()
+    grad_position = grad_output.unsqueeze(1) * _expand_weight(weight, c)
+    grad_input = grad_output.new_zeros(input.shape).index_add_(0, idx.reshape(-1), grad_position.reshape(-1, c))
+    grad_weight = grad_output.new_zeros(n, nsample, w_c).index_add_(
+        2, torch.arange(c) % w_c, grad_output.unsqueeze(1) * (input[idx] + position))
+    return grad_input, grad_position, grad_weight
+
+
+def interpolation_forward(input, idx, weight):
+    """
+    input: input: (m, c), idx: (n, k), weight: (n, k)
+    output: (n, c)
+    """
+    return (input[idx.long()] * weight.unsqueeze(-1)).sum(1)
+
+
+def interpolation_backward(grad_output, idx, weight, m):
+    """
+    input: grad_output: (n, c), idx: (n, k), weight: (n, k)
+    output: grad_input: (m, c)
+    """
+    c = grad_output.shape[1]
+    grad = grad_output.unsqueeze(1) * weight.unsqueeze(-1)
+    return grad_output.new_zeros(m, c).index_add_(0, idx.reshape(-1).long(), grad.reshape(-1, c))
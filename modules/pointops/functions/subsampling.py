@@ -0,0 +1,113 @@
+"""Grid and random subsampling, alternatives to furthest point sampling for any device.
+
+Both follow ``furthestsampling``: for clouds batched by ``offset`` they return
+(m) int32 indices into xyz, ``new_offset[i] - new_offset[i - 1]`` of them in
+cloud i, grouped by cloud. The indices of a cloud are sorted.
+
+``gridsampling`` bisects the cell size of a uniform grid over every cloud
+until its points occupy at least as many cells as the cloud keeps, and keeps
+the point closest to the center of each cell. When there are more cells than
+points to keep, the cells are thinned evenly: the cells of a cell twice as
+large take turns, each giving its point closest to the center of the large
+cell first. It is deterministic, and linear in the points per bisection step
+instead of O(n m) like furthest sampling.
+"""
+import torch
+
+from .knn_grid import _segment_bounds
+
+# bisection steps over the cell size, between the extent of a cloud and 1e-5 of it
+GRID_STEPS = 16
+MIN_CELL_RATIO = 1e-5
+
+
+def _segment_ids(offset):
+    counts = torch.diff(offset, prepend=offset.new_zeros(1))
+    return counts, torch.repeat_interleave(torch.arange(offset.shape[0], device=offset.device), counts)
+
+
+def _rank(group, value):
+    """Rank of every element within its group, by increasing value."""
+    _, order = torch.sort(value, stable=True)
+    order = order[torch.sort(group[order], stable=True)[1]]
+    sorted_group = group[order]
+    rank = torch.empty_like(order)
+    rank[order] = torch.arange(order.shape[0], device=order.device) - torch.searchsorted(sorted_group, sorted_group)
+    return rank
+
+
+def _take(seg, priority, new_counts):
+    """The new_counts[i] elements of lowest priority of every segment i, sorted."""
+    keep = _rank(seg, priority) < new_counts[seg]
+    return torch.nonzero(keep).squeeze(1).int()
+
+
+def _cells(xyz, seg, lo, size):
+    """Cell coordinates of every point in the grid of its cloud."""
+    return torch.floor((xyz - lo[seg]) / size[seg, None]).long()
+
+
+def _cell_keys(seg, cell, grid):
+    """Keys of the (cloud, cell) of every point, ordered by cloud, in grids of (b, d) cells per axis."""
+    b = grid.shape[0]
+    stride = torch.cumprod(torch.cat([grid.new_ones(b, 1), grid.flip(1)[:, :-1]], 1), 1).flip(1)
+    base = torch.cumsum(grid.prod(1), 0) - grid.prod(1)
+    return base[seg] + (cell * stride[seg]).sum(1)
+
+
+def gridsampling(xyz, offset, new_offset):
+    """
+    input: xyz: (n, d), offset: (b), new_offset: (b)
+    output: idx: (m)
+    """
+    offset, new_offset = offset.long(), new_offset.long()
+    b = offset.shape[0]
+    counts, seg = _segment_ids(offset)
+    new_counts, _ = _segment_ids(new_offset)
+
+    xyz = xyz.float()
+    lo, hi = _segment_bounds(xyz, offset, counts, seg)
+    clouds = torch.arange(b, device=xyz.device)
+    extent = (hi - lo).amax(1).clamp(min=1e-12)
+
+    # largest cell size in log space whose occupied cells are at least the points to keep
+    log_hi = torch.log(extent) + 1e-3  # a single cell
+    log_lo = torch.log(extent * MIN_CELL_RATIO)
+    for _ in range(GRID_STEPS):
+        log_mid = (log_lo + log_hi) / 2
+        mid = torch.exp(log_mid)
+        # the highest point of a cloud is in its last cell on every axis, floor is monotonic
+        keys, order = torch.sort(_cell_keys(seg, _cells(xyz, seg, lo, mid), _cells(hi, clouds, lo, mid) + 1))
+        new_cell = torch.diff(keys, prepend=keys.new_full((1,), -1)) != 0
+        occupied = torch.bincount(seg[order][new_cell], minlength=b)
+        enough = occupied >= new_counts
+        log_lo = torch.where(enough, log_mid, log_lo)
+        log_hi = torch.where(enough, log_hi, log_mid)
+    size = torch.exp(log_lo)
+
+    # the point closest to the center of its cell first, then cells of the same large cell take turns
+    cell, last = _cells(xyz, seg, lo, size), _cells(hi, clouds, lo, size)
+    cell_keys = _cell_keys(seg, cell, last + 1)
+    center = lo[seg] + (cell + 0.5) * size[seg, None]
+    cell_rank = _rank(cell_keys, ((xyz - center) ** 2).sum(1))
+    parent = torch.div(cell, 2, rounding_mode="floor")
+    parent_keys = _cell_keys(seg, parent, torch.div(last, 2, rounding_mode="floor") + 1)
+    parent_center = lo[seg] + (parent + 0.5) * 2 * size[seg, None]
+    parent_dist = ((xyz - parent_center) ** 2).sum(1)
+    first = cell_rank == 0
+    turn = torch.zeros_like(cell_rank)
+    turn[first] = _rank(parent_keys[first], parent_dist[first])
+    # all first points of the cells, by turn, then the other points
+    priority = torch.where(first, turn, cell_rank + counts.max())
+    return _take(seg, priority, new_counts)
+
+
+def randomsampling(xyz, offset, new_offset):
+    """
+    input: xyz: (n, d), offset: (b), new_offset: (b)
+    output: idx: (m)
+    """
+    offset, new_offset = offset.long(), new_offset.long()
+    _, seg = _segment_ids(offset)
+    new_counts, _ = _segment_ids(new_offset)
+    return _take(seg, torch.rand(seg.shape[0], device=xyz.device), new_counts)
@@ -1,6 +1,8 @@
 #python3 setup.py install
+# builds the CUDA and the CPU kernels, or only the CPU ones when CUDA is absent (FORCE_CUDA=1 to override)
 from setuptools import setup
-from torch.utils.cpp_extension import BuildExtension, CUDAExtension
+import torch
+from torch.utils.cpp_extension import BuildExtension, CppExtension, CUDAExtension, CUDA_HOME
 import os
 from distutils.sysconfig import get_config_vars
 
@@ -9,27 +11,46 @@ os.environ['OPT'] = " ".join(
     flag for flag in opt.split() if flag != '-Wstrict-prototypes'
 )
 
+cpu_sources = [
+    'src/pointops_api.cpp',
+    'src/knnquery/knnquery_cpu.cpp',
+    'src/sampling/sampling_cpu.cpp',
+    'src/grouping/grouping_cpu.cpp',
+    'src/interpolation/interpolation_cpu.cpp',
+]
+cuda_sources = [
+    'src/knnquery/knnquery_cuda.cpp',
+    'src/knnquery/knnquery_cuda_kernel.cu',
+    'src/sampling/sampling_cuda.cpp',
+    'src/sampling/sampling_cuda_kernel.cu',
+    'src/grouping/grouping_cuda.cpp',
+    'src/grouping/grouping_cuda_kernel.cu',
+    'src/interpolation/interpolation_cuda.cpp',
+    'src/interpolation/interpolation_cuda_kernel.cu',
+    'src/subtraction/subtraction_cuda.cpp',
+    'src/subtraction/subtraction_cuda_kernel.cu',
+    'src/aggregation/aggregation_cuda.cpp',
+    'src/aggregation/aggregation_cuda_kernel.cu',
+]
+with_cuda = CUDA_HOME is not None and (torch.cuda.is_available() or os.environ.get('FORCE_CUDA') == '1')
+
+if with_cuda:
+    extension = CUDAExtension(
+        'pointops_cuda', cpu_sources + cuda_sources,
+        define_macros=[('WITH_CUDA', None)],
+        extra_compile_args={'cxx': ['-g', '-O2', '-fopenmp'], 'nvcc': ['-O2']},
+        extra_link_args=['-fopenmp'],
+    )
+else:
+    extension = CppExtension(
+        'pointops_cuda', cpu_sources,
+        extra_compile_args={'cxx': ['-O3', '-fopenmp']},
+        extra_link_args=['-fopenmp'],
+    )
+
 setup(
     name='pointops_cuda',
     author='Hengshuang Zhao',
-    ext_modules=[
-        CUDAExtension('pointops_cuda', [
-            'src/pointops_api.cpp',
-            'src/knnquery/knnquery_cuda.cpp',
-            'src/knnquery/knnquery_cuda_kernel.cu',
-            'src/sampling/sampling_cuda.cpp',
-            'src/sampling/sampling_cuda_kernel.cu',
-            'src/grouping/grouping_cuda.cpp',
-            'src/grouping/grouping_cuda_kernel.cu',
-            'src/interpolation/interpolation_cuda.cpp',
-            'src/interpolation/interpolation_cuda_kernel.cu',
-            'src/subtraction/subtraction_cuda.cpp',
-            'src/subtraction/subtraction_cuda_kernel.cu',
-            'src/aggregation/aggregation_cuda.cpp',
-            'src/aggregation/aggregation_cuda_kernel.cu',
-            ],
-        extra_compile_args={'cxx': ['-g'], 'nvcc': ['-O2']}
-        )
-    ],
+    ext_modules=[extension],
     cmdclass={'build_ext': BuildExtension}
 )
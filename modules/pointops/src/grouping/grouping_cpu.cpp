@@ -0,0 +1,39 @@
+#include <torch/serialize/tensor.h>
+#include "../pointops_cpu.h"
+
+
+void grouping_forward_cpu(int m, int nsample, int c, at::Tensor input_tensor, at::Tensor idx_tensor, at::Tensor output_tensor)
+{
+    // input: input: (n, c), idx: (m, nsample), output: (m, nsample, c)
+    const float *input = input_tensor.data_ptr<float>();
+    const int *idx = idx_tensor.data_ptr<int>();
+    float *output = output_tensor.data_ptr<float>();
+    #pragma omp parallel for schedule(static)
+    for (int64_t i = 0; i < (int64_t)m * nsample; i++)
+    {
+        const float *src = input + (int64_t)idx[i] * c;
+        float *dst = output + i * c;
+        for (int c_idx = 0; c_idx < c; c_idx++)
+            dst[c_idx] = src[c_idx];
+    }
+}
+
+
+void grouping_backward_cpu(int m, int nsample, int c, at::Tensor grad_output_tensor, at::Tensor idx_tensor, at::Tensor grad_input_tensor)
+{
+    // input: grad_output: (m, nsample, c), idx: (m, nsample), output: grad_input: (n, c)
+    const float *grad_output = grad_output_tensor.data_ptr<float>();
+    const int *idx = idx_tensor.data_ptr<int>();
+    float *grad_input = grad_input_tensor.data_ptr<float>();
+    #pragma omp parallel for schedule(static)
+    for (int64_t i = 0; i < (int64_t)m * nsample; i++)
+    {
+        const float *src = grad_output + i * c;
+        float *dst = grad_input + (int64_t)idx[i] * c;
+        for (int c_idx = 0; c_idx < c; c_idx++)
+        {
+            #pragma omp atomic
+            dst[c_idx] += src[c_idx];
+        }
+    }
+}
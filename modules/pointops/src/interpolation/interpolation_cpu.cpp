@@ -0,0 +1,51 @@
+#include <torch/serialize/tensor.h>
+#include "../pointops_cpu.h"
+
+
+void interpolation_forward_cpu(int n, int c, int k, at::Tensor input_tensor, at::Tensor idx_tensor, at::Tensor weight_tensor, at::Tensor output_tensor)
+{
+    // input: input: (m, c), idx: (n, k), weight: (n, k), output: output (n, c)
+    const float *input = input_tensor.data_ptr<float>();
+    const int *idx = idx_tensor.data_ptr<int>();
+    const float *weight = weight_tensor.data_ptr<float>();
+    float *output = output_tensor.data_ptr<float>();
+    #pragma omp parallel for schedule(static)
+    for (int n_idx = 0; n_idx < n; n_idx++)
+    {
+        float *dst = output + (int64_t)n_idx * c;
+        for (int i = 0; i < k; i++)
+        {
+            const int idx_idx = n_idx * k + i;
+            const float *src = input + (int64_t)idx[idx_idx] * c;
+            const float w = weight[idx_idx];
+            for (int c_idx = 0; c_idx < c; c_idx++)
+                dst[c_idx] += src[c_idx] * w;
+        }
+    }
+}
+
+
+void interpolation_backward_cpu(int n, int c, int k, at::Tensor grad_output_tensor, at::Tensor idx_tensor, at::Tensor weight_tensor, at::Tensor grad_input_tensor)
+{
+    // input: grad_output: (n, c), idx: (n, k), weight: (n, k), output: grad_input (m, c)
+    const float *grad_output = grad_output_tensor.data_ptr<float>();
+    const int *idx = idx_tensor.data_ptr<int>();
+    const float *weight = weight_tensor.data_ptr<float>();
+    float *grad_input = grad_input_tensor.data_ptr<float>();
+    #pragma omp parallel for schedule(static)
+    for (int n_idx = 0; n_idx < n; n_idx++)
+    {
+        const float *src = grad_output + (int64_t)n_idx * c;
+        for (int i = 0; i < k; i++)
+        {
+            const int idx_idx = n_idx * k + i;
+            float *dst = grad_input + (int64_t)idx[idx_idx] * c;
+            const float w = weight[idx_idx];
+            for (int c_idx = 0; c_idx < c; c_idx++)
+            {
+                #pragma omp atomic
+                dst[c_idx] += src[c_idx] * w;
+            }
+        }
+    }
+}
@@ -0,0 +1,83 @@
+#include <vector>
+#include <algorithm>
+#include <torch/serialize/tensor.h>
+#include "../pointops_cpu.h"
+
+
+static void reheap(float *dist, int *idx, int k)
+{
+    int root = 0;
+    int child = root * 2 + 1;
+    while (child < k)
+    {
+        if(child + 1 < k && dist[child+1] > dist[child])
+            child++;
+        if(dist[root] > dist[child])
+            return;
+        std::swap(dist[root], dist[child]);
+        std::swap(idx[root], idx[child]);
+        root = child;
+        child = root * 2 + 1;
+    }
+}
+
+
+static void heap_sort(float *dist, int *idx, int k)
+{
+    for (int i = k - 1; i > 0; i--)
+    {
+        std::swap(dist[0], dist[i]);
+        std::swap(idx[0], idx[i]);
+        reheap(dist, idx, i);
+    }
+}
+
+
+void knnquery_cpu(int m, int nsample, at::Tensor xyz_tensor, at::Tensor new_xyz_tensor, at::Tensor offset_tensor, at::Tensor new_offset_tensor, at::Tensor idx_tensor, at::Tensor dist2_tensor)
+{
+    // input: xyz (n, dims) new_xyz (m, dims), dims 3 or 2 (x, y only)
+    // output: idx (m, nsample) dist2 (m, nsample)
+    const float *xyz = xyz_tensor.data_ptr<float>();
+    const float *new_xyz = new_xyz_tensor.data_ptr<float>();
+    const int *offset = offset_tensor.data_ptr<int>();
+    const int *new_offset = new_offset_tensor.data_ptr<int>();
+    const int b = offset_tensor.size(0);
+    const int dims = xyz_tensor.size(1);
+    int *idx = idx_tensor.data_ptr<int>();
+    float *dist2 = dist2_tensor.data_ptr<float>();
+
+    // brute force like the CUDA kernel, one query point per iteration
+    #pragma omp parallel
+    {
+        std::vector<float> best_dist(nsample);
+        std::vector<int> best_idx(nsample);
+        #pragma omp for schedule(static)
+        for (int pt_idx = 0; pt_idx < m; pt_idx++)
+        {
+            const int bt_idx = std::upper_bound(new_offset, new_offset + b, pt_idx) - new_offset;
+            const int start = bt_idx == 0 ? 0 : offset[bt_idx - 1];
+            const int end = offset[bt_idx];
+            const float new_x = new_xyz[pt_idx * dims + 0];
+            const float new_y = new_xyz[pt_idx * dims + 1];
+            const float new_z = dims == 3 ? new_xyz[pt_idx * dims + 2] : 0;
+            std::fill(best_dist.begin(), best_dist.end(), 1e10f);
+            std::fill(best_idx.begin(), best_idx.end(), start);
+            for (int i = start; i < end; i++)
+            {
+                const float x = xyz[i * dims + 0];
+                const float y = xyz[i * dims + 1];
+                const float z = dims == 3 ? xyz[i * dims + 2] : 0;
+                const float d2 = (new_x - x) * (new_x - x) + (new_y - y) * (new_y - y) + (new_z - z) * (new_z - z);
+                if (d2 < best_dist[0])
+                {
+                    best_dist[0] = d2;
+                    best_idx[0] = i;
+                    reheap(best_dist.data(), best_idx.data(), nsample);
+                }
+            }
+            heap_sort(best_dist.data(), best_idx.data(), nsample);
+            std::copy(best_idx.begin(), best_idx.end(), idx + (int64_t)pt_idx * nsample);
+            std::copy(best_dist.begin(), best_dist.end(), dist2 + (int64_t)pt_idx * nsample);
+        }
+    }
+}
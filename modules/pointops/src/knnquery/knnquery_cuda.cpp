@@ -13,5 +13,6 @@ void knnquery_cuda(int m, int nsample, at::Tensor xyz_tensor, at::Tensor new_xyz
     const int *new_offset = new_offset_tensor.data_ptr<int>();
     int *idx = idx_tensor.data_ptr<int>();
     float *dist2 = dist2_tensor.data_ptr<float>();
-    knnquery_cuda_launcher(m, nsample, xyz, new_xyz, offset, new_offset, idx, dist2);
+    const int dims = xyz_tensor.size(1);
+    knnquery_cuda_launcher(m, nsample, dims, xyz, new_xyz, offset, new_offset, idx, dist2);
 }
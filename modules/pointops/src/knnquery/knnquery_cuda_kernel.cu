@@ -62,13 +62,13 @@ __device__ int get_bt_idx(int idx, const int *offset)
 }
 
 
-__global__ void knnquery_cuda_kernel(int m, int nsample, const float *__restrict__ xyz, const float *__restrict__ new_xyz, const int *__restrict__ offset, const int *__restrict__ new_offset, int *__restrict__ idx, float *__restrict__ dist2) {
-    // input: xyz (n, 3) new_xyz (m, 3)
+__global__ void knnquery_cuda_kernel(int m, int nsample, int dims, const float *__restrict__ xyz, const float *__restrict__ new_xyz, const int *__restrict__ offset, const int *__restrict__ new_offset, int *__restrict__ idx, float *__restrict__ dist2) {
+    // input: xyz (n, dims) new_xyz (m, dims), dims 3 or 2 (x, y only)
     // output: idx (m, nsample) dist2 (m, nsample)
     int pt_idx = blockIdx.x * blockDim.x + threadIdx.x;
     if (pt_idx >= m) return;
 
-    new_xyz += pt_idx * 3;
+    new_xyz += pt_idx * dims;
     idx += pt_idx * nsample;
     dist2 += pt_idx * nsample;
     int bt_idx = get_bt_idx(pt_idx, new_offset);
@@ -81,7 +81,7 @@ __global__ void knnquery_cuda_kernel(int m, int nsample, const float *__restrict
 
     float new_x = new_xyz[0];
     float new_y = new_xyz[1];
-    float new_z = new_xyz[2];
+    float new_z = dims == 3 ? new_xyz[2] : 0;
 
     float best_dist[100];
     int best_idx[100];
@@ -90,9 +90,9 @@ __global__ void knnquery_cuda_kernel(int m, int nsample, const float *__restrict
         best_idx[i] = start;
     }
     for(int i = start; i < end; i++){
-        float x = xyz[i * 3 + 0];
-        float y = xyz[i * 3 + 1];
-        float z = xyz[i * 3 + 2];
+        float x = xyz[i * dims + 0];
+        float y = xyz[i * dims + 1];
+        float z = dims == 3 ? xyz[i * dims + 2] : 0;
         float d2 = (new_x - x) * (new_x - x) + (new_y - y) * (new_y - y) + (new_z - z) * (new_z - z);
         if (d2 < best_dist[0]){
             best_dist[0] = d2;
@@ -108,9 +108,9 @@ __global__ void knnquery_cuda_kernel(int m, int nsample, const float *__restrict
 }
 
 
-void knnquery_cuda_launcher(int m, int nsample, const float *xyz, const float *new_xyz, const int *offset, const int *new_offset, int *idx, float *dist2) {
-    // input: new_xyz: (m, 3), xyz: (n, 3), idx: (m, nsample)
+void knnquery_cuda_launcher(int m, int nsample, int dims, const float *xyz, const float *new_xyz, const int *offset, const int *new_offset, int *idx, float *dist2) {
+    // input: new_xyz: (m, dims), xyz: (n, dims), idx: (m, nsample)
     dim3 blocks(DIVUP(m, THREADS_PER_BLOCK));
     dim3 threads(THREADS_PER_BLOCK);
-    knnquery_cuda_kernel<<<blocks, threads, 0>>>(m, nsample, xyz, new_xyz, offset, new_offset, idx, dist2);
+    knnquery_cuda_kernel<<<blocks, threads, 0>>>(m, nsample, dims, xyz, new_xyz, offset, new_offset, idx, dist2);
 }
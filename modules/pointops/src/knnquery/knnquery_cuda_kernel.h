@@ -10,7 +10,7 @@ void knnquery_cuda(int m, int nsample, at::Tensor xyz_tensor, at::Tensor new_xyz
 extern "C" {
 #endif
 
-void knnquery_cuda_launcher(int m, int nsample, const float *xyz, const float *new_xyz, const int *offset, const int *new_offset, int *idx, float *dist2);
+void knnquery_cuda_launcher(int m, int nsample, int dims, const float *xyz, const float *new_xyz, const int *offset, const int *new_offset, int *idx, float *dist2);
 
 #ifdef __cplusplus
 }
@@ -1,15 +1,19 @@
 #include <torch/serialize/tensor.h>
 #include <torch/extension.h>
 
+#include "pointops_cpu.h"
+#ifdef WITH_CUDA
 #include "knnquery/knnquery_cuda_kernel.h"
 #include "sampling/sampling_cuda_kernel.h"
 #include "grouping/grouping_cuda_kernel.h"
 #include "interpolation/interpolation_cuda_kernel.h"
 #include "aggregation/aggregation_cuda_kernel.h"
 #include "subtraction/subtraction_cuda_kernel.h"
+#endif
 
 
 PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
+#ifdef WITH_CUDA
     m.def("knnquery_cuda", &knnquery_cuda, "knnquery_cuda");
     m.def("furthestsampling_cuda", &furthestsampling_cuda, "furthestsampling_cuda");
     m.def("grouping_forward_cuda", &grouping_forward_cuda, "grouping_forward_cuda");
@@ -20,4 +24,11 @@ PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
     m.def("subtraction_backward_cuda", &subtraction_backward_cuda, "subtraction_backward_cuda");
     m.def("aggregation_forward_cuda", &aggregation_forward_cuda, "aggregation_forward_cuda");
     m.def("aggregation_backward_cuda", &aggregation_backward_cuda, "aggregation_backward_cuda");
+#endif
+    m.def("knnquery_cpu", &knnquery_cpu, "knnquery_cpu");
+    m.def("furthestsampling_cpu", &furthestsampling_cpu, "furthestsampling_cpu");
+    m.def("grouping_forward_cpu", &grouping_forward_cpu, "grouping_forward_cpu");
+    m.def("grouping_backward_cpu", &grouping_backward_cpu, "grouping_backward_cpu");
+    m.def("interpolation_forward_cpu", &interpolation_forward_cpu, "interpolation_forward_cpu");
+    m.def("interpolation_backward_cpu", &interpolation_backward_cpu, "interpolation_backward_cpu");
 }
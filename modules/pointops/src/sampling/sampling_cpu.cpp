@@ -0,0 +1,52 @@
+#include <torch/serialize/tensor.h>
+#include "../pointops_cpu.h"
+
+
+void furthestsampling_cpu(int b, int n, at::Tensor xyz_tensor, at::Tensor offset_tensor, at::Tensor new_offset_tensor, at::Tensor tmp_tensor, at::Tensor idx_tensor)
+{
+    // input xyz: (n, dims), dims 3 or 2 (x, y only), tmp: (n)
+    // ouput idx (m)
+    const float *xyz = xyz_tensor.data_ptr<float>();
+    const int *offset = offset_tensor.data_ptr<int>();
+    const int *new_offset = new_offset_tensor.data_ptr<int>();
+    float *tmp = tmp_tensor.data_ptr<float>();
+    int *idx = idx_tensor.data_ptr<int>();
+    const int dims = xyz_tensor.size(1);
+
+    // the samples of a cloud depend on each other, the clouds are sampled in parallel
+    #pragma omp parallel for schedule(dynamic, 1) if (b > 1)
+    for (int bid = 0; bid < b; bid++)
+    {
+        const int start_n = bid == 0 ? 0 : offset[bid - 1];
+        const int end_n = offset[bid];
+        const int start_m = bid == 0 ? 0 : new_offset[bid - 1];
+        const int end_m = new_offset[bid];
+        if (start_m >= end_m) continue;
+        int old = start_n;
+        idx[start_m] = start_n;
+        for (int j = start_m + 1; j < end_m; j++)
+        {
+            const float x1 = xyz[old * dims + 0];
+            const float y1 = xyz[old * dims + 1];
+            const float z1 = dims == 3 ? xyz[old * dims + 2] : 0;
+            int besti = start_n;
+            float best = -1;
+            for (int k = start_n; k < end_n; k++)
+            {
+                const float x2 = xyz[k * dims + 0];
+                const float y2 = xyz[k * dims + 1];
+                const float z2 = dims == 3 ? xyz[k * dims + 2] : 0;
+                const float d = (x2 - x1) * (x2 - x1) + (y2 - y1) * (y2 - y1) + (z2 - z1) * (z2 - z1);
+                const float d2 = d < tmp[k] ? d : tmp[k];
+                tmp[k] = d2;
+                if (d2 > best)
+                {
+                    best = d2;
+                    besti = k;
+                }
+            }
+            old = besti;
+            idx[j] = old;
+        }
+    }
+}
@@ -12,5 +12,6 @@ void furthestsampling_cuda(int b, int n, at::Tensor xyz_tensor, at::Tensor offse
     const int *new_offset = new_offset_tensor.data_ptr<int>();
     float *tmp = tmp_tensor.data_ptr<float>();
     int *idx = idx_tensor.data_ptr<int>();
-    furthestsampling_cuda_launcher(b, n, xyz, offset, new_offset, tmp, idx);
+    const int dims = xyz_tensor.size(1);
+    furthestsampling_cuda_launcher(b, n, dims, xyz, offset, new_offset, tmp, idx);
 }
@@ -9,10 +9,10 @@ __device__ void __update(float *dists, int *dists_i, int idx1, int idx2) {
     dists_i[idx1] = v2 > v1 ? i2 : i1;
 }
 
-// input xyz: (n, 3), tmp: (b, n_max)
+// input xyz: (n, dims), dims 3 or 2 (x, y only), tmp: (b, n_max)
 // ouput idx (m)
 template <unsigned int block_size>
-__global__ void furthestsampling_cuda_kernel(const float *xyz, const int *offset, const int *new_offset, float *tmp, int *idx)
+__global__ void furthestsampling_cuda_kernel(int dims, const float *xyz, const int *offset, const int *new_offset, float *tmp, int *idx)
 {
     __shared__ float dists[block_size];
     __shared__ int dists_i[block_size];
@@ -43,14 +43,14 @@ __global__ void furthestsampling_cuda_kernel(const float *xyz, const int *offset
     {
         int besti = start_n;
         float best = -1;
-        float x1 = xyz[old * 3 + 0];
-        float y1 = xyz[old * 3 + 1];
-        float z1 = xyz[old * 3 + 2];
+        float x1 = xyz[old * dims + 0];
+        float y1 = xyz[old * dims + 1];
+        float z1 = dims == 3 ? xyz[old * dims + 2] : 0;
         for (int k = start_n + tid; k < end_n; k += stride)
         {
-            float x2 = xyz[k * 3 + 0];
-            float y2 = xyz[k * 3 + 1];
-            float z2 = xyz[k * 3 + 2];
+            float x2 = xyz[k * dims + 0];
+            float y2 = xyz[k * dims + 1];
+            float z2 = dims == 3 ? xyz[k * dims + 2] : 0;
             float d = (x2 - x1) * (x2 - x1) + (y2 - y1) * (y2 - y1) + (z2 - z1) * (z2 - z1);
             float d2 = min(d, tmp[k]);
             tmp[k] = d2;
@@ -128,44 +128,44 @@ __global__ void furthestsampling_cuda_kernel(const float *xyz, const int *offset
     }
 }
 
-void furthestsampling_cuda_launcher(int b, int n, const float *xyz, const int *offset, const int *new_offset, float *tmp, int *idx)
+void furthestsampling_cuda_launcher(int b, int n, int dims, const float *xyz, const int *offset, const int *new_offset, float *tmp, int *idx)
 {   
 	unsigned int n_threads = opt_n_threads(n);
 	switch (n_threads) {
         case 1024:
-            furthestsampling_cuda_kernel<1024><<<b, n_threads, 0>>>(xyz, offset, new_offset, tmp, idx);
+            furthestsampling_cuda_kernel<1024><<<b, n_threads, 0>>>(dims, xyz, offset, new_offset, tmp, idx);
             break;
         case 512:
-            furthestsampling_cuda_kernel<512><<<b, n_threads, 0>>>(xyz, offset, new_offset, tmp, idx);
+            furthestsampling_cuda_kernel<512><<<b, n_threads, 0>>>(dims, xyz, offset, new_offset, tmp, idx);
             break;
         case 256:
-            furthestsampling_cuda_kernel<256><<<b, n_threads, 0>>>(xyz, offset, new_offset, tmp, idx);
+            furthestsampling_cuda_kernel<256><<<b, n_threads, 0>>>(dims, xyz, offset, new_offset, tmp, idx);
             break;
         case 128:
-            furthestsampling_cuda_kernel<128><<<b, n_threads, 0>>>(xyz, offset, new_offset, tmp, idx);
+            furthestsampling_cuda_kernel<128><<<b, n_threads, 0>>>(dims, xyz, offset, new_offset, tmp, idx);
             break;
         case 64:
-            furthestsampling_cuda_kernel<64><<<b, n_threads, 0>>>(xyz, offset, new_offset, tmp, idx);
+            furthestsampling_cuda_kernel<64><<<b, n_threads, 0>>>(dims, xyz, offset, new_offset, tmp, idx);
             break;
         case 32:
-            furthestsampling_cuda_kernel<32><<<b, n_threads, 0>>>(xyz, offset, new_offset, tmp, idx);
+            furthestsampling_cuda_kernel<32><<<b, n_threads, 0>>>(dims, xyz, offset, new_offset, tmp, idx);
             break;
         case 16:
-            furthestsampling_cuda_kernel<16><<<b, n_threads, 0>>>(xyz, offset, new_offset, tmp, idx);
+            furthestsampling_cuda_kernel<16><<<b, n_threads, 0>>>(dims, xyz, offset, new_offset, tmp, idx);
             break;
         case 8:
-            furthestsampling_cuda_kernel<8><<<b, n_threads, 0>>>(xyz, offset, new_offset, tmp, idx);
+            furthestsampling_cuda_kernel<8><<<b, n_threads, 0>>>(dims, xyz, offset, new_offset, tmp, idx);
             break;
         case 4:
-            furthestsampling_cuda_kernel<4><<<b, n_threads, 0>>>(xyz, offset, new_offset, tmp, idx);
+            furthestsampling_cuda_kernel<4><<<b, n_threads, 0>>>(dims, xyz, offset, new_offset, tmp, idx);
             break;
         case 2:
-            furthestsampling_cuda_kernel<2><<<b, n_threads, 0>>>(xyz, offset, new_offset, tmp, idx);
+            furthestsampling_cuda_kernel<2><<<b, n_threads, 0>>>(dims, xyz, offset, new_offset, tmp, idx);
             break;
         case 1:
-            furthestsampling_cuda_kernel<1><<<b, n_threads, 0>>>(xyz, offset, new_offset, tmp, idx);
+            furthestsampling_cuda_kernel<1><<<b, n_threads, 0>>>(dims, xyz, offset, new_offset, tmp, idx);
             break;
         default:
-            furthestsampling_cuda_kernel<512><<<b, n_threads, 0>>>(xyz, offset, new_offset, tmp, idx);
+            furthestsampling_cuda_kernel<512><<<b, n_threads, 0>>>(dims, xyz, offset, new_offset, tmp, idx);
     }
 }
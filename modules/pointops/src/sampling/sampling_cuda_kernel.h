@@ -10,7 +10,7 @@ void furthestsampling_cuda(int b, int n, at::Tensor xyz_tensor, at::Tensor offse
 extern "C" {
 #endif
 
-void furthestsampling_cuda_launcher(int b, int n, const float *xyz, const int *offset, const int *new_offset, float *tmp, int *idx);
+void furthestsampling_cuda_launcher(int b, int n, int dims, const float *xyz, const int *offset, const int *new_offset, float *tmp, int *idx);
 
 #ifdef __cplusplus
 }
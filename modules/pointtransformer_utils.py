@@ -5,7 +5,7 @@ from modules.pointops.functions import pointops
 
 
 class PointTransformerLayer(nn.Module):
-    def __init__(self, in_planes, out_planes, share_planes=8, nsample=16):
+    def __init__(self, in_planes, out_planes, share_planes=8, nsample=16, coord_dims=3):
         super().__init__()
         self.mid_planes = mid_planes = out_planes // 1
         self.out_planes = out_planes
@@ -14,7 +14,7 @@ class PointTransformerLayer(nn.Module):
         self.linear_q = nn.Linear(in_planes, mid_planes)
         self.linear_k = nn.Linear(in_planes, mid_planes)
         self.linear_v = nn.Linear(in_planes, out_planes)
-        self.linear_p = nn.Sequential(nn.Linear(3, 3), nn.BatchNorm1d(3), nn.ReLU(inplace=True),
+        self.linear_p = nn.Sequential(nn.Linear(coord_dims, 3), nn.BatchNorm1d(3), nn.ReLU(inplace=True),
                                       nn.Linear(3, out_planes))
         self.linear_w = nn.Sequential(nn.BatchNorm1d(mid_planes), nn.ReLU(inplace=True),
                                       nn.Linear(mid_planes, mid_planes // share_planes),
@@ -23,11 +23,12 @@ class PointTransformerLayer(nn.Module):
         self.softmax = nn.Softmax(dim=1)
 
     def forward(self, pxo) -> torch.Tensor:
-        p, x, o,knn_idx = pxo  # (n, 3), (n, c), (b)
+        p, x, o,knn_idx = pxo  # (n, d), (n, c), (b), d = 3 or 2 coordinates
         x_q, x_k, x_v = self.linear_q(x), self.linear_k(x), self.linear_v(x)  # (n, c)
-        x_k, knn_idx = pointops.queryandgroup(self.nsample, p, p, x_k, knn_idx, o, o, use_xyz=True)  # (n, nsample, 3+c)
+        x_k, knn_idx = pointops.queryandgroup(self.nsample, p, p, x_k, knn_idx, o, o, use_xyz=True)  # (n, nsample, d+c)
         x_v = pointops.queryandgroup(self.nsample, p, p, x_v, knn_idx, o, o, use_xyz=False)  # (n, nsample, c)
-        p_r, x_k = x_k[:, :, 0:3], x_k[:, :, 3:]
+        d = p.shape[1]
+        p_r, x_k = x_k[:, :, 0:d], x_k[:, :, d:]
         for i, layer in enumerate(self.linear_p):
             # (n, nsample, c)
             p_r = layer(p_r.transpose(1, 2).contiguous()).transpose(1, 2).contiguous() if i == 1 else layer(p_r)
@@ -44,11 +45,17 @@ class PointTransformerLayer(nn.Module):
 
 
 class TransitionDown(nn.Module):
-    def __init__(self, in_planes, out_planes, stride=1, nsample=16, num_sector=1):
+    # sampling of the points kept by a strided TransitionDown: furthest points (sectorized
+    # when training with num_sector > 1), grid subsampling or random (grid in eval, so that
+    # evaluation does not depend on the global RNG)
+    SAMPLINGS = ("fps", "grid", "random")
+
+    def __init__(self, in_planes, out_planes, stride=1, nsample=16, num_sector=1, coord_dims=3, sampling="fps"):
         super().__init__()
-        self.stride, self.nsample, self.num_sector = stride, nsample, num_sector
+        assert sampling in self.SAMPLINGS, f"sampling must be one of {self.SAMPLINGS}, got {sampling}"
+        self.stride, self.nsample, self.num_sector, self.sampling = stride, nsample, num_sector, sampling
         if stride != 1:
-            self.linear = nn.Linear(3 + in_planes, out_planes, bias=False)
+            self.linear = nn.Linear(coord_dims + in_planes, out_planes, bias=False)
             self.pool = nn.MaxPool1d(nsample)
         else:
             self.linear = nn.Linear(in_planes, out_planes, bias=False)
@@ -56,19 +63,26 @@ class TransitionDown(nn.Module):
         self.relu = nn.ReLU(inplace=True)
 
     def forward(self, pxo):
-        p, x, o = pxo  # (n, 3), (n, c), (b)
+        p, x, o = pxo  # (n, d), (n, c), (b)
         if self.stride != 1:
-            n_o, count = [o[0].item() // self.stride], o[0].item() // self.stride
+            # every cloud keeps at least one point, small unpadded clouds would otherwise vanish
+            n_o, count = [max(o[0].item() // self.stride, 1)], max(o[0].item() // self.stride, 1)
             for i in range(1, o.shape[0]):
-                count += (o[i].item() - o[i - 1].item()) // self.stride
+                count += max((o[i].item() - o[i - 1].item()) // self.stride, 1)
                 n_o.append(count)
-            n_o = torch.cuda.IntTensor(n_o)
-            if self.num_sector > 1 and self.training:
+            n_o = torch.tensor(n_o, dtype=torch.int32, device=o.device)
+            if self.sampling == "grid":
+                idx = pointops.gridsampling(p, o, n_o)  # [M]
+            elif self.sampling == "random" and not self.training:
+                idx = pointops.gridsampling(p, o, n_o)  # [M]
+            elif self.sampling == "random":
+                idx = pointops.randomsampling(p, o, n_o)  # [M]
+            elif self.num_sector > 1 and self.training:
                 idx = pointops.sectorized_fps(p, o, n_o, self.num_sector)  # [M]
             else:
                 idx = pointops.furthestsampling(p, o, n_o)  # [M]
-            n_p = p[idx.long(), :]  # (m, 3)
-            x, _ = pointops.queryandgroup(self.nsample, p, n_p, x, None, o, n_o, use_xyz=True)  # (m, 3+c, nsample)
+            n_p = p[idx.long(), :]  # (m, d)
+            x, _ = pointops.queryandgroup(self.nsample, p, n_p, x, None, o, n_o, use_xyz=True)  # (m, nsample, d+c)
             x = self.relu(self.bn(self.linear(x).transpose(1, 2).contiguous()))  # (m, c, nsample)
             x = self.pool(x).squeeze(-1)  # (m, c)
             p, o = n_p, n_o
@@ -115,11 +129,11 @@ class TransitionUp(nn.Module):
 class PointTransformerBlock(nn.Module):
     expansion = 1
 
-    def __init__(self, in_planes, planes, share_planes=8, nsample=16):
+    def __init__(self, in_planes, planes, share_planes=8, nsample=16, coord_dims=3):
         super(PointTransformerBlock, self).__init__()
         self.linear1 = nn.Linear(in_planes, planes, bias=False)
         self.bn1 = nn.BatchNorm1d(planes)
-        self.transformer2 = PointTransformerLayer(planes, planes, share_planes, nsample)
+        self.transformer2 = PointTransformerLayer(planes, planes, share_planes, nsample, coord_dims)
         self.bn2 = nn.BatchNorm1d(planes)
         self.linear3 = nn.Linear(planes, planes * self.expansion, bias=False)
         self.bn3 = nn.BatchNorm1d(planes * self.expansion)
@@ -0,0 +1,28 @@
+"""Pack the parsed drawings of a split into a few large shard files."""
+import os
+import argparse
+
+from svgnet.data.shards import pack_shards
+
+def parse_args():
+    '''
+    Arguments
+    '''
+    parser = argparse.ArgumentParser(description='')
+    parser.add_argument('--split', type=str, default="test",
+                        help='the split of dataset')
+    parser.add_argument('--data_dir', type=str, default=None,
+                        help='parsed drawings, ./dataset/<split>/npz by default')
+    parser.add_argument('--out_dir', type=str, default=None,
+                        help='shards and their index, ./dataset/<split>/shards by default')
+    parser.add_argument('--shard_mb', type=int, default=1024,
+                        help='approximate size of a shard in MB')
+    args = parser.parse_args()
+    return args
+
+if __name__ == "__main__":
+    args = parse_args()
+    data_dir = args.data_dir or os.path.join("./dataset/", args.split, "npz")
+    out_dir = args.out_dir or os.path.join("./dataset/", args.split, "shards")
+    num_drawings, num_shards = pack_shards(data_dir, out_dir, args.shard_mb << 20)
+    print(f"{num_drawings} drawings packed into {num_shards} shards in {out_dir}")
@@ -1,16 +1,26 @@
 
 import math,re
 import os,glob,json
+import traceback
+import bisect
+from multiprocessing import Pool
+from tqdm import tqdm
 # import xml.etree.ElementTree as ET
 from lxml import etree as ET
-from svgpathtools import parse_path
-from collections import defaultdict
+from svgpathtools import parse_path, Line, Arc
 import numpy as np
+from svgnet.data import geometry
+from svgnet.data.drawing_io import DRAWING_FORMATS, drawing_neighbors, save_drawing
+from svgnet.data.manifest import MANIFEST_NAME, Manifest, file_hash
+from preprocess_svg import convert_poly
+from svgnet.data.svg_tree import iter_primitives, iterparse_primitives, read_root
 #from sklearn.metrics.pairwise import euclidean_distances
 
 LABEL_NUM = 35
 COMMANDS = ['Line', 'Arc','circle', 'ellipse']
-import mmcv, argparse
+# bump when the parsed output changes, the next run re-parses every svg
+PARSER_VERSION = 3
+import argparse
 
 def parse_args():
     '''
@@ -21,7 +31,19 @@ def parse_args():
                         help='the split of dataset')
     parser.add_argument('--data_dir', type=str, default="./dataset/test/test/svg_gt",
                         help='save the downloaded data')
+    parser.add_argument('--format', type=str, default="npz", choices=list(DRAWING_FORMATS),
+                        help='output format, npz is a compact binary format read without json decoding')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of parallel parse processes')
+    parser.add_argument('--overwrite', action='store_true',
+                        help='re-parse svgs already parsed from the same content, see the split manifest')
+    parser.add_argument('--stream', action='store_true',
+                        help='parse incrementally with bounded memory, for very large svgs')
+    parser.add_argument('--svg_out', type=str, default=None,
+                        help='also write the svgs with polylines/polygons converted to paths, like preprocess_svg.py')
     args = parser.parse_args()
+    if args.stream and args.svg_out:
+        parser.error('--svg_out needs the whole tree and cannot be used with --stream')
     return args
 
 def parse_stroke(elem, root):
@@ -61,127 +83,144 @@ def parse_width(elem, root):
     
     return "0.9"
 
-def parse_svg(svg_file):
-    tree = ET.parse(svg_file)
-    root = tree.getroot()
+def parse_labels(elem):
+    semanticId = int(elem.attrib['semanticId']) - 1 if 'semanticId' in elem.attrib else LABEL_NUM
+    instanceId = int(elem.attrib['instanceId']) if 'instanceId' in elem.attrib else -1
+    return semanticId, instanceId
+
+def parse_points(points):
+    """Vertices of a polyline/polygon points attribute."""
+    nums = list(map(float, points.strip().replace(',', ' ').split()))
+    return list(zip(nums[::2], nums[1::2]))
+
+def measure_primitives(num, segments, fallbacks, circles, ellipses):
+    """Lengths and 4 sample points of every primitive, computed in vectorized batches.
+
+    segments: (row, start, end, is_arc, radius, rotation, large_arc, sweep) of every
+    Line/Arc segment of the paths, in path order; fallbacks: (row, length, arg) of paths
+    measured by svgpathtools; circles: (row, cx, cy, r); ellipses: (row, cx, cy, rx, ry)
+    """
+    lengths = np.zeros(num)
+    points = np.zeros((num, 4, 2))
+    if segments:
+        rows, start, end, is_arc, radius, rotation, large_arc, sweep = map(np.array, zip(*segments))
+        path_rows, path_idx = np.unique(rows, return_inverse=True)
+        path_lengths, path_points = geometry.path_samples(
+            start, end, is_arc, radius, rotation, large_arc, sweep, path_idx.reshape(-1), len(path_rows))
+        lengths[path_rows], points[path_rows] = path_lengths, path_points
+    if fallbacks:
+        rows, path_lengths, path_args = zip(*fallbacks)
+        lengths[list(rows)], points[list(rows)] = path_lengths, np.array(path_args).reshape(-1, 4, 2)
+    if circles:
+        rows, cx, cy, r = map(np.array, zip(*circles))
+        lengths[rows], points[rows] = geometry.circle_samples(np.stack([cx, cy], 1), r)
+    if ellipses:
+        rows, cx, cy, rx, ry = map(np.array, zip(*ellipses))
+        lengths[rows], points[rows] = geometry.ellipse_samples(np.stack([cx, cy], 1), rx, ry)
+    return lengths, points
+
+def parse_svg(svg_file, stream=False, svg_out=None):
+    """Parses the primitives of an svg into a drawing dict.
+
+    polyline/polygon elements are read as Line paths, like the <path> preprocess_svg
+    turns them into, so raw svgs can be parsed directly. primIds index the elements
+    of the converted svg, the output of preprocess_svg, which is written to svg_out
+    when given.
+    """
+    if stream:
+        # bounded memory for very large files, elements are freed as soon as parsed
+        root = read_root(svg_file)
+        primitives = iterparse_primitives(svg_file)
+    else:
+        tree = ET.parse(svg_file)
+        root = tree.getroot()
+        primitives = iter_primitives(root)
     ns = root.tag[:-3]
     minx, miny, width, height = [int(float(x)) for x in root.attrib['viewBox'].split(' ')]
     
     commands = []
-    args = [] # (x1,y1,x2,y2,x3,y3,x4,y4) 4points
-    lengths = []
     semanticIds = []
     instanceIds = []
     strokes = []
     layerIds = []
     widths = []
-    inst_infos = defaultdict(list)
-    id = 0
-    for g in root.iter(ns + 'g'):
-        # path
-        id +=1
-        for path in g.iter(ns + 'path'):
+    primIds = []
+    # geometry is gathered here and measured in one vectorized pass at the end
+    segments, fallbacks, circles, ellipses = [], [], [], []
+    path_tag, circle_tag = ns + 'path', ns + 'circle'
+    poly_tags = (ns + 'polyline', ns + 'polygon')
+    polys, dropped = [], []  # polyline/polygon elements, prim_idx of those without length
+    # single pass in document order, every primitive is visited once even in nested <g>
+    for prim_idx, elem, g, layer_id in primitives:
+        row = len(commands)
+        if elem.tag == path_tag:
             try:
-                path_repre = parse_path(path.attrib['d'])
+                path_repre = parse_path(elem.attrib['d'])
             except Exception as e:
-                raise RuntimeError("Parse path failed!{}, {}".format(svg_file, path.attrib['d']))
+                raise RuntimeError("Parse path failed!{}, {}".format(svg_file, elem.attrib['d']))
             
             try:
                 path_type = path_repre[0].__class__.__name__
                 assert path_type in COMMANDS
             except (IndexError, AssertionError):
-                print(f"Strange Element {path}")
+                print(f"Strange Element {elem}")
                 continue
+            if all(isinstance(seg, (Line, Arc)) for seg in path_repre):
+                for seg in path_repre:
+                    if isinstance(seg, Arc):
+                        segments.append((row, (seg.start.real, seg.start.imag), (seg.end.real, seg.end.imag), True,
+                                         (seg.radius.real, seg.radius.imag), seg.rotation, seg.large_arc, seg.sweep))
+                    else:
+                        segments.append((row, (seg.start.real, seg.start.imag), (seg.end.real, seg.end.imag), False,
+                                         (0, 0), 0, False, False))
+            else:
+                # bezier segments are left to svgpathtools
+                arg = []
+                for ind in geometry.SAMPLE_TS:
+                    point = path_repre.point(ind)
+                    arg.extend([point.real,point.imag])
+                fallbacks.append((row, path_repre.length(), arg))
             commands.append(COMMANDS.index(path_type))
-            length = path_repre.length()
-            lengths.append(length)
-            layerIds.append(id)
-            semanticId = int(path.attrib['semanticId']) - 1 if 'semanticId' in path.attrib else LABEL_NUM
-            instanceId = int(path.attrib['instanceId']) if 'instanceId' in path.attrib else -1
-            semanticIds.append(semanticId)
-            instanceIds.append(instanceId)
-            rgb = parse_stroke(path, g)
-            strokes.append(rgb)
-            widths.extend([float(parse_width(path, g))])
-            inds = [0, 1/3, 2/3, 1.0]
-            arg = []
-            for ind in inds:
-                point = path_repre.point(ind)
-                arg.extend([point.real,point.imag])
-            args.append(arg)
-            inst_infos[(instanceId,semanticId)].extend(arg)
-            
-        
-        # circle
-        for circle in g.iter(ns + 'circle'):
-             
-            cx = float(circle.attrib['cx'])
-            cy = float(circle.attrib['cy'])
-            r = float(circle.attrib['r'])
-            semanticId = int(circle.attrib['semanticId']) - 1 if 'semanticId' in circle.attrib else LABEL_NUM
-            instanceId = int(circle.attrib['instanceId']) if 'instanceId' in circle.attrib else -1
-            circle_len = 2 * math.pi * r
-            lengths.append(circle_len)
-            semanticIds.append(semanticId)
-            instanceIds.append(instanceId)
+        elif elem.tag in poly_tags:
+            if svg_out is not None:
+                polys.append(elem)
+            if not elem.get('points'):
+                continue
+            coords = parse_points(elem.get('points'))
+            if len(set(coords)) <= 1:
+                dropped.append(prim_idx)
+                continue
+            if elem.tag == poly_tags[1] and coords[-1] != coords[0]:
+                coords.append(coords[0])
+            for start, end in zip(coords[:-1], coords[1:]):
+                segments.append((row, start, end, False, (0, 0), 0, False, False))
+            commands.append(COMMANDS.index('Line'))
+        elif elem.tag == circle_tag:
+            circles.append((row, float(elem.attrib['cx']), float(elem.attrib['cy']),
+                            float(elem.attrib['r'])))
             commands.append(COMMANDS.index("circle"))
-            layerIds.append(id)
-            rgb = parse_stroke(circle, g)
-            strokes.append(rgb)
-            widths.extend([float(parse_width(circle, g))])
-            thetas = [0,math.pi/2, math.pi, 3 * math.pi/2,]
-            arg = []
-            for theta in thetas:
-                x, y = cx + r * math.cos(theta), cy + r * math.sin(theta)
-                arg.extend([x,y])
-            args.append(arg)
-            inst_infos[(instanceId,semanticId)].extend(arg)
-               
-        # ellipse
-        for ellipse in g.iter(ns + 'ellipse'):
-            cx = float(ellipse.attrib['cx'])
-            cy = float(ellipse.attrib['cy'])
-            rx = float(ellipse.attrib['rx'])
-            ry = float(ellipse.attrib['ry'])
-            
-            semanticId = int(ellipse.attrib['semanticId']) - 1 if 'semanticId' in ellipse.attrib else LABEL_NUM
-            instanceId = int(ellipse.attrib['instanceId']) if 'instanceId' in ellipse.attrib else -1
-            if rx>ry: 
-                a,b = rx, ry
-            else:
-                a,b = ry, rx
-            ellipse_len = 2* math.pi *b + 4*(a - b)
-            lengths.append(ellipse_len)
+        else:
+            ellipses.append((row, float(elem.attrib['cx']), float(elem.attrib['cy']),
+                             float(elem.attrib['rx']), float(elem.attrib['ry'])))
             commands.append(COMMANDS.index("ellipse"))
-            semanticIds.append(semanticId)
-            instanceIds.append(instanceId)
-            layerIds.append(id)
-            rgb = parse_stroke(ellipse, g)
-            strokes.append(rgb)
-            widths.extend([float(parse_width(ellipse, g))])
-            thetas = [0,math.pi/2, math.pi, 3 * math.pi/2,]
-            arg = []
-            for theta in thetas:
-                x, y = cx + a * math.cos(theta), cy + b * math.sin(theta)
-                arg.extend([x,y])
-            args.append(arg)
-            inst_infos[(instanceId,semanticId)].extend(arg)
+        semanticId, instanceId = parse_labels(elem)
+        semanticIds.append(semanticId)
+        instanceIds.append(instanceId)
+        layerIds.append(layer_id)
+        primIds.append(prim_idx)
+        rgb = parse_stroke(elem, g)
+        strokes.append(rgb)
+        widths.extend([float(parse_width(elem, g))])
             
-        
-            
-    assert len(args) == len(lengths) ,'error'
     assert len(semanticIds) ==  len(instanceIds), 'error'
-    obj_cts = []
-    obj_boxes = []
-    for (inst_id, sem_id),coords in inst_infos.items():
-        if inst_id<0: continue
-        coords = np.array(coords).reshape(-1,2)
-        x1,y1 = np.min(coords[:,0]), np.min(coords[:,1])
-        x2,y2 = np.max(coords[:,0]), np.max(coords[:,1])
-        obj_cts.append([(x1+x2)/2,(y1+y2)/2,0,inst_id])
-        obj_boxes.append([x1,y1,x2,y2,sem_id])
-    
-    coords = np.array(args).reshape(-1,4,2)
+    if svg_out is not None:
+        write_converted(tree, polys, os.path.join(svg_out, os.path.basename(svg_file)))
+    # the converted svg no longer has the polylines/polygons without length
+    primIds = [prim_idx - bisect.bisect(dropped, prim_idx) for prim_idx in primIds]
+    lengths, points = measure_primitives(len(commands), segments, fallbacks, circles, ellipses)
+    obj_cts, obj_boxes = geometry.instance_boxes(points, np.array(semanticIds), np.array(instanceIds))
+    args = points.reshape(-1, 8)
+    neighbors = drawing_neighbors(args, width, height)
    
     json_dicts = {
         "commands":commands,
@@ -195,40 +234,87 @@ def parse_svg(svg_file):
         "boxes": obj_boxes,
         "rgb": strokes,
         "layerIds":layerIds,
+        "primIds":primIds,
+        "neighbors":neighbors,
         "widths": widths
     }
     return json_dicts
 
-def save_json(json_dicts,out_json):
-    json.dump(json_dicts, open(out_json, 'w'), indent=4)
-    
-def process(svg_file, save_dir):
-    json_dicts = parse_svg(svg_file)
-    filename = svg_file.split("/")[-1].replace(".svg",".json")
-    out_json = os.path.join(save_dir,filename)
-    save_json(json_dicts,out_json)
+def write_converted(tree, polys, out_file):
+    """Writes the svg with its polylines/polygons replaced by paths, like preprocess_svg.poly2path."""
+    for elem in polys:
+        new_elem, status = convert_poly(elem)
+        if new_elem is None:
+            elem.getparent().remove(elem)
+        elif new_elem is not elem:
+            elem.getparent().replace(elem, new_elem)
+    tree.write(out_file)
+
+def output_path(svg_file, save_dir, fmt="npz"):
+    filename = os.path.basename(svg_file).replace(".svg",DRAWING_FORMATS[fmt])
+    return os.path.join(save_dir,filename)
+
+def process(svg_file, save_dir, fmt="npz", stream=False, svg_out=None):
+    json_dicts = parse_svg(svg_file, stream, svg_out)
+    out_file = output_path(svg_file, save_dir, fmt)
+    save_drawing(json_dicts,out_file)
+
+def safe_process(inputs):
+    """Runs process() on one svg, logging any failure to <error_dir>/<name>.log instead of raising."""
+    svg_file, save_dir, error_dir, fmt, stream, svg_out = inputs
+    error_log = os.path.join(error_dir, os.path.basename(svg_file).replace(".svg",".log"))
+    try:
+        process(svg_file, save_dir, fmt, stream, svg_out)
+    except Exception:
+        with open(error_log, 'w') as f:
+            f.write(traceback.format_exc())
+        return svg_file, False
+    if os.path.exists(error_log):
+        os.remove(error_log)
+    return svg_file, True
 
 if __name__=="__main__":
     
     args = parse_args()
-    svg_paths = glob.glob(os.path.join(args.data_dir,'*.svg'))
+    svg_paths = sorted(os.path.realpath(path) for path in glob.glob(os.path.join(args.data_dir,'*.svg')))
     
-    save_dir = os.path.join("./dataset/",args.split, "jsons")
+    save_dir = os.path.join("./dataset/",args.split, "jsons" if args.format == "json" else args.format)
+    error_dir = os.path.join("./dataset/",args.split, "errors")
     os.makedirs(save_dir,exist_ok=True)
+    os.makedirs(error_dir,exist_ok=True)
+    if args.svg_out:
+        os.makedirs(args.svg_out,exist_ok=True)
     
-    inputs = []
-    for svg_path in svg_paths: 
-        print(f"Parsing {svg_path}")
-        process(svg_path, save_dir)
-        print(f"--------------------------------------------------------------------")
-#    mmcv.track_parallel_progress(process,inputs,64)
-
-
-    
+    # only svgs that are new, changed or parsed by another version of the parser are parsed
+    manifest = Manifest(os.path.join("./dataset/",args.split, MANIFEST_NAME), "parse_svg", PARSER_VERSION)
+    manifest.resolve_sources()
+    # only prunes the svgs of this data_dir, and nothing when it lists none
+    removed = manifest.prune(svg_paths, root=args.data_dir)
+    print(f"{len(removed)} outputs of removed svgs deleted")
+    inputs, digests = [], {}
+    for svg_path in svg_paths:
+        digests[svg_path] = file_hash(svg_path)
+        if not args.overwrite and manifest.is_current(svg_path, digests[svg_path], output_path(svg_path, save_dir, args.format)):
+            continue
+        inputs.append((svg_path, save_dir, error_dir, args.format, args.stream, args.svg_out))
+    print(f"{len(svg_paths) - len(inputs)} of {len(svg_paths)} svgs up to date, parsing {len(inputs)}")
 
+    def collect(results):
+        for i, (svg_path, ok) in enumerate(tqdm(results, total=len(inputs))):
+            if ok:
+                manifest.record(svg_path, digests[svg_path], output_path(svg_path, save_dir, args.format))
+            else:
+                failed.append(svg_path)
+            if i % 100 == 99:
+                manifest.save()  # an interrupted run keeps what it parsed
 
-    
-            
-            
-            
-
+    failed = []
+    try:
+        if args.workers > 1:
+            with Pool(args.workers) as pool:
+                collect(pool.imap_unordered(safe_process, inputs, chunksize=1))
+        else:
+            collect(map(safe_process, inputs))
+    finally:
+        manifest.save()
+    print(f"{len(failed)} svgs failed, see logs in {error_dir}")
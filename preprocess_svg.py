@@ -5,6 +5,12 @@ from tqdm import tqdm
 from lxml import etree
 from math import hypot
 
+from svgnet.data.manifest import MANIFEST_NAME, Manifest, file_hash
+from svgnet.data.svg_tree import stream_rewrite
+
+# bump when the converted output changes, the next run converts every svg
+PREPROCESS_VERSION = 1
+
 
 def get_args():
     """Parses command-line arguments for the SVGNet inference script.
@@ -25,6 +31,22 @@ def get_args():
         help="Directory for output results.",
         default="./dataset/test/test/svg_gt",
     )
+    parser.add_argument(
+        "--split",
+        type=str,
+        help="Split of the dataset, whose manifest records the converted svgs.",
+        default="test",
+    )
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="Convert svgs already converted from the same content.",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Convert incrementally with bounded memory, for very large svgs.",
+    )
     
     args = parser.parse_args()
     return args
@@ -62,6 +84,32 @@ def is_trivial_path(d_attr, tolerance=0.0):
     except:
         return False
 
+def convert_poly(elem):
+    """Converts a <polyline>/<polygon> into an equivalent <path>.
+
+    Returns:
+        (new_elem, status): new_elem is None when the element should be dropped,
+        status is "no_info" (no points), "trivial" (0 length) or "converted".
+    """
+    points = elem.get('points')
+    if not points:
+        return elem, "no_info"
+
+    d = points_to_path(points, closed=etree.QName(elem).localname == 'polygon')
+    if not d:
+        return None, "trivial"
+
+    # Create new <path> element
+    new_elem = etree.Element('path')
+    new_elem.set('d', d)
+
+    # Copy style/presentation attributes
+    for attr in elem.attrib:
+        if attr not in ['points']:
+            new_elem.set(attr, elem.get(attr))
+    new_elem.tail = elem.tail
+    return new_elem, "converted"
+
 def poly2path(svg_file, out_folder):
     tree = etree.parse(svg_file)
     root = tree.getroot()
@@ -71,38 +119,42 @@ def poly2path(svg_file, out_folder):
 
     for tag_name in ['polyline', 'polygon']:
         elements = root.xpath(f'//svg:{tag_name}', namespaces=ns)
-        closed = tag_name == 'polygon'
         print(f"{len(elements)} {tag_name}s to clean")
         for elem in elements:
-            points = elem.get('points')
-            if not points:
+            new_elem, status = convert_poly(elem)
+            if status == "no_info":
                 no_info +=1
                 continue
 
-            d = points_to_path(points, closed=closed)
-            if not d:
-                parent = elem.getparent()
+            parent = elem.getparent()
+            if new_elem is None:
                 parent.remove(elem)
                 trivial += 1
                 continue
 
-            # Create new <path> element
-            new_elem = etree.Element('path')
-            new_elem.set('d', d)
-
-            # Copy style/presentation attributes
-            for attr in elem.attrib:
-                if attr not in ['points']:
-                    new_elem.set(attr, elem.get(attr))
-
             # Replace the old element with new one
-            parent = elem.getparent()
             parent.replace(elem, new_elem)
     
     print(f"{no_info} polylines/polygons skipped because of no info")
     print(f"{trivial} polylines/polygons skipped because of being 0 length")
     tree.write(os.path.join(out_folder, os.path.basename(svg_file)))
 
+def poly2path_stream(svg_file, out_folder):
+    """Streaming poly2path: the output is written while the input is parsed, with bounded memory."""
+    counts = {"no_info": 0, "trivial": 0, "converted": 0}
+
+    def transform(elem):
+        if etree.QName(elem).localname not in ('polyline', 'polygon'):
+            return elem
+        new_elem, status = convert_poly(elem)
+        counts[status] += 1
+        return new_elem
+
+    stream_rewrite(svg_file, os.path.join(out_folder, os.path.basename(svg_file)), transform)
+    print(f"{counts['converted']} polylines/polygons converted")
+    print(f"{counts['no_info']} polylines/polygons skipped because of no info")
+    print(f"{counts['trivial']} polylines/polygons skipped because of being 0 length")
+
 
 
 def process():
@@ -110,11 +162,28 @@ def process():
     os.makedirs(args.input_dir, exist_ok=True)
     os.makedirs(args.output_dir, exist_ok=True)
 
-    svg_paths = glob.glob(os.path.join(args.input_dir,'*.svg'))
+    svg_paths = sorted(os.path.realpath(path) for path in glob.glob(os.path.join(args.input_dir,'*.svg')))
     print(f"{args.input_dir}")
-    for file in tqdm(svg_paths):
-        print(f"File {file}")
-        poly2path(file, args.output_dir)
+    # only svgs that are new or changed since the last run are converted
+    manifest = Manifest(os.path.join("./dataset/", args.split, MANIFEST_NAME), "preprocess_svg", PREPROCESS_VERSION)
+    manifest.resolve_sources()
+    # only prunes the svgs of this input_dir, and nothing when it lists none
+    removed = manifest.prune(svg_paths, root=args.input_dir)
+    print(f"{len(removed)} outputs of removed svgs deleted")
+    try:
+        for file in tqdm(svg_paths):
+            out_file = os.path.join(args.output_dir, os.path.basename(file))
+            digest = file_hash(file)
+            if not args.overwrite and manifest.is_current(file, digest, out_file):
+                continue
+            print(f"File {file}")
+            if args.stream:
+                poly2path_stream(file, args.output_dir)
+            else:
+                poly2path(file, args.output_dir)
+            manifest.record(file, digest, out_file)
+    finally:
+        manifest.save()
 
 
 def main():
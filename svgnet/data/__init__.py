@@ -1,10 +1,17 @@
-from torch.utils.data import DataLoader
+import warnings
+
+import torch
+from torch.utils.data import BatchSampler, DataLoader
 from torch.utils.data.distributed import DistributedSampler
 from functools import partial
 
-from svgnet.util import worker_init_fn
+from svgnet.util import get_dist_info, worker_init_fn
+from .batch_aug import BatchAugmentation
+from .prefetch import DevicePrefetcher
+from .sampler import BucketBatchSampler, ResumableBatchSampler, TokenBudgetBatchSampler
 from .svg import SVGDataset
-__all__ = ["SVGDataset", "build_dataset"]
+from .svg2 import SVGDataset as SVGNeighborDataset
+__all__ = ["SVGDataset", "SVGNeighborDataset", "DevicePrefetcher", "build_dataset", "build_batch_aug"]
 
 
 def build_dataset(data_cfg, logger):
@@ -15,30 +22,57 @@ def build_dataset(data_cfg, logger):
     
     if data_type == "svg":
         return SVGDataset(**_data_cfg)
+    elif data_type == "svg2":
+        return SVGNeighborDataset(**_data_cfg)
     else:
         raise ValueError(f"Unknown {data_type}")
 
 
-def build_dataloader(args,dataset, batch_size=1, num_workers=1, training=True, dist=False):
-    shuffle = training
-    sampler = DistributedSampler(dataset, shuffle=shuffle) if dist else None
-    if sampler is not None:
-        shuffle = False
+def build_batch_aug(data_cfg):
+    """Augmentation of the collated train batches, None when the dataset augments each sample."""
+    if not data_cfg.get("batch_aug", False):
+        return None
+    return BatchAugmentation(data_cfg.aug, data_cfg.data_norm)
+
+
+def build_dataloader(args,dataset, batch_size=1, num_workers=1, training=True, dist=False, bucket_batches=0, max_points=0, prefetch=0):
+    batch_sampler = None
+    rank, world_size = get_dist_info() if dist else (0, 1)
+    if max_points > 0:
+        # batches packed up to a budget of points, batch_size is then ignored
+        batch_sampler = TokenBudgetBatchSampler(
+            dataset.sample_sizes(), max_points,
+            num_replicas=world_size, rank=rank, shuffle=training, seed=args.seed)
+    elif training and bucket_batches > 0:
+        # batches of drawings with similar primitive counts
+        batch_sampler = BucketBatchSampler(
+            dataset.sample_sizes(), batch_size, bucket_batches,
+            num_replicas=world_size, rank=rank, shuffle=True, drop_last=True, seed=args.seed)
     if training:
-        return DataLoader(
+        if batch_sampler is None:
+            # a seeded shuffle, the same for the same epoch with or without DDP
+            sampler = DistributedSampler(dataset, num_replicas=world_size, rank=rank, shuffle=True, seed=args.seed)
+            batch_sampler = BatchSampler(sampler, batch_size, drop_last=True)
+        # the epoch can restart at any batch, see train.py --resume
+        batch_sampler = ResumableBatchSampler(batch_sampler, seed=args.seed, rank=rank)
+        if int(torch.__version__.split(".")[0]) < 2:
+            # the DataLoader only calls dataset.__getitems__, which seeds the batches, from torch 2.0
+            warnings.warn("torch < 2.0: the augmentations of a resumed epoch are not those of the interrupted one")
+    sampler = DistributedSampler(dataset, shuffle=False) if dist and batch_sampler is None else None
+    if batch_sampler is not None:
+        loader = DataLoader(
             dataset,
-            batch_size=batch_size,
+            batch_sampler=batch_sampler,
             num_workers=num_workers,
             collate_fn=dataset.collate_fn,
-            shuffle=shuffle,
-            sampler=sampler,
-            drop_last=True,
             pin_memory=True,
-            worker_init_fn=partial(worker_init_fn, seed=args.seed)
+            worker_init_fn=partial(worker_init_fn, seed=args.seed),
+            # keeps the global RNGs of the process untouched by the loader
+            generator=torch.Generator()
         )
     else:
         # assert batch_size == 1
-        return DataLoader(
+        loader = DataLoader(
             dataset,
             batch_size=batch_size,
             num_workers=num_workers,
@@ -49,3 +83,7 @@ def build_dataloader(args,dataset, batch_size=1, num_workers=1, training=True, d
             pin_memory=True,
             worker_init_fn=partial(worker_init_fn, seed=args.seed)
         )
+    if prefetch > 0:
+        # stage the next batches on the device while the current one runs
+        loader = DevicePrefetcher(loader, num_prefetch=prefetch)
+    return loader
@@ -50,19 +50,12 @@ def random_delete(coords, lens, labels, ctypes, neighbors):
     uni_labels = np.unique(labels, axis=0)
     del_id = np.random.randint(uni_labels.shape[0])
     sem, ins = uni_labels[del_id]
-    ind = np.logical_and(labels[:,0]==sem, labels[:,1]==ins)
-    valid = np.where(ind==True)[0]
+    keep = np.logical_or(labels[:,0]!=sem, labels[:,1]!=ins)
     
-    coords = np.delete(coords, valid, axis=0)
-    lens = np.delete(lens, valid, axis=0)
-    labels = np.delete(labels, valid, axis=0)
-    ctypes = np.delete(ctypes, valid, axis=0)
-    neighbors = np.delete(neighbors, valid, axis=0)
+    # compaction: new index of every kept primitive, -1 for the deleted ones
+    new_index = np.cumsum(keep) - 1
+    new_index[~keep] = -1
+    neighbors = neighbors[keep]
+    neighbors = np.where(neighbors>=0, new_index[neighbors], -1)
     
-    neighbors[np.isin(neighbors, valid)] = -1
-    
-    return coords, lens, labels, ctypes, neighbors
-    
-    
-    
-    
\ No newline at end of file
+    return coords[keep], lens[keep], labels[keep], ctypes[keep], neighbors
@@ -0,0 +1,109 @@
+import math
+
+import torch
+
+
+class BatchAugmentation:
+    """The augmentations of ``SVGDataset.transform_train`` run on a collated batch.
+
+    Every cloud of the batch (delimited by ``offset``) draws its own flips,
+    rotation, shift and scale, and the whole batch is transformed with a few
+    torch ops, on the device of the batch, instead of once per sample in the
+    workers. Cutmix stays in the workers, where the instance bank lives; the
+    pasted instances are augmented with the cloud they were pasted into.
+
+    Args:
+        aug: the aug section of the train data config.
+        data_norm: "mean" or "min", the per cloud coordinate normalization.
+    """
+
+    def __init__(self, aug, data_norm):
+        self.aug = aug
+        self.data_norm = data_norm
+
+    def _apply(self, enable, num_clouds, device=None):
+        """Which clouds get an augmentation."""
+        if not enable:
+            return torch.zeros(num_clouds, dtype=torch.bool, device=device)
+        return torch.rand(num_clouds, device=device) < self.aug.aug_prob
+
+    def __call__(self, batch):
+        coord, feat, label, offset = batch[:4]
+        aug = self.aug
+        counts = torch.diff(offset.long(), prepend=offset.new_zeros(1).long())
+        num_clouds, device = counts.shape[0], coord.device
+        cloud = torch.repeat_interleave(torch.arange(num_clouds, device=device), counts)
+        coord, feat = coord.clone(), feat.clone()
+        x, y = coord[:, 0], coord[:, 1]
+
+        # flips
+        hflip = self._apply(aug.hflip, num_clouds, device)[cloud]
+        x = torch.where(hflip, 1 - x, x)
+        vflip = self._apply(aug.vflip, num_clouds, device)[cloud]
+        y = torch.where(vflip, 1 - y, y)
+
+        # rotations around the center, rotate and rotate2 compose into one angle
+        angle = torch.zeros(num_clouds, dtype=coord.dtype, device=device)
+        if aug.rotate.enable:
+            _min, _max = aug.rotate.angle
+            angle += torch.where(self._apply(True, num_clouds, device),
+                                 torch.empty(num_clouds, dtype=coord.dtype, device=device).uniform_(_min, _max), 0)
+        if aug.rotate2:
+            angle += torch.where(self._apply(True, num_clouds, device),
+                                 torch.empty(num_clouds, dtype=coord.dtype, device=device).uniform_(-180, 180), 0)
+        radians = (angle * math.pi / 180)[cloud]
+        cos, sin = torch.cos(radians), torch.sin(radians)
+        x, y = (x - 0.5) * cos - (y - 0.5) * sin + 0.5, (x - 0.5) * sin + (y - 0.5) * cos + 0.5
+        coord[:, 0], coord[:, 1] = x, y
+
+        # random shift
+        if aug.shift.enable:
+            _min, _max = aug.shift.scale
+            shift = torch.empty(num_clouds, 2, dtype=coord.dtype, device=device).uniform_(_min, _max)
+            shift[~self._apply(True, num_clouds, device)] = 0
+            coord[:, :2] += shift[cloud]
+
+        # random scale
+        if aug.scale.enable:
+            _min, _max = aug.scale.ratio
+            scale = torch.empty(num_clouds, dtype=coord.dtype, device=device).uniform_(_min, _max)
+            scale[~self._apply(True, num_clouds, device)] = 1
+            coord *= scale[cloud, None]
+            feat[:, 1] *= scale[cloud]
+
+        feat[:, 0] = torch.atan(coord[:, 1] / (coord[:, 0] + 1e-8)) / math.pi
+
+        # shuffle within every cloud
+        shuf_idx = torch.argsort(cloud.double() + torch.rand(cloud.shape[0], dtype=torch.float64, device=device))
+        coord, feat, label = coord[shuf_idx], feat[shuf_idx], label[shuf_idx]
+        extra = batch[5] if len(batch) > 5 and isinstance(batch[5], dict) else None
+        if extra is not None:
+            extra = self._shuffle_extra(extra, shuf_idx)
+
+        # coord norm
+        if self.data_norm == 'mean':
+            center = torch.zeros(num_clouds, 3, dtype=coord.dtype, device=device).index_add_(0, cloud, coord)
+            coord -= (center / counts[:, None].clamp(min=1))[cloud]
+        elif self.data_norm == 'min':
+            # the clouds padded to (b, n_max, 3), scatter_reduce needs torch 1.12
+            pos = torch.arange(coord.shape[0], device=device) - (offset.long() - counts)[cloud]
+            padded = torch.full((num_clouds, int(counts.max()) if num_clouds else 0, 3), math.inf,
+                                dtype=coord.dtype, device=device)
+            padded[cloud, pos] = coord
+            coord -= padded.amin(1)[cloud]
+        if extra is not None:
+            return (coord, feat, label, batch[3], batch[4], extra) + tuple(batch[6:])
+        return (coord, feat, label) + tuple(batch[3:])
+
+    @staticmethod
+    def _shuffle_extra(extra, shuf_idx):
+        """Follows the shuffle in the per point inputs built by collate_fn."""
+        extra = dict(extra)
+        if "targets" in extra:
+            targets = extra["targets"]
+            extra["targets"] = {"labels": targets["labels"], "ids": targets["ids"][shuf_idx]}
+        if extra.get("knn_idx") is not None:
+            inv_idx = torch.empty_like(shuf_idx)
+            inv_idx[shuf_idx] = torch.arange(shuf_idx.shape[0], device=shuf_idx.device)
+            extra["knn_idx"] = inv_idx[extra["knn_idx"][shuf_idx]]
+        return extra
@@ -0,0 +1,148 @@
+"""Reading and writing of parsed drawings.
+
+A drawing is what ``parse_svg.py`` extracts from one svg: per-primitive columns
+(args, lengths, commands, ...) plus a few per-drawing values (width, height,
+instance boxes). Drawings are stored either as the legacy indented json or as a
+binary ``.npz`` with one typed array per column, which numpy reads straight
+into arrays without going through python lists.
+"""
+import io
+import json
+import os
+from glob import glob
+
+import numpy as np
+
+from . import geometry
+
+NUM_NEIGHBORS = 16
+
+# column name -> (dtype, trailing shape)
+DRAWING_COLUMNS = {
+    "args": (np.float32, (8,)),  # (x1,y1,x2,y2,x3,y3,x4,y4) 4 points
+    "lengths": (np.float32, ()),
+    "commands": (np.uint8, ()),
+    "semanticIds": (np.int16, ()),
+    "instanceIds": (np.int32, ()),
+    "rgb": (np.uint8, (3,)),
+    "layerIds": (np.int32, ()),
+    "widths": (np.float32, ()),
+    "primIds": (np.int32, ()),  # document order index of the source element, see svg_tree
+    "neighbors": (np.int32, (NUM_NEIGHBORS,)),  # nearest primitives by center, -1 padded
+}
+# header: small per-drawing values
+DRAWING_HEADER = {
+    "width": np.int32,
+    "height": np.int32,
+}
+# per-instance tables
+DRAWING_TABLES = {
+    "obj_cts": (np.float32, (4,)),  # (x,y,z,inst_id)
+    "boxes": (np.float32, (5,)),  # (x1,y1,x2,y2,sem_id)
+}
+DRAWING_FORMATS = {"json": ".json", "npz": ".npz"}
+
+
+def _fix_rgb(rgb):
+    # parse_stroke returns every integer found in the stroke attribute, which is
+    # not always 3 values (e.g. "none", "#a0a0a0"); keep a fixed (r,g,b) layout
+    rgb = list(rgb)[:3] + [0] * max(0, 3 - len(rgb))
+    return np.clip(rgb, 0, 255)
+
+
+def missing_column(drawing, key):
+    """Columns added after the first drawings were parsed, derived from the others."""
+    if key == "primIds":
+        # rows followed the element order
+        return np.arange(len(drawing["commands"]))
+    if key == "neighbors":
+        return drawing_neighbors(drawing["args"], drawing["width"], drawing["height"])
+    raise KeyError(key)
+
+
+def drawing_neighbors(args, width, height):
+    """kNN graph of the primitives, on centers normalized by the drawing size like the model input."""
+    centers = np.asarray(args, dtype=np.float64).reshape(-1, 4, 2).mean(1)
+    size = np.array([float(width), float(height)])
+    return geometry.knn_graph(centers / np.where(size > 0, size, 1), NUM_NEIGHBORS)
+
+
+def to_arrays(drawing):
+    """Converts a drawing dict (python lists or arrays) into typed numpy arrays."""
+    arrays = {}
+    for key, (dtype, shape) in DRAWING_COLUMNS.items():
+        value = drawing[key] if key in drawing else missing_column(drawing, key)
+        if key == "rgb" and not isinstance(value, np.ndarray):
+            value = [_fix_rgb(rgb) for rgb in value]
+        arrays[key] = np.asarray(value, dtype=dtype).reshape((-1,) + shape)
+    for key, dtype in DRAWING_HEADER.items():
+        arrays[key] = np.asarray(drawing[key], dtype=dtype)
+    for key, (dtype, shape) in DRAWING_TABLES.items():
+        arrays[key] = np.asarray(drawing.get(key, []), dtype=dtype).reshape((-1,) + shape)
+    # extra fields are kept as they are
+    for key, value in drawing.items():
+        if key not in arrays:
+            arrays[key] = np.asarray(value)
+    return arrays
+
+
+def save_drawing(drawing, out_file):
+    """Saves a drawing, choosing the format from the file extension.
+
+    The file is written to a temporary name first so an interrupted write never
+    leaves a truncated file behind.
+    """
+    tmp_file = out_file + ".tmp"
+    if out_file.endswith(".npz"):
+        with open(tmp_file, "wb") as f:
+            f.write(encode_drawing(drawing))
+    else:
+        with open(tmp_file, "w") as f:
+            json.dump(drawing, f, indent=4, default=lambda x: x.tolist())
+    os.replace(tmp_file, out_file)
+
+
+def encode_drawing(drawing):
+    """Serializes a drawing to the bytes of its ``.npz`` file."""
+    buf = io.BytesIO()
+    np.savez(buf, **to_arrays(drawing))
+    return buf.getvalue()
+
+
+def _read_npz(f):
+    with np.load(f) as data:
+        drawing = {key: data[key] for key in data.files}
+    for key, (dtype, shape) in DRAWING_COLUMNS.items():
+        if key not in drawing:
+            drawing[key] = np.asarray(missing_column(drawing, key), dtype=dtype).reshape((-1,) + shape)
+    return drawing
+
+
+def decode_drawing(buf):
+    """Inverse of :func:`encode_drawing`, buf is any bytes-like object."""
+    return _read_npz(io.BytesIO(buf))
+
+
+def load_drawing(file):
+    """Loads a drawing saved by :func:`save_drawing` as a dict of numpy arrays."""
+    if file.endswith(".npz"):
+        return _read_npz(file)
+    with open(file) as f:
+        return to_arrays(json.load(f))
+
+
+def count_primitives(file):
+    """Number of primitives of a saved drawing, npz files only read their commands column."""
+    if file.endswith(".npz"):
+        with np.load(file) as data:
+            return data["commands"].shape[0]
+    return load_drawing(file)["commands"].shape[0]
+
+
+def list_drawings(data_root):
+    """Lists the drawings in a directory, preferring the binary format."""
+    for ext in (".npz", ".json"):
+        files = sorted(glob(os.path.join(data_root, "*" + ext)))
+        if files:
+            return files
+    return []
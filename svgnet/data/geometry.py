@@ -0,0 +1,235 @@
+"""Vectorized geometry of svg primitives.
+
+Every function works on a whole batch of primitives given as numpy arrays, so a
+drawing is measured with a handful of array operations instead of one
+svgpathtools call per segment. Results follow svgpathtools' conventions:
+
+* a path is sampled at ``SAMPLE_TS`` by arc length over its segments, like
+  ``Path.point(T)``, and its length is the sum of its segment lengths;
+* arcs are parameterized by angle like ``Arc.point(t)``, out of range radii are
+  scaled up like ``Arc(autoscale_radius=True)``;
+* circles and ellipses keep the closed forms parse_svg has always used.
+"""
+import numpy as np
+from scipy.spatial import cKDTree
+
+SAMPLE_TS = np.array([0, 1/3, 2/3, 1.0])
+
+# composite Gauss-Legendre rule used for elliptical arc lengths
+_GL_PANELS = 32
+_GL_NODES, _GL_WEIGHTS = np.polynomial.legendre.leggauss(16)
+
+
+def line_points(start, end, t):
+    """start, end: (M, 2), t: (M, T) -> (M, T, 2)"""
+    return start[:, None, :] + t[..., None] * (end - start)[:, None, :]
+
+
+def line_lengths(start, end):
+    """start, end: (M, 2) -> (M,)"""
+    return np.linalg.norm(end - start, axis=1)
+
+
+def arc_parameters(start, end, radius, rotation, large_arc, sweep):
+    """Center parameterization of svg arcs, see
+    http://www.w3.org/TR/SVG/implnote.html#ArcImplementationNotes
+
+    input: start, end: (M, 2), radius: (M, 2) as (rx, ry), rotation: (M,) in degrees,
+           large_arc, sweep: (M,) bool
+    output: dict of center (M, 2), rx, ry, phi, theta, delta (M,), angles in radians
+    """
+    rx, ry = np.abs(radius[:, 0]), np.abs(radius[:, 1])
+    phi = np.radians(rotation)
+    cosphi, sinphi = np.cos(phi), np.sin(phi)
+
+    # rotate the half chord so the ellipse axes align with x/y
+    half = (start - end) / 2
+    x1p = cosphi * half[:, 0] + sinphi * half[:, 1]
+    y1p = -sinphi * half[:, 0] + cosphi * half[:, 1]
+
+    # scale up radii for which no ellipse through start and end exists
+    radius_check = x1p**2 / rx**2 + y1p**2 / ry**2
+    scale = np.sqrt(np.maximum(radius_check, 1))
+    rx, ry = rx * scale, ry * scale
+
+    tmp = rx**2 * y1p**2 + ry**2 * x1p**2
+    radicand = (rx**2 * ry**2 - tmp) / tmp
+    radical = np.where(np.isclose(radicand, 0), 0, np.sqrt(np.abs(radicand)))
+    radical = np.where(large_arc == sweep, -radical, radical)
+    cxp = radical * rx * y1p / ry
+    cyp = -radical * ry * x1p / rx
+
+    mid = (start + end) / 2
+    center = np.stack([cosphi * cxp - sinphi * cyp + mid[:, 0],
+                       sinphi * cxp + cosphi * cyp + mid[:, 1]], axis=1)
+
+    # start and end on the unit circle
+    u1x = np.clip((x1p - cxp) / rx, -1, 1)
+    u1y = np.clip((y1p - cyp) / ry, -1, 1)
+    u2x = np.clip((-x1p - cxp) / rx, -1, 1)
+    u2y = np.clip((-y1p - cyp) / ry, -1, 1)
+
+    theta = np.arctan2(u1y, u1x)
+    delta = np.arctan2(u1x * u2y - u1y * u2x, u1x * u2x + u1y * u2y)
+    delta = np.where(~sweep & (delta >= 0), delta - 2 * np.pi,
+                     np.where(sweep & large_arc & (delta <= 0), delta + 2 * np.pi, delta))
+    return {"center": center, "rx": rx, "ry": ry, "phi": phi, "theta": theta, "delta": delta}
+
+
+def arc_points(arc, t):
+    """arc: output of arc_parameters, t: (M, T) -> (M, T, 2)"""
+    angle = arc["theta"][:, None] + t * arc["delta"][:, None]
+    cosphi, sinphi = np.cos(arc["phi"])[:, None], np.sin(arc["phi"])[:, None]
+    ex = arc["rx"][:, None] * np.cos(angle)
+    ey = arc["ry"][:, None] * np.sin(angle)
+    x = cosphi * ex - sinphi * ey + arc["center"][:, None, 0]
+    y = sinphi * ex + cosphi * ey + arc["center"][:, None, 1]
+    return np.stack([x, y], axis=-1)
+
+
+def arc_lengths(arc):
+    """arc: output of arc_parameters -> (M,)
+
+    Circular arcs use the closed form r*|delta|, elliptical ones integrate
+    |d/dt point| with a composite Gauss-Legendre rule.
+    """
+    rx, ry, theta, delta = arc["rx"], arc["ry"], arc["theta"], arc["delta"]
+    lengths = rx * np.abs(delta)
+    ellipse = ~np.isclose(rx, ry, rtol=1e-12, atol=0)
+    if ellipse.any():
+        rx, ry, theta, delta = rx[ellipse], ry[ellipse], theta[ellipse], delta[ellipse]
+        # nodes over [0, 1] split into equal panels
+        edges = np.arange(_GL_PANELS) / _GL_PANELS
+        t = (edges[:, None] + (_GL_NODES[None, :] + 1) / (2 * _GL_PANELS)).reshape(-1)
+        w = np.tile(_GL_WEIGHTS / (2 * _GL_PANELS), _GL_PANELS)
+        angle = theta[:, None] + t[None, :] * delta[:, None]
+        speed = np.sqrt((rx[:, None] * np.sin(angle))**2 + (ry[:, None] * np.cos(angle))**2)
+        lengths[ellipse] = np.abs(delta) * (speed * w).sum(1)
+    return lengths
+
+
+def path_samples(start, end, is_arc, radius, rotation, large_arc, sweep, path_idx, num_paths, ts=SAMPLE_TS):
+    """Lengths and sample points of paths made of Line and Arc segments.
+
+    input: per segment arrays (M, ...) in path order, path_idx: (M,) sorted index of
+           the owning path, num_paths: P, every path has at least one segment
+    output: lengths (P,), points (P, T, 2) sampled at ``ts`` by arc length, like svgpathtools Path.point
+    """
+    num_segs = start.shape[0]
+    seg_lengths = np.zeros(num_segs)
+    is_line = ~is_arc
+    seg_lengths[is_line] = line_lengths(start[is_line], end[is_line])
+    arc = None
+    if is_arc.any():
+        arc = arc_parameters(start[is_arc], end[is_arc], radius[is_arc], rotation[is_arc],
+                             large_arc[is_arc], sweep[is_arc])
+        seg_lengths[is_arc] = arc_lengths(arc)
+
+    first = np.searchsorted(path_idx, np.arange(num_paths))
+    counts = np.bincount(path_idx, minlength=num_paths)
+    lengths = np.add.reduceat(seg_lengths, first) if num_segs else np.zeros(num_paths)
+
+    # cumulative length fraction at the end of every segment
+    cum = np.cumsum(seg_lengths)
+    cum_end = cum - np.repeat(cum[first] - seg_lengths[first], counts)
+    total = np.repeat(lengths, counts)
+    frac_end = np.divide(cum_end, total, out=np.zeros_like(cum_end), where=total > 0)
+    frac_start = frac_end - np.divide(seg_lengths, total, out=np.zeros_like(cum_end), where=total > 0)
+
+    # the sampled segment is the first one whose end fraction reaches T
+    inner = (ts > 0) & (ts < 1)
+    T = ts[inner]
+    before = np.add.reduceat((frac_end[:, None] < T[None, :]).astype(np.int64), first, axis=0)
+    seg = np.minimum(first[:, None] + before, (first + counts - 1)[:, None])  # (P, T')
+    span = frac_end[seg] - frac_start[seg]
+    t = np.clip(np.divide(T[None, :] - frac_start[seg], span, out=np.zeros_like(span), where=span > 0), 0, 1)
+
+    # local parameters of every sampled segment, T == 0 / 1 are the path start / end
+    seg_ids = np.empty((num_paths, len(ts)), dtype=np.int64)
+    seg_t = np.empty((num_paths, len(ts)))
+    seg_ids[:, inner], seg_t[:, inner] = seg, t
+    seg_ids[:, ts <= 0], seg_t[:, ts <= 0] = first[:, None], 0
+    seg_ids[:, ts >= 1], seg_t[:, ts >= 1] = (first + counts - 1)[:, None], 1
+
+    # degenerate paths of zero length sample their start point
+    seg_t[lengths == 0] = 0
+    seg_ids[lengths == 0] = first[lengths == 0, None]
+
+    flat_ids, flat_t = seg_ids.reshape(-1), seg_t.reshape(-1, 1)
+    points = np.empty((flat_ids.shape[0], 2))
+    line_mask = is_line[flat_ids]
+    ids = flat_ids[line_mask]
+    points[line_mask] = line_points(start[ids], end[ids], flat_t[line_mask])[:, 0]
+    if arc is not None:
+        arc_row = np.cumsum(is_arc) - 1  # position of each segment among the arcs
+        ids = arc_row[flat_ids[~line_mask]]
+        sub = {k: v[ids] for k, v in arc.items()}
+        points[~line_mask] = arc_points(sub, flat_t[~line_mask])[:, 0]
+    return lengths, points.reshape(num_paths, len(ts), 2)
+
+
+def circle_samples(center, r):
+    """center: (M, 2), r: (M,) -> lengths (M,), points (M, 4, 2) at 0, 90, 180, 270 degrees"""
+    thetas = np.array([0, np.pi/2, np.pi, 3 * np.pi/2])
+    points = center[:, None, :] + r[:, None, None] * np.stack([np.cos(thetas), np.sin(thetas)], axis=1)[None]
+    return 2 * np.pi * r, points
+
+
+def ellipse_samples(center, rx, ry):
+    """center: (M, 2), rx, ry: (M,) -> lengths (M,), points (M, 4, 2)
+
+    Like parse_svg always did, the major axis a is laid along x and the minor
+    axis b along y, and the length is approximated as 2*pi*b + 4*(a-b).
+    """
+    a, b = np.maximum(rx, ry), np.minimum(rx, ry)
+    thetas = np.array([0, np.pi/2, np.pi, 3 * np.pi/2])
+    offsets = np.stack([a[:, None] * np.cos(thetas)[None], b[:, None] * np.sin(thetas)[None]], axis=-1)
+    return 2 * np.pi * b + 4 * (a - b), center[:, None, :] + offsets
+
+
+def instance_boxes(points, semantic_ids, instance_ids):
+    """Bounding boxes of the labelled instances of a drawing.
+
+    input: points: (N, K, 2), semantic_ids, instance_ids: (N,)
+    output: obj_cts (I, 4) as (cx, cy, 0, inst_id), boxes (I, 5) as (x1, y1, x2, y2, sem_id),
+            instances ordered by first appearance, unlabelled (inst_id < 0) primitives skipped
+    """
+    valid = instance_ids >= 0
+    if not valid.any():
+        return np.zeros((0, 4)), np.zeros((0, 5))
+    points, semantic_ids, instance_ids = points[valid], semantic_ids[valid], instance_ids[valid]
+    keys = np.stack([instance_ids, semantic_ids], axis=1)
+    _, first, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    # relabel groups by first appearance
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(order.shape[0])
+    group = rank[inverse]
+
+    num = order.shape[0]
+    lo = np.full((num, 2), np.inf)
+    hi = np.full((num, 2), -np.inf)
+    np.minimum.at(lo, group, points.min(1))
+    np.maximum.at(hi, group, points.max(1))
+    first = first[order]
+    inst, sem = instance_ids[first], semantic_ids[first]
+    obj_cts = np.stack([(lo[:, 0] + hi[:, 0]) / 2, (lo[:, 1] + hi[:, 1]) / 2, np.zeros(num), inst], axis=1)
+    boxes = np.stack([lo[:, 0], lo[:, 1], hi[:, 0], hi[:, 1], sem], axis=1)
+    return obj_cts, boxes
+
+
+def knn_graph(centers, k=16):
+    """k nearest primitives of every primitive by center distance, found with a KD-tree.
+
+    input: centers: (N, 2)
+    output: (N, k) indices ordered by distance, the primitive itself included like
+            pointops.knnquery, padded with -1 when N < k
+    """
+    num = centers.shape[0]
+    neighbors = np.full((num, k), -1, dtype=np.int64)
+    k_valid = min(k, num)
+    if k_valid:
+        _, idx = cKDTree(centers).query(centers, k=k_valid)
+        neighbors[:, :k_valid] = idx.reshape(num, k_valid)
+    return neighbors
@@ -0,0 +1,100 @@
+"""Content-hash manifest of the dataset build stages.
+
+Every split has a ``manifest.json`` with one section per stage (download,
+preprocess, parse). A section maps each source to the content hash it was
+built from, the version of the stage that built it and the output path, so a
+re-run only rebuilds new or changed sources and removes the outputs of the
+sources that are gone.
+"""
+import hashlib
+import json
+import os
+
+MANIFEST_NAME = "manifest.json"
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """sha1 of the content of a file."""
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def _read(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+class Manifest:
+    """Section of a split manifest owned by one stage.
+
+    Args:
+        path: the manifest file of the split.
+        stage: name of the section, e.g. "parse_svg".
+        version: version of the stage, bumping it rebuilds every output.
+    """
+
+    def __init__(self, path, stage, version):
+        self.path, self.stage, self.version = path, stage, version
+        self.entries = _read(path).get(stage, {})
+
+    def is_current(self, source, digest, output):
+        """Whether output was built from this content of source by this version of the stage."""
+        entry = self.entries.get(source)
+        return (entry is not None and entry["hash"] == digest and entry["version"] == self.version
+                and entry["output"] == output and os.path.exists(output))
+
+    def record(self, source, digest, output):
+        self.entries[source] = {"hash": digest, "version": self.version, "output": output}
+
+    def resolve_sources(self):
+        """Keys the sources that are file paths by their real path, so that
+        ./dataset/a.svg and dataset/a.svg are the same source."""
+        self.entries = {os.path.realpath(source): entry for source, entry in self.entries.items()}
+
+    def prune(self, sources=None, root=None):
+        """Forgets the sources that are gone and deletes their outputs.
+
+        Args:
+            sources: the sources still present, by default those that exist on disk.
+                Nothing is pruned when it is empty, which rather means a wrong
+                or unmounted input directory than a split without sources.
+            root: only prune the sources under this directory, the one the
+                sources were listed from.
+        Returns:
+            the deleted outputs.
+        """
+        candidates = list(self.entries)
+        if root is not None:
+            root = os.path.realpath(root)
+            candidates = [source for source in candidates if os.path.commonpath([root, source]) == root]
+        if sources is None:
+            gone = [source for source in candidates if not os.path.exists(source)]
+        else:
+            sources = set(sources)
+            if not sources:
+                return []
+            gone = [source for source in candidates if source not in sources]
+        stale = {self.entries.pop(source)["output"] for source in gone}
+        # an output rebuilt from another source stays
+        stale -= {entry["output"] for entry in self.entries.values()}
+        removed = []
+        for output in sorted(stale):
+            if os.path.exists(output):
+                os.remove(output)
+                removed.append(output)
+        return removed
+
+    def save(self):
+        """Writes the section back, keeping the sections of the other stages as they are on disk."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        data = _read(self.path)
+        data[self.stage] = self.entries
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,130 @@
+import queue
+import threading
+import time
+
+import torch
+
+
+def to_device(data, device, non_blocking=False):
+    """Moves the tensors of a batch (nested in tuples, lists and dicts) to device."""
+    if isinstance(data, torch.Tensor):
+        if device.type == "cpu":
+            return data.contiguous()
+        return data.to(device, non_blocking=non_blocking)
+    if isinstance(data, dict):
+        return {k: to_device(v, device, non_blocking) for k, v in data.items()}
+    if isinstance(data, (tuple, list)):
+        return type(data)(to_device(v, device, non_blocking) for v in data)
+    return data
+
+
+def _record_stream(data, stream):
+    if isinstance(data, torch.Tensor):
+        data.record_stream(stream)
+    elif isinstance(data, dict):
+        for v in data.values():
+            _record_stream(v, stream)
+    elif isinstance(data, (tuple, list)):
+        for v in data:
+            _record_stream(v, stream)
+
+
+class DevicePrefetcher:
+    """Wraps a DataLoader to stage the next batches on the device in a background thread.
+
+    The thread pulls batches from the loader and copies them to the device on
+    a side CUDA stream with non-blocking copies (the loader should pin its
+    memory), so the transfer and collate of the next ``num_prefetch`` batches
+    overlap with the current step. On CPU the batches are only made
+    contiguous. Other attributes (sampler, batch_sampler, dataset, ...) are
+    those of the loader.
+
+    Args:
+        loader: the DataLoader to wrap.
+        device: target device, the current CUDA device by default.
+        num_prefetch: batches staged ahead.
+    """
+
+    def __init__(self, loader, device=None, num_prefetch=2):
+        self.loader = loader
+        if device is None:
+            device = torch.device("cuda", torch.cuda.current_device()) if torch.cuda.is_available() else torch.device("cpu")
+        self.device = torch.device(device)
+        self.num_prefetch = max(1, num_prefetch)
+        self.reset_stats()
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def reset_stats(self):
+        self.load_time, self.wait_time, self.steps = 0.0, 0.0, 0
+
+    def stats(self):
+        """Per step averages: time to load and stage a batch, time the step waited for it, and the difference saved."""
+        steps = max(self.steps, 1)
+        load, wait = self.load_time / steps, self.wait_time / steps
+        return {"load_time": load, "wait_time": wait, "saved_time": max(load - wait, 0.0)}
+
+    @staticmethod
+    def _put(batches, item, stop):
+        # gives up once the consumer stopped, it may never empty a full queue again
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _produce(self, batches, stop):
+        stream = torch.cuda.Stream(self.device) if self.device.type == "cuda" else None
+        try:
+            iterator = iter(self.loader)
+            while not stop.is_set():
+                start = time.time()
+                try:
+                    batch = next(iterator)
+                except StopIteration:
+                    break
+                event = None
+                if stream is not None:
+                    with torch.cuda.stream(stream):
+                        batch = to_device(batch, self.device, non_blocking=True)
+                        event = torch.cuda.Event()
+                        event.record(stream)
+                else:
+                    batch = to_device(batch, self.device)
+                self._put(batches, (batch, event, time.time() - start), stop)
+        except Exception as e:  # raised again in the consumer
+            self._put(batches, e, stop)
+            return
+        self._put(batches, None, stop)
+
+    def __iter__(self):
+        batches = queue.Queue(maxsize=self.num_prefetch)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._produce, args=(batches, stop), daemon=True)
+        thread.start()
+        try:
+            while True:
+                start = time.time()
+                item = batches.get()
+                if item is None:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                batch, event, load_time = item
+                if event is not None:
+                    current = torch.cuda.current_stream(self.device)
+                    current.wait_event(event)
+                    # the tensors are now used on the compute stream, not only the copy stream
+                    _record_stream(batch, current)
+                self.wait_time += time.time() - start
+                self.load_time += load_time
+                self.steps += 1
+                yield batch
+        finally:
+            stop.set()
+            thread.join()
@@ -0,0 +1,197 @@
+"""Caches in shared memory, shared by the dataloader workers.
+
+Every entry is one ``.npy`` file in a directory of ``/dev/shm``, so the
+dataloader workers of a process and all its epochs share a single copy of
+it. Files are written atomically and workers never coordinate beyond the
+file system: an entry written by two workers at once is simply written
+twice.
+
+``SharedSampleCache`` keeps decoded drawings, touching files on every hit
+and removing the least recently used ones when it grows over its budget.
+``InstanceBank`` keeps a fixed number of instance slots for cutmix.
+
+The directories are removed at exit. Those of killed or preempted jobs,
+whose owner process is gone, are removed when a new one is created.
+"""
+import atexit
+import multiprocessing
+import os
+import os.path as osp
+import shutil
+import tempfile
+import uuid
+
+import numpy as np
+
+
+def _shm_dir():
+    return "/dev/shm" if osp.isdir("/dev/shm") else tempfile.gettempdir()
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _remove_stale(root):
+    """Removes the svgnet_* directories of this user whose owner process is gone."""
+    with os.scandir(root) as it:
+        for entry in it:
+            parts = entry.name.split("_")
+            if parts[0] != "svgnet" or len(parts) != 4 or not parts[2].isdigit():
+                continue
+            try:
+                if not entry.is_dir(follow_symlinks=False) or entry.stat().st_uid != os.getuid():
+                    continue
+            except FileNotFoundError:
+                continue
+            if not _pid_alive(int(parts[2])):
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def _make_dir(prefix, root=None):
+    root = root or _shm_dir()
+    _remove_stale(root)
+    path = osp.join(root, f"{prefix}_{os.getpid()}_{uuid.uuid4().hex[:8]}")
+    os.makedirs(path)
+    return path, os.getpid()
+
+
+def _save(path, array):
+    """Writes array to path atomically, False if shared memory is full."""
+    tmp_path = osp.join(osp.dirname(path), f".{osp.basename(path)}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+    except OSError:
+        if osp.exists(tmp_path):
+            os.remove(tmp_path)
+        return False
+    return True
+
+
+class SharedSampleCache:
+    """LRU cache of arrays keyed by sample index, shared across worker processes.
+
+    The workers keep a shared running total of the bytes written; the
+    directory is only scanned when it exceeds the budget, and then evicted
+    down to ``EVICT_TO`` of the budget so the next scan is some puts away.
+
+    Args:
+        budget_mb: memory budget of the cache in MB.
+        root: directory holding the cache, /dev/shm by default.
+    """
+
+    EVICT_TO = 0.9
+
+    def __init__(self, budget_mb, root=None):
+        self.budget = int(budget_mb) << 20
+        self.dir, self._owner = _make_dir("svgnet_cache", root)
+        # inherited by the dataloader workers
+        self._size = multiprocessing.Value("q", 0)
+        atexit.register(self.close)
+
+    def _path(self, key):
+        return osp.join(self.dir, f"{key}.npy")
+
+    def get(self, key):
+        """A private copy of the cached array, None on a miss."""
+        path = self._path(key)
+        try:
+            array = np.load(path)
+            os.utime(path)  # mark as recently used
+        except (FileNotFoundError, ValueError):
+            # missing, or evicted by another worker while being read
+            return None
+        return array
+
+    def put(self, key, array):
+        if array.nbytes > self.budget:
+            return
+        # when shared memory is full the sample is served uncached
+        if not _save(self._path(key), array):
+            return
+        with self._size.get_lock():
+            # an estimate, files overwritten or evicted by other workers are counted at the next scan
+            self._size.value += array.nbytes
+            if self._size.value > self.budget:
+                self._size.value = self._evict()
+
+    def _evict(self):
+        """Removes the least recently used files down to EVICT_TO of the budget, returns the size left."""
+        entries = []
+        with os.scandir(self.dir) as it:
+            for entry in it:
+                if not entry.name.endswith(".npy"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.budget * self.EVICT_TO:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        return total
+
+    def close(self):
+        """Removes the cache, only from the process that created it."""
+        if os.getpid() == self._owner:
+            shutil.rmtree(self.dir, ignore_errors=True)
+
+
+class InstanceBank:
+    """Fixed number of instance slots shared by all workers, for cutmix.
+
+    An instance pushed by any worker goes to a random slot, replacing the
+    instance that was there, so the bank is a random sample of the instances
+    seen recently by all workers.
+
+    Args:
+        size: number of slots.
+        max_push: instances of one drawing stored per push, a quarter of the
+            slots by default so a single drawing never takes over the bank.
+        root: directory holding the bank, /dev/shm by default.
+    """
+
+    def __init__(self, size, max_push=None, root=None):
+        self.size = size
+        self.max_push = max_push or max(1, size // 4)
+        self.dir, self._owner = _make_dir("svgnet_bank", root)
+        atexit.register(self.close)
+
+    def push(self, instances):
+        """Stores up to max_push of the instances, in distinct random slots."""
+        if len(instances) > self.max_push:
+            keep = np.random.choice(len(instances), self.max_push, replace=False)
+            instances = [instances[i] for i in keep]
+        slots = np.random.choice(self.size, len(instances), replace=False)
+        for slot, instance in zip(slots, instances):
+            _save(osp.join(self.dir, f"{slot}.npy"), instance)
+
+    def instances(self):
+        """Every instance of the bank."""
+        instances = []
+        for slot in range(self.size):
+            try:
+                instances.append(np.load(osp.join(self.dir, f"{slot}.npy")))
+            except (FileNotFoundError, ValueError):
+                continue
+        return instances
+
+    def close(self):
+        """Removes the bank, only from the process that created it."""
+        if os.getpid() == self._owner:
+            shutil.rmtree(self.dir, ignore_errors=True)
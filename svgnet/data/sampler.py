@@ -0,0 +1,218 @@
+import math
+import random
+from itertools import islice
+
+import numpy as np
+import torch
+from torch.utils.data import Sampler, get_worker_info
+
+
+class BucketBatchSampler(Sampler):
+    """Batch sampler grouping samples of similar size, usable with or without DDP.
+
+    Samples are sorted by size with a random tie break and cut into buckets of
+    ``bucket_batches`` global batches (``batch_size * num_replicas`` samples).
+    Each bucket is shuffled and cut into global batches, and the global batches
+    are shuffled across buckets. Every rank takes an interleaved share of each
+    global batch, so the ranks get batches of the same sizes in the same step
+    and none of them waits on a much larger drawing.
+
+    Args:
+        sizes: size of every sample of the dataset, e.g. its number of points.
+        batch_size: batch size of a rank.
+        bucket_batches: global batches per bucket, larger mixes sizes more.
+        num_replicas, rank: like DistributedSampler, one rank by default.
+        shuffle: shuffle the samples and batches, set_epoch changes the order.
+        drop_last: drop the last incomplete global batch instead of padding it
+            with samples from the start.
+        seed: shared by all ranks so they agree on the batches.
+    """
+
+    def __init__(self, sizes, batch_size, bucket_batches=8, num_replicas=1, rank=0,
+                 shuffle=True, drop_last=False, seed=0):
+        self.sizes = np.asarray(sizes)
+        self.batch_size = batch_size
+        self.bucket_batches = max(1, bucket_batches)
+        self.num_replicas, self.rank = num_replicas, rank
+        self.shuffle, self.drop_last = shuffle, drop_last
+        self.seed, self.epoch = seed, 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        global_batch = self.batch_size * self.num_replicas
+        if self.drop_last:
+            return len(self.sizes) // global_batch
+        return math.ceil(len(self.sizes) / global_batch)
+
+    def __iter__(self):
+        rng = np.random.default_rng(self.seed + self.epoch)
+        global_batch = self.batch_size * self.num_replicas
+        if self.shuffle:
+            order = rng.permutation(len(self.sizes))
+            order = order[np.argsort(self.sizes[order], kind="stable")]
+        else:
+            order = np.argsort(self.sizes, kind="stable")
+
+        num_batches = len(self)
+        num_samples = num_batches * global_batch
+        if num_samples > len(order):
+            # pad by wrapping around, like DistributedSampler
+            order = np.concatenate([order, np.resize(order, num_samples - len(order))])
+        elif self.drop_last and self.shuffle:
+            # drop random samples rather than always the largest ones
+            order = order[np.sort(rng.permutation(len(order))[:num_samples])]
+        else:
+            order = order[:num_samples]
+
+        batches = []
+        bucket_size = self.bucket_batches * global_batch
+        for start in range(0, num_samples, bucket_size):
+            bucket = order[start:start + bucket_size]
+            if self.shuffle:
+                bucket = rng.permutation(bucket)
+            for i in range(0, len(bucket), global_batch):
+                batch = bucket[i:i + global_batch]
+                # interleave by size so every rank gets a similar share
+                batches.append(batch[np.argsort(self.sizes[batch], kind="stable")])
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        for batch in batches:
+            yield batch[self.rank::self.num_replicas].tolist()
+
+
+class TokenBudgetBatchSampler(Sampler):
+    """Batch sampler packing samples up to a budget of points per batch.
+
+    Samples are shuffled, sorted by size within pools of ``pool_size`` samples
+    so that similar sizes are packed together, and greedily packed into
+    batches of at most ``max_points`` points (a larger sample gets a batch of
+    its own). The batches are shuffled and dealt to the ranks; their number is
+    padded to a multiple of ``num_replicas`` by repeating batches, so every
+    rank runs the same number of steps.
+
+    Args:
+        sizes: size of every sample of the dataset, e.g. its number of points.
+        max_points: budget of points of a batch.
+        num_replicas, rank: like DistributedSampler, one rank by default.
+        shuffle: shuffle the samples and batches, set_epoch changes the order.
+        pool_size: samples sorted together before packing.
+        seed: shared by all ranks so they agree on the batches.
+    """
+
+    def __init__(self, sizes, max_points, num_replicas=1, rank=0, shuffle=True, pool_size=1024, seed=0):
+        self.sizes = np.asarray(sizes)
+        self.max_points = max_points
+        self.num_replicas, self.rank = num_replicas, rank
+        self.shuffle, self.pool_size = shuffle, max(1, pool_size)
+        self.seed, self.epoch = seed, 0
+        self._batches = None
+
+    def set_epoch(self, epoch):
+        if epoch != self.epoch:
+            self.epoch, self._batches = epoch, None
+
+    def _pack(self):
+        rng = np.random.default_rng(self.seed + self.epoch)
+        order = rng.permutation(len(self.sizes)) if self.shuffle else np.arange(len(self.sizes))
+        batches = []
+        for start in range(0, len(order), self.pool_size):
+            pool = order[start:start + self.pool_size]
+            pool = pool[np.argsort(self.sizes[pool], kind="stable")]
+            batch, points = [], 0
+            for i in pool:
+                if batch and points + self.sizes[i] > self.max_points:
+                    batches.append(batch)
+                    batch, points = [], 0
+                batch.append(int(i))
+                points += self.sizes[i]
+            if batch:
+                batches.append(batch)
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        # pad by wrapping around, like DistributedSampler
+        num_batches = -(-len(batches) // self.num_replicas) * self.num_replicas
+        return batches + batches[:num_batches - len(batches)]
+
+    def batches(self):
+        """Batches of all ranks for the current epoch."""
+        if self._batches is None:
+            self._batches = self._pack()
+        return self._batches
+
+    def __len__(self):
+        return len(self.batches()) // self.num_replicas
+
+    def __iter__(self):
+        yield from self.batches()[self.rank::self.num_replicas]
+
+
+class SeededBatch(list):
+    """Indices of a batch with the seed its worker draws the augmentations from."""
+
+    def __init__(self, indices, seed):
+        super().__init__(indices)
+        self.seed = seed
+
+
+def seed_batch(indices):
+    """Reseeds the RNGs of a loader worker for a batch of ``ResumableBatchSampler``.
+
+    Without workers the batches are loaded in the trainer process, or its
+    prefetch thread, where reseeding would also reset the dropout and batch
+    augmentation of the training step; the augmentations then draw from the
+    RNGs of the process, which the checkpoints restore.
+    """
+    seed = getattr(indices, "seed", None)
+    if seed is None or get_worker_info() is None:
+        return
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+
+class ResumableBatchSampler(Sampler):
+    """Wraps a batch sampler so an epoch can restart at any batch.
+
+    The wrapped sampler must give the same batches for the same epoch (the
+    samplers above, or a DistributedSampler for the plain shuffle). ``skip``
+    makes the next iteration start at a given batch without loading the
+    batches before it, and every batch carries a seed derived from the seed,
+    the epoch, the rank and its position, which the datasets reseed their
+    workers with (see ``seed_batch``). The augmentations then depend only on
+    the position in the epoch, not on the worker that loads the batch, so a
+    resumed epoch sees the same batches as the interrupted one. Without
+    workers they follow the RNGs of the process instead. Cutmix draws
+    from the instance bank, whose content depends on the timing of the
+    workers, and stays approximate.
+
+    Args:
+        batch_sampler: the batch sampler to wrap.
+        seed: shared by all ranks, like the samplers above.
+        rank: rank of the process, so the ranks draw different augmentations.
+    """
+
+    def __init__(self, batch_sampler, seed=0, rank=0):
+        self.batch_sampler = batch_sampler
+        self.seed, self.rank = seed, rank
+        self.epoch, self.start = 0, 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+        for sampler in (self.batch_sampler, getattr(self.batch_sampler, "sampler", None)):
+            if hasattr(sampler, "set_epoch"):
+                sampler.set_epoch(epoch)
+
+    def skip(self, num_batches):
+        """Starts the next iteration at batch ``num_batches``."""
+        self.start = num_batches
+
+    def __len__(self):
+        return len(self.batch_sampler)
+
+    def __iter__(self):
+        start, self.start = self.start, 0
+        for i, batch in enumerate(islice(self.batch_sampler, start, None), start):
+            seed = np.random.SeedSequence([self.seed, self.epoch, self.rank, i]).generate_state(1)[0]
+            yield SeededBatch(batch, int(seed))
@@ -0,0 +1,166 @@
+"""Sharded storage of a split.
+
+``pack_shards`` concatenates the ``.npz`` bytes of every drawing of a split
+into a few large shard files and writes an ``index.json`` with the shard,
+byte offset, length and primitive count of each drawing. Datasets then read a
+drawing with one seek (or an mmap slice) into an already open file instead of
+opening a small file per sample.
+"""
+import json
+import mmap
+import os
+import os.path as osp
+
+import numpy as np
+
+from .drawing_io import count_primitives, decode_drawing, encode_drawing, list_drawings, load_drawing
+
+SHARD_INDEX = "index.json"
+# primitive counts of a directory of drawings, keyed by file name, mtime and size
+# (hidden, so list_drawings never mistakes it for a json drawing)
+COUNT_INDEX = ".num_primitives.json"
+
+
+def pack_shards(data_root, out_dir, shard_bytes=1 << 30):
+    """Packs the drawings of data_root into shards of about shard_bytes each.
+
+    Returns:
+        the number of drawings and of shards written.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    shards, drawings = [], []
+    out = None
+    for file in list_drawings(data_root):
+        drawing = load_drawing(file)
+        buf = encode_drawing(drawing)
+        if out is None or (out.tell() and out.tell() + len(buf) > shard_bytes):
+            if out is not None:
+                out.close()
+            shards.append(f"shard_{len(shards):05d}.bin")
+            out = open(osp.join(out_dir, shards[-1]), "wb")
+        drawings.append({
+            "name": osp.splitext(osp.basename(file))[0] + ".npz",
+            "shard": len(shards) - 1,
+            "offset": out.tell(),
+            "length": len(buf),
+            "num_primitives": int(drawing["commands"].shape[0]),
+        })
+        out.write(buf)
+    if out is not None:
+        out.close()
+    # the index is written last, a pack is only usable once complete
+    tmp_file = osp.join(out_dir, SHARD_INDEX + ".tmp")
+    with open(tmp_file, "w") as f:
+        json.dump({"shards": shards, "drawings": drawings}, f)
+    os.replace(tmp_file, osp.join(out_dir, SHARD_INDEX))
+    return len(drawings), len(shards)
+
+
+class DrawingFiles:
+    """Drawings stored one per file, as written by parse_svg."""
+
+    def __init__(self, data_root):
+        self.data_root = data_root
+        self.names = list_drawings(data_root)
+        self._num_primitives = None
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def num_primitives(self):
+        """Primitive count of every drawing, kept in a small index next to the files."""
+        if self._num_primitives is None:
+            self._num_primitives = self._count_primitives()
+        return self._num_primitives
+
+    def _count_primitives(self):
+        index_file = osp.join(self.data_root, COUNT_INDEX)
+        index = {}
+        if osp.exists(index_file):
+            with open(index_file) as f:
+                index = json.load(f)
+        counts, changed = [], False
+        for name in self.names:
+            stat = os.stat(name)
+            key, stamp = osp.basename(name), [stat.st_mtime_ns, stat.st_size]
+            if key not in index or index[key][:2] != stamp:
+                index[key] = stamp + [int(count_primitives(name))]
+                changed = True
+            counts.append(index[key][2])
+        if changed:
+            try:
+                tmp_file = index_file + ".tmp"
+                with open(tmp_file, "w") as f:
+                    json.dump(index, f)
+                os.replace(tmp_file, index_file)
+            except OSError:
+                pass  # read-only data, counted again next time
+        return np.array(counts, dtype=np.int64)
+
+    def load(self, i):
+        return load_drawing(self.names[i])
+
+
+class ShardedDrawings:
+    """Drawings packed by :func:`pack_shards`, read by seeking into the shards.
+
+    Shard files are opened lazily by each process, so dataloader workers never
+    share a file position.
+
+    Args:
+        data_root: directory of the shards and their index.
+        use_mmap: map the shards in memory instead of seeking and reading.
+    """
+
+    def __init__(self, data_root, use_mmap=False):
+        self.data_root, self.use_mmap = data_root, use_mmap
+        with open(osp.join(data_root, SHARD_INDEX)) as f:
+            index = json.load(f)
+        self.shards = index["shards"]
+        drawings = index["drawings"]
+        self.names = [osp.join(data_root, d["name"]) for d in drawings]
+        self.shard_ids = np.array([d["shard"] for d in drawings], dtype=np.int64)
+        self.offsets = np.array([d["offset"] for d in drawings], dtype=np.int64)
+        self.lengths = np.array([d["length"] for d in drawings], dtype=np.int64)
+        self.num_primitives = np.array([d["num_primitives"] for d in drawings], dtype=np.int64)
+        self._files, self._pid = {}, None
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_files"], state["_pid"] = {}, None
+        return state
+
+    def _shard(self, shard_id):
+        if self._pid != os.getpid():
+            self._files, self._pid = {}, os.getpid()
+        if shard_id not in self._files:
+            f = open(osp.join(self.data_root, self.shards[shard_id]), "rb")
+            if self.use_mmap:
+                self._files[shard_id] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                f.close()
+            else:
+                self._files[shard_id] = f
+        return self._files[shard_id]
+
+    def read(self, i):
+        """Raw bytes of the i-th drawing."""
+        shard = self._shard(self.shard_ids[i])
+        offset, length = self.offsets[i], self.lengths[i]
+        if self.use_mmap:
+            return memoryview(shard)[offset:offset + length]
+        shard.seek(offset)
+        return shard.read(length)
+
+    def load(self, i):
+        return decode_drawing(self.read(i))
+
+
+def open_drawings(data_root, use_mmap=False):
+    """Drawings of a directory, packed in shards if it has a shard index."""
+    if osp.exists(osp.join(data_root, SHARD_INDEX)):
+        return ShardedDrawings(data_root, use_mmap)
+    return DrawingFiles(data_root)
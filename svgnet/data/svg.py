@@ -3,11 +3,13 @@ import torch
 from torch.utils.data import Dataset
 
 import os.path as osp
-from glob import glob
-import json
 import math
 import random
 from .aug_utils import *
+from .sample_cache import InstanceBank, SharedSampleCache
+from .sampler import seed_batch
+from .shards import open_drawings
+from .targets import instance_targets
 
 SVG_CATEGORIES = [
     #1-6 doors
@@ -55,29 +57,54 @@ SVG_CATEGORIES = [
     {"color": [0, 0, 0], "isthing": 0, "id": 36, "name": "bg"},
 ]
 
+# drawings are padded to this many points unless padding is off
+PAD_POINTS = 2048
+
 class SVGDataset(Dataset):
 
     CLASSES = tuple([x["name"] for x in SVG_CATEGORIES])
 
-    def __init__(self, data_root, split,data_norm,aug, repeat=1, logger=None):
+    def __init__(self, data_root, split,data_norm,aug, repeat=1, use_mmap=False, padding=True, cache_mb=0, batch_aug=False, logger=None):
         
         self.split = split
         self.data_norm = data_norm
         self.aug = aug
+        # leave flips, rotations, shift, scale, shuffle and norm to BatchAugmentation
+        self.batch_aug = batch_aug
         self.repeat = repeat
-        self.data_list = glob(osp.join(data_root,"*.json"))
+        # pad every drawing to PAD_POINTS with background points, or feed only its primitives
+        self.min_points = PAD_POINTS if padding else 1
+        # a directory of drawings, or of shards packed by pack_shards.py
+        self.drawings = open_drawings(data_root, use_mmap)
+        self.data_list = self.drawings.names
         logger.info(f"Load {split} dataset: {len(self.data_list)} svg")
         self.data_idx = np.arange(len(self.data_list))
+        if not padding:
+            num = self.drawings.num_primitives
+            fed, padded = num.sum(), np.maximum(num, PAD_POINTS).sum()
+            logger.info(f"Padding-free {split}: {fed} points per pass instead of {padded} "
+                        f"({100 * (1 - fed / max(padded, 1)):.1f}% fewer points through the backbone and decoder)")
+        # decoded drawings shared by the dataloader workers, augmentation runs on a copy
+        self.cache = SharedSampleCache(cache_mb) if cache_mb > 0 else None
+        if self.cache is not None:
+            logger.info(f"Cache {split} samples in {self.cache.dir} (budget {cache_mb} MB)")
         
-        self.instance_queues = []
+        # instances of all workers for cutmix, replaced at random once full
+        self.instance_bank = None
+        if split == "train" and self.aug and self.aug.cutmix.enable:
+            self.instance_bank = InstanceBank(self.aug.cutmix.queueK)
 
     def __len__(self):
         return len(self.data_list)*self.repeat
+
+    def sample_sizes(self):
+        """Number of points of every sample, from the primitive counts of the drawing index."""
+        num = np.maximum(self.drawings.num_primitives, self.min_points)
+        return num[self.data_idx[np.arange(len(self)) % len(self.data_idx)]]
     
     @staticmethod
-    def load(json_file,idx,min_points=2048):
-        data = json.load(open(json_file))
-        args = np.array(data["args"]).reshape(-1,8)/ 140
+    def load(data,idx,min_points=PAD_POINTS):
+        args = data["args"].reshape(-1,8).astype(np.float64) / 140
         num = args.shape[0]
         max_num = max(num,min_points)
         
@@ -94,11 +121,11 @@ class SVGDataset(Dataset):
         coord[:num,2] = coord_z
        
         lengths = np.zeros(max_num)
-        lengths[:num] = np.array(data["lengths"])
+        lengths[:num] = data["lengths"]
         
         feat = np.zeros((max_num,6))
         arc = np.arctan(coord_y/(coord_x + 1e-8)) / math.pi
-        lens = np.array(data["lengths"]).clip(0,140) / 140
+        lens = data["lengths"].clip(0,140) / 140
         ctype = np.eye(4)[data["commands"]]
         
         feat[:num,0] = arc
@@ -106,35 +133,79 @@ class SVGDataset(Dataset):
         feat[:num,2:] = ctype
         
         semanticIds = np.full_like(coord[:,0],35) # bg sem id = 35
-        seg = np.array(data["semanticIds"])
+        seg = data["semanticIds"]
         semanticIds[:num] = seg
         semanticIds = semanticIds.astype(np.int64)
         
         instanceIds = np.full_like(coord[:,0],-1) # stuff id = -1
-        ins = np.array(data["instanceIds"])
+        ins = data["instanceIds"].astype(np.int64)
         valid_pos = ins != -1
-        ins[valid_pos] += idx*min_points
+        ins[valid_pos] += idx*PAD_POINTS  # avoid repeat id
         
         instanceIds[:num] = ins
         instanceIds = instanceIds.astype(np.int64)
         label = np.concatenate([semanticIds[:,None],instanceIds[:,None]],axis=1)
         return coord, feat, label,lengths
 
+    def load_sample(self, data_idx, idx):
+        if self.cache is None:
+            return SVGDataset.load(self.drawings.load(data_idx),idx,self.min_points)
+        # cached without the instance offset, which depends on idx
+        sample = self.cache.get(data_idx)
+        if sample is None:
+            coord, feat, label, lengths = SVGDataset.load(self.drawings.load(data_idx),0,self.min_points)
+            sample = np.concatenate([coord, feat, label, lengths[:,None]],axis=1)
+            self.cache.put(data_idx, sample)
+        coord, feat, lengths = sample[:,:3], sample[:,3:9], sample[:,11]
+        label = sample[:,9:11].astype(np.int64)
+        valid_pos = label[:,1] != -1
+        label[valid_pos,1] += idx*PAD_POINTS
+        return coord, feat, label, lengths
+
     def __getitem__(self, idx):
         
         data_idx = self.data_idx[idx % len(self.data_idx)]
         json_file = self.data_list[data_idx]
-        coord, feat, label,lengths = SVGDataset.load(json_file,idx)
+        coord, feat, label,lengths = self.load_sample(data_idx, idx)
         
         if self.split=="train":
-            return self.transform_train(coord, feat, label)
+            return (*(self.transform_train(coord, feat, label)), json_file)
         else:
             return (*(self.transform_test(coord, feat, label,lengths)), json_file)
             # print(f"self.split is test: {len((self.transform_test(coord, feat, label, lengths), json_file))}")
             # return (self.transform_test(coord, feat, label,lengths), json_file)
+
+    def __getitems__(self, indices):
+        # batches of a ResumableBatchSampler carry the seed of their augmentations
+        seed_batch(indices)
+        return [self[idx] for idx in indices]
     
     def transform_train(self,coord, feat, label):
         
+        if not self.batch_aug:
+            coord, feat = self.augment(coord, feat)
+        coord, feat, label = self.cutmix(coord, feat, label)
+        if self.batch_aug:
+            # the rest runs on the collated batch, see BatchAugmentation
+            return torch.FloatTensor(coord), torch.FloatTensor(feat), torch.LongTensor(label) , None
+        feat[:,0] = np.arctan(coord[:,1]/(coord[:,0] + 1e-8)) / math.pi     # feature should be change
+        
+        # shuffle
+        shuf_idx = np.arange(coord.shape[0])
+        np.random.shuffle(shuf_idx)
+        coord, feat = coord[shuf_idx], feat[shuf_idx]
+        if label is not None:
+            label = label[shuf_idx]
+            
+        # coord norm
+        if self.data_norm == 'mean':
+            coord -= np.mean(coord, 0)
+        elif self.data_norm == 'min':
+            coord -= np.min(coord, 0)
+        return torch.FloatTensor(coord), torch.FloatTensor(feat), torch.LongTensor(label) , None
+
+    def augment(self,coord, feat):
+        
         # hflip
         if self.aug.hflip and np.random.rand() < self.aug.aug_prob:
             args = RandomHorizonFilp(coord[:,:2],width=1)
@@ -169,7 +240,10 @@ class SVGDataset(Dataset):
             scale = np.random.uniform(_min, _max,1)
             coord *= scale
             feat[:,1] = feat[:,1] * scale
-            
+        return coord, feat
+
+    def cutmix(self,coord, feat, label):
+        
         mix_coord, mix_feat, mix_label = [], [], []
         mix_coord.append(coord)
         mix_feat.append(feat)
@@ -178,45 +252,25 @@ class SVGDataset(Dataset):
         # random cutmix
         if self.aug.cutmix.enable and np.random.rand() < self.aug.aug_prob:
             
-            unique_label = np.unique(label,axis=0)
-            for sem,ins in unique_label:
-                if sem >=30: continue
-                valid = np.logical_and(label[:,0]==sem,label[:,1]==ins)
-                if len(self.instance_queues)<=self.aug.cutmix.queueK: 
-                    self.instance_queues.insert(0,{
-                        "coord":coord[valid],
-                        "feat": feat[valid],
-                        "label": label[valid]
-                        })
-                else:
-                    self.instance_queues.pop()
+            # split the thing instances in one pass, grouping rows by their (sem, ins) pair
+            things = np.where(label[:,0] < 30)[0]
+            _, inverse, counts = np.unique(label[things], axis=0, return_inverse=True, return_counts=True)
+            groups = np.split(things[np.argsort(inverse.reshape(-1), kind="stable")], np.cumsum(counts)[:-1])
+            sample = np.concatenate([coord, feat, label],axis=1)
+            instances = self.instance_bank.instances()
+            self.instance_bank.push([sample[rows] for rows in groups if len(rows)])
             _min, _max = self.aug.cutmix.relative_shift
             rand_pos = np.random.uniform(_min, _max,3)
             rand_pos[2] = 0
-            for instance in self.instance_queues:
-                mix_coord.append(instance["coord"]+rand_pos) # random shift
-                mix_feat.append(instance["feat"])
-                mix_label.append(instance["label"])
+            for instance in instances:
+                mix_coord.append(instance[:,:3]+rand_pos) # random shift
+                mix_feat.append(instance[:,3:9])
+                mix_label.append(instance[:,9:11].astype(np.int64))
         
         coord = np.concatenate(mix_coord,axis=0)
         feat = np.concatenate(mix_feat,axis=0)
-        feat[:,0] = np.arctan(coord[:,1]/(coord[:,0] + 1e-8)) / math.pi     # feature should be change
-        
         label = np.concatenate(mix_label,axis=0)
-        
-        # shuffle
-        shuf_idx = np.arange(coord.shape[0])
-        np.random.shuffle(shuf_idx)
-        coord, feat = coord[shuf_idx], feat[shuf_idx]
-        if label is not None:
-            label = label[shuf_idx]
-            
-        # coord norm
-        if self.data_norm == 'mean':
-            coord -= np.mean(coord, 0)
-        elif self.data_norm == 'min':
-            coord -= np.min(coord, 0)
-        return torch.FloatTensor(coord), torch.FloatTensor(feat), torch.LongTensor(label) , None
+        return coord, feat, label
 
     def transform_test(self,coord, feat, label,lengths):
         
@@ -235,5 +289,8 @@ class SVGDataset(Dataset):
             count += item.shape[0]
             offset.append(count)
         lengths = torch.cat(lengths) if lengths[0] is not None else None
-        return torch.cat(coord), torch.cat(feat), torch.cat(label), torch.IntTensor(offset),lengths, json_file
+        label = torch.cat(label)
+        # instance targets are grouped here in the workers instead of in the forward pass
+        extra = {"targets": instance_targets(label)}
+        return torch.cat(coord), torch.cat(feat), label, torch.IntTensor(offset),lengths, extra, json_file
   
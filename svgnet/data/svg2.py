@@ -3,11 +3,13 @@ import torch
 from torch.utils.data import Dataset
 
 import os.path as osp
-from glob import glob
-import json
 import math
 import random
 from .aug_utils2 import *
+from .drawing_io import NUM_NEIGHBORS
+from .sampler import seed_batch
+from .shards import open_drawings
+from .targets import instance_targets
 SVG_CATEGORIES = [
     #1-6 doors
     {"color": [224, 62, 155], "isthing": 1, "id": 1, "name": "single door"},
@@ -57,14 +59,16 @@ SVG_CATEGORIES = [
 class SVGDataset(Dataset):
 
 
-    def __init__(self, data_root, split,data_norm, aug, repeat=1, logger=None):
+    def __init__(self, data_root, split,data_norm, aug, repeat=1, use_mmap=False, padding=True, logger=None):
         
         self.split = split
         self.data_norm = data_norm
         self.aug = aug
         self.repeat = repeat
+        self.min_points = 2048 if padding else 1
         
-        self.data_list = glob(osp.join(data_root,split,"*.json"))
+        self.drawings = open_drawings(data_root, use_mmap)
+        self.data_list = self.drawings.names
         logger.info(f"Load {split} dataset: {len(self.data_list)} svg")
         self.data_idx = np.arange(len(self.data_list))
         
@@ -72,22 +76,24 @@ class SVGDataset(Dataset):
         
     def __len__(self):
         return len(self.data_list)*self.repeat
+
+    def sample_sizes(self):
+        """Number of points of every sample, from the primitive counts of the drawing index."""
+        num = np.maximum(self.drawings.num_primitives + 1, self.min_points)
+        return num[self.data_idx[np.arange(len(self)) % len(self.data_idx)]]
     
     
-    def load(self, json_file, idx ):
+    def load(self, data, idx ):
         
-        json_file = json_file.replace(".svg",".json")
-        data = json.load(open(json_file))
-        width, height = data["width"], data["height"]
-        coords = data["args"]
-        coords = np.array(coords).reshape(-1,4,2)
-        neighbors = np.array(data["neighbors"]).reshape(-1,16)
+        width, height = data["width"].item(), data["height"].item()
+        coords = data["args"].reshape(-1,4,2).astype(np.float64)
+        neighbors = data["neighbors"].reshape(-1,NUM_NEIGHBORS).astype(np.int64)
         
-        lens = np.array(data["lengths"])
-        ctypes = np.array(data["commands"])
+        lens = data["lengths"].astype(np.float64)
+        ctypes = data["commands"].astype(np.int64)
         
-        seg = np.array(data["semanticIds"])
-        ins = np.array(data["instanceIds"])
+        seg = data["semanticIds"].astype(np.int64)
+        ins = data["instanceIds"].astype(np.int64)
         
         valid_pos = ins != -1
         ins[valid_pos] += idx*2048  # avoid repeat id
@@ -138,18 +144,18 @@ class SVGDataset(Dataset):
         theta_radians = np.arctan(slopes)
         return theta_radians
     
-    def extract_feat(self,coords, lens, labels, ctypes, neighbors, width, height, k=4):
+    def extract_feat(self,coords, lens, labels, ctypes, neighbors, width, height, k=NUM_NEIGHBORS):
         
-        min_points = 2048
         num = coords.shape[0]
-        max_num = max(num+1,min_points) # pad one
+        max_num = max(num+1,self.min_points) # pad one
         coords[:, :, 0] = coords[:, :, 0] / width
         coords[:, :, 1] = coords[:, :, 1] / height
         
+        # missing neighbors (and every neighbor of a padding point) are the point itself,
+        # like knnquery pads small clouds, so the graph can stand in for the backbone knn
         _neighbors = neighbors[:,:k]
-        neighbors = np.full_like(np.zeros((max_num,k)),-1)
-        neighbors[:num] = _neighbors
-        neighbors = neighbors.astype(np.int64)
+        neighbors = np.repeat(np.arange(max_num)[:,None],k,axis=1)
+        neighbors[:num] = np.where(_neighbors>=0, _neighbors, neighbors[:num])
         
         coord = np.zeros((max_num,3))
         coord[:num,0] = coords.mean(1)[:, 0]
@@ -176,7 +182,10 @@ class SVGDataset(Dataset):
         label[:, 1] = -1
         label[:num] = labels
         
-        return coord, feat, label, neighbors
+        lengths = np.zeros(max_num)
+        lengths[:num] = lens * max_lengths
+        
+        return coord, feat, label, neighbors, lengths
    
     
     def transform(self, coords, lens, labels, ctypes, neighbors, width, height):
@@ -187,25 +196,22 @@ class SVGDataset(Dataset):
             coords, lens, ctypes, neighbors, labels = self.train_aug(
                 coords, lens, labels, ctypes, neighbors, width, height
                 )
-            coord, feat, label, neighbors = self.extract_feat(coords, lens, labels, 
+            coord, feat, label, neighbors, lengths = self.extract_feat(coords, lens, labels, 
                                                               ctypes, neighbors, width, height)
             
-            # shuffle
-            shuf_idx = np.arange(coord.shape[0])
-            np.random.shuffle(shuf_idx)
+            # shuffle, neighbors are remapped through the inverse permutation
+            shuf_idx = np.random.permutation(coord.shape[0])
+            inv_idx = np.empty_like(shuf_idx)
+            inv_idx[shuf_idx] = np.arange(shuf_idx.shape[0])
             coord = coord[shuf_idx]
             feat = feat[shuf_idx]
             label = label[shuf_idx]
-            
-            neighbors[neighbors<=-1] = coord.shape[0] - 1 
-            neighbors= neighbors[shuf_idx]
-            index_map = {old: new  for new, old in enumerate(shuf_idx)}
-            neighbors = np.vectorize(index_map.get)(neighbors)
+            lengths = lengths[shuf_idx]
+            neighbors = inv_idx[neighbors[shuf_idx]]
             
         else:
-            coord, feat, label, neighbors = self.extract_feat(coords, lens, labels, ctypes, 
+            coord, feat, label, neighbors, lengths = self.extract_feat(coords, lens, labels, ctypes, 
                                                               neighbors, width, height)
-            neighbors[neighbors<=-1] = coord.shape[0] - 1 
         
             
         # coord norm
@@ -213,18 +219,20 @@ class SVGDataset(Dataset):
             coord -= np.mean(coord, 0)
         elif self.data_norm == 'min':
             coord -= np.min(coord, 0)
-        return torch.FloatTensor(coord), torch.FloatTensor(feat), torch.LongTensor(label), torch.LongTensor(neighbors), torch.FloatTensor(lens)
+        return torch.FloatTensor(coord), torch.FloatTensor(feat), torch.LongTensor(label), torch.FloatTensor(lengths), torch.LongTensor(neighbors)
     
     
-
-    
     def __getitem__(self, idx):
         
         data_idx = self.data_idx[idx % len(self.data_idx)]
         json_file = self.data_list[data_idx]
-        
-        coords, lens, ctypes, neighbors, labels, width, height = self.load(json_file, idx)
-        return self.transform(coords, lens, labels, ctypes, neighbors, width, height)
+        coords, lens, ctypes, neighbors, labels, width, height = self.load(self.drawings.load(data_idx), idx)
+        return (*self.transform(coords, lens, labels, ctypes, neighbors, width, height), json_file)
+
+    def __getitems__(self, indices):
+        # batches of a ResumableBatchSampler carry the seed of their augmentations
+        seed_batch(indices)
+        return [self[idx] for idx in indices]
        
         
     def find_positions(self,lst, arr):
@@ -233,11 +241,13 @@ class SVGDataset(Dataset):
         return get_index(arr, -1)
 
     def collate_fn(self,batch):
-        coord, feat, label, neighbors,lengths = list(zip(*batch))
+        coord, feat, label, lengths, neighbors, json_file = list(zip(*batch))
         offset, count = [], 0
         for item in coord:
             count += item.shape[0]
             offset.append(count)
-        lengths = torch.cat(lengths) if lengths[0] is not None else None
-        return torch.cat(coord), torch.cat(feat), torch.cat(label), torch.IntTensor(offset), lengths
-  
+        # neighbors index the concatenated batch
+        neighbors = torch.cat([item + start for item, start in zip(neighbors, [0] + offset[:-1])])
+        label = torch.cat(label)
+        extra = {"knn_idx": neighbors, "targets": instance_targets(label)}
+        return torch.cat(coord), torch.cat(feat), label, torch.IntTensor(offset), torch.cat(lengths), extra, json_file
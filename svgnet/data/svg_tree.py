@@ -0,0 +1,137 @@
+"""Traversal of the primitives of an svg tree.
+
+iter_primitives works on both lxml and xml.etree trees, the streaming helpers
+parse the file incrementally with lxml and never hold the whole tree.
+"""
+from lxml import etree
+
+PRIMITIVE_TAGS = ("path", "circle", "ellipse", "polyline", "polygon")
+# elements whose children are streamed one by one by stream_rewrite
+CONTAINER_TAGS = ("svg", "g", "defs", "a", "switch", "symbol", "clipPath", "mask", "pattern", "marker")
+
+
+def iter_primitives(root, tags=PRIMITIVE_TAGS):
+    """Yields every primitive of the tree exactly once, in document order.
+
+    Yields:
+        (prim_idx, elem, layer, layer_id): prim_idx counts the primitives in document
+        order and is stable across parses of the same file, layer is the closest
+        enclosing <g> and layer_id its 1-based position among all <g> in document
+        order. Primitives outside of any <g> belong to the root with layer_id 0.
+    """
+    ns = root.tag[:-3]
+    g_tag = ns + "g"
+    wanted = {ns + tag for tag in tags}
+    prim_idx, num_layers = 0, 0
+    stack = [(root, root, 0)]
+    while stack:
+        elem, layer, layer_id = stack.pop()
+        if elem.tag == g_tag:
+            num_layers += 1
+            layer, layer_id = elem, num_layers
+        elif elem.tag in wanted:
+            yield prim_idx, elem, layer, layer_id
+            prim_idx += 1
+            continue
+        stack.extend((child, layer, layer_id) for child in reversed(elem))
+
+
+def _release(elem):
+    """Frees an element handled by iterparse along with its already handled siblings."""
+    elem.clear(keep_tail=True)
+    parent = elem.getparent()
+    if parent is not None:
+        while elem.getprevious() is not None:
+            del parent[0]
+
+
+def read_root(source):
+    """Root element of an svg with its attributes, read without parsing the rest of the file."""
+    for _, root in etree.iterparse(source, events=("start",), huge_tree=True):
+        return root
+
+
+def iterparse_primitives(source, tags=PRIMITIVE_TAGS):
+    """Streaming version of :func:`iter_primitives` based on lxml iterparse.
+
+    The file is parsed incrementally and every element is freed once handled, so
+    memory does not grow with the size of the file. A yielded element is only
+    valid until the next iteration: its attributes and those of its ancestors
+    can be read, its preceding siblings are gone.
+    """
+    prim_idx, num_layers = 0, 0
+    layers = []  # (elem, layer_id) of the root and the open <g>
+    inside = 0  # depth inside a primitive, whose content is not traversed
+    for event, elem in etree.iterparse(source, events=("start", "end"), huge_tree=True):
+        if not layers:
+            ns = elem.tag[:-3]
+            g_tag = ns + "g"
+            wanted = {ns + tag for tag in tags}
+            layers.append((elem, 0))
+            continue
+        if event == "start":
+            if inside or elem.tag in wanted:
+                inside += 1
+            elif elem.tag == g_tag:
+                num_layers += 1
+                layers.append((elem, num_layers))
+            continue
+        if inside:
+            inside -= 1
+            if inside:
+                continue
+            layer, layer_id = layers[-1]
+            yield prim_idx, elem, layer, layer_id
+            prim_idx += 1
+        elif elem.tag == g_tag:
+            layers.pop()
+        _release(elem)
+
+
+def stream_rewrite(source, out_file, transform):
+    """Copies an svg to out_file element by element, with bounded memory.
+
+    Containers (CONTAINER_TAGS) are written as they open and close, with their
+    text, and comments and processing instructions between elements are copied.
+    Any other element is handed to ``transform`` once fully parsed, which returns
+    the element to write in its place or None to drop it, along with its tail.
+    """
+    with etree.xmlfile(out_file, encoding="utf-8") as xf:
+        opened = []  # contexts of the open containers
+        depth = 0  # depth inside a non container element
+        # (elem, "text" or "tail") still to write, only parsed by the time of the next event
+        pending = None
+        for event, elem in etree.iterparse(source, events=("start", "end", "comment", "pi"), huge_tree=True):
+            if depth and event != "end":
+                if event == "start":
+                    depth += 1
+                continue
+            if pending is not None:
+                text = getattr(*pending)
+                if text:
+                    xf.write(text)
+                pending = None
+            if event in ("comment", "pi"):
+                xf.write(elem, with_tail=False)
+                pending = (elem, "tail")
+            elif event == "start":
+                if etree.QName(elem).localname not in CONTAINER_TAGS:
+                    depth += 1
+                    continue
+                container = xf.element(elem.tag, dict(elem.attrib), nsmap=None if opened else elem.nsmap)
+                container.__enter__()
+                opened.append(container)
+                pending = (elem, "text")
+                continue
+            elif depth:
+                depth -= 1
+                if depth:
+                    continue
+                new_elem = transform(elem)
+                if new_elem is not None:
+                    xf.write(new_elem, with_tail=False)
+                    pending = (elem, "tail")
+            else:
+                opened.pop().__exit__(None, None, None)
+                pending = (elem, "tail")
+            _release(elem)
@@ -0,0 +1,31 @@
+import torch
+
+
+def instance_targets(label, bg_sem=35, bg_ins=-1):
+    """Groups the points of a batch into instance targets in one pass.
+
+    Every (semantic id, instance id) pair but the background is a target,
+    in order of first appearance. A point belongs to at most one target, so
+    the masks are kept as the target index of every point; dense masks are
+    never built.
+
+    Args:
+        label: (n, 2) semantic and instance id of every point.
+    Returns:
+        dict with "labels", the (k,) semantic id of every target, and "ids",
+        the (n,) target of every point, -1 for the background.
+    """
+    label = torch.as_tensor(label)
+    num = label.shape[0]
+    keys, inverse = torch.unique(label, dim=0, return_inverse=True)
+    # order the targets by their first point: the head of each key in a stable sort of the points
+    sorted_inverse, points = torch.sort(inverse, stable=True)
+    head = torch.ones_like(sorted_inverse, dtype=torch.bool)
+    head[1:] = sorted_inverse[1:] != sorted_inverse[:-1]
+    first = torch.full((keys.shape[0],), num, dtype=torch.long, device=label.device)
+    first[sorted_inverse[head]] = points[head]
+    order = torch.argsort(first)
+    keep = ~((keys[order, 0] == bg_sem) & (keys[order, 1] == bg_ins))
+    rank = torch.full_like(order, -1)
+    rank[order[keep]] = torch.arange(int(keep.sum()), device=label.device)
+    return {"labels": keys[order[keep], 0], "ids": rank[inverse]}
@@ -117,27 +117,34 @@ class InstanceEval(object):
         """Updates evaluation metrics based on detected instances and ground truth targets.
         
         Args:
-            instances (list): List of detected instances.
-            target (dict): Dictionary containing ground truth labels and masks.
+            instances (list): List of detected instances, with the indices of their points.
+            target (dict): Dictionary containing ground truth labels and the target of every point.
             lengths (torch.Tensor): Length of each detected object instance.
         """
         lengths = np.round( np.log(1 + lengths.cpu().numpy()) , 3)
         tgt_labels = target["labels"].cpu().numpy().tolist()
-        tgt_masks = target["masks"].transpose(0,1).cpu().numpy()
-        for tgt_label, tgt_mask in zip(tgt_labels, tgt_masks):
+        tgt_ids = target["ids"].cpu().numpy()
+        num_targets = len(tgt_labels)
+        # summed lengths of every target and of its intersection with every instance
+        tgt_area = np.bincount(tgt_ids + 1, weights=lengths, minlength=num_targets + 1)[1:]
+        instances = [instance for instance in instances
+                     if instance["labels"]!=self.ignore_label and instance["scores"]>=self.min_obj_score]
+        inter_area = np.zeros((len(instances), num_targets))
+        src_area = np.zeros(len(instances))
+        for i, instance in enumerate(instances):
+            points = instance["points"]
+            inter_area[i] = np.bincount(tgt_ids[points] + 1, weights=lengths[points],
+                                        minlength=num_targets + 1)[1:]
+            src_area[i] = lengths[points].sum()
+        ious = inter_area / (src_area[:, None] + tgt_area[None, :] - inter_area + 1e-6)
+        
+        for j, tgt_label in enumerate(tgt_labels):
             if tgt_label==self.ignore_label: continue
 
             flag = False
-            for instance in instances:
+            for i, instance in enumerate(instances):
                 src_label = instance["labels"]
-                src_score = instance["scores"]
-                if src_label==self.ignore_label: continue
-                if src_score< self.min_obj_score: continue
-                src_mask = instance["masks"]
-                
-                interArea = sum(lengths[np.logical_and(src_mask,tgt_mask)])
-                unionArea = sum(lengths[np.logical_or(src_mask,tgt_mask)])
-                iou = interArea / (unionArea + 1e-6)
+                iou = ious[i, j]
                 if iou>=self.IoU_thres:
                     flag = True
                     if tgt_label==src_label:
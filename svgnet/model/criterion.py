@@ -20,22 +20,23 @@ def is_dist_avail_and_initialized():
 
 def dice_loss(
         inputs: torch.Tensor,
-        targets: torch.Tensor,
+        rows: torch.Tensor,
+        points: torch.Tensor,
         num_masks: float,
     ):
     """
     Compute the DICE loss, similar to generalized IOU for masks
     Args:
-        inputs: A float tensor of arbitrary shape.
-                The predictions for each example.
-        targets: A float tensor with the same shape as inputs. Stores the binary
-                 classification label for each element in inputs
-                (0 for the negative class and 1 for the positive class).
+        inputs: A float tensor (m, n), the mask logits of each matched query.
+        rows, points: Long tensors of the positive elements of the target
+                masks, inputs[rows[i], points[i]] has target 1 and every
+                other element target 0.
     """
     inputs = inputs.sigmoid()
     inputs = inputs.flatten(1)
-    numerator = 2 * (inputs * targets).sum(-1)
-    denominator = inputs.sum(-1) + targets.sum(-1)
+    numerator = 2 * inputs.new_zeros(inputs.shape[0]).index_add_(0, rows, inputs[rows, points])
+    counts = torch.bincount(rows, minlength=inputs.shape[0]).to(inputs)
+    denominator = inputs.sum(-1) + counts
     loss = 1 - (numerator + 1) / (denominator + 1)
     return loss.sum() / num_masks
 
@@ -47,22 +48,22 @@ dice_loss_jit = torch.jit.script(
 
 def sigmoid_ce_loss(
         inputs: torch.Tensor,
-        targets: torch.Tensor,
+        rows: torch.Tensor,
+        points: torch.Tensor,
         num_masks: float,
     ):
     """
     Args:
-        inputs: A float tensor of arbitrary shape.
-                The predictions for each example.
-        targets: A float tensor with the same shape as inputs. Stores the binary
-                 classification label for each element in inputs
-                (0 for the negative class and 1 for the positive class).
+        inputs: A float tensor (m, n), the mask logits of each matched query.
+        rows, points: Long tensors of the positive elements of the target masks.
     Returns:
         Loss tensor
     """
-    loss = F.binary_cross_entropy_with_logits(inputs, targets, reduction="none")
+    # ce(x, 1) - ce(x, 0) = -x, so only the positive elements differ from an empty mask
+    loss = F.binary_cross_entropy_with_logits(inputs, torch.zeros_like(inputs), reduction="none").sum(1)
+    loss = loss - inputs.new_zeros(inputs.shape[0]).index_add_(0, rows, inputs[rows, points])
 
-    return loss.mean(1).sum() / num_masks
+    return (loss / inputs.shape[1]).sum() / num_masks
 
 def sigmoid_focal_loss(inputs, targets, num_boxes, alpha: float = 0.25, gamma: float = 2):
     """
@@ -169,26 +170,32 @@ class SetCriterion(nn.Module):
     
     def loss_masks(self, outputs, targets, indices, num_masks,cts=None):
         """Compute the losses related to the masks: the focal loss and the dice loss.
-        targets dicts must contain the key "masks" containing a tensor of dim [nb_target_boxes, h, w]
+        targets dicts must contain the key "ids" containing the target of every point (-1 for none)
         """
         assert "pred_masks" in outputs
 
         src_idx = self._get_src_permutation_idx(indices)
-        tgt_idx = self._get_tgt_permutation_idx(indices)
         src_masks = outputs["pred_masks"]
         
         src_masks = src_masks[src_idx]
-        masks = [t["masks"].transpose(0,1).unsqueeze(0) for t in targets]
-        target_masks = torch.cat(masks,dim=0)
-        
-        target_masks = target_masks[tgt_idx]
+        # positive elements of the matched target masks, which stay sparse
+        rows, points, start = [], [], 0
+        for t, (_, tgt) in zip(targets, indices):
+            ids = t["ids"].to(src_masks.device)
+            row_of_target = torch.full((len(t["labels"]),), -1, dtype=torch.long, device=ids.device)
+            row_of_target[tgt.to(ids.device)] = torch.arange(start, start + len(tgt), device=ids.device)
+            start += len(tgt)
+            point = torch.nonzero(ids >= 0).squeeze(1)
+            row = row_of_target[ids[point]]
+            rows.append(row[row >= 0])
+            points.append(point[row >= 0])
+        rows, points = torch.cat(rows), torch.cat(points)
         
         losses = {
-            "loss_mask": sigmoid_ce_loss_jit(src_masks, target_masks, num_masks)*self.weight_dict["loss_mask"],
-            "loss_dice": dice_loss_jit(src_masks, target_masks, num_masks)*self.weight_dict["loss_dice"],
+            "loss_mask": sigmoid_ce_loss_jit(src_masks, rows, points, num_masks)*self.weight_dict["loss_mask"],
+            "loss_dice": dice_loss_jit(src_masks, rows, points, num_masks)*self.weight_dict["loss_dice"],
         }
         del src_masks
-        del target_masks
         return losses
 
 
@@ -49,6 +49,7 @@ class Decoder(nn.Module):
         num_shared = self.num_decoders if not self.shared_decoder else 1
         self.pos_enc = PositionEmbeddingCoordsSine(pos_type="fourier",
                                                        d_pos=self.mask_dim,
+                                                       d_in=cfg.get("coord_dims", 3),
                                                        gauss_scale=cfg.gauss_scale,
                                                        normalize=cfg.normalize_pos_enc)
         
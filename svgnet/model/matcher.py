@@ -9,20 +9,26 @@ from scipy.optimize import linear_sum_assignment
 from torch import nn
 from torch.cuda.amp import autocast
 import numpy as np 
-def batch_dice_loss(inputs: torch.Tensor, targets: torch.Tensor):
+def segment_sum(inputs: torch.Tensor, ids: torch.Tensor, num_targets: int):
+    """Sums inputs (q, n) over the points of every target, ids (n,) is the target of each point or -1."""
+    points = torch.nonzero(ids >= 0).squeeze(1)
+    out = inputs.new_zeros(inputs.shape[0], num_targets)
+    return out.index_add_(1, ids[points], inputs[:, points])
+
+
+def batch_dice_loss(inputs: torch.Tensor, ids: torch.Tensor, num_targets: int):
     """
     Compute the DICE loss, similar to generalized IOU for masks
     Args:
-        inputs: A float tensor of arbitrary shape.
-                The predictions for each example.
-        targets: A float tensor with the same shape as inputs. Stores the binary
-                 classification label for each element in inputs
-                (0 for the negative class and 1 for the positive class).
+        inputs: A float tensor (q, n), the mask logits of each query.
+        ids: A long tensor (n,), the target of every point, -1 for none;
+             the sparse form of the (num_targets, n) binary target masks.
     """
     inputs = inputs.sigmoid()
     inputs = inputs.flatten(1)
-    numerator = 2 * torch.einsum("nc,mc->nm", inputs, targets)
-    denominator = inputs.sum(-1)[:, None] + targets.sum(-1)[None, :]
+    numerator = 2 * segment_sum(inputs, ids, num_targets)
+    counts = torch.bincount(ids[ids >= 0], minlength=num_targets).to(inputs)
+    denominator = inputs.sum(-1)[:, None] + counts[None, :]
     loss = 1 - (numerator + 1) / (denominator + 1)
     return loss
 
@@ -32,28 +38,21 @@ batch_dice_loss_jit = torch.jit.script(
 )  # type: torch.jit.ScriptModule
 
 
-def batch_sigmoid_ce_loss(inputs: torch.Tensor, targets: torch.Tensor):
+def batch_sigmoid_ce_loss(inputs: torch.Tensor, ids: torch.Tensor, num_targets: int):
     """
     Args:
-        inputs: A float tensor of arbitrary shape.
-                The predictions for each example.
-        targets: A float tensor with the same shape as inputs. Stores the binary
-                 classification label for each element in inputs
-                (0 for the negative class and 1 for the positive class).
+        inputs: A float tensor (q, n), the mask logits of each query.
+        ids: A long tensor (n,), the target of every point, -1 for none.
     Returns:
-        Loss tensor
+        Loss tensor (q, num_targets)
     """
     hw = inputs.shape[1]
 
-    pos = F.binary_cross_entropy_with_logits(
-        inputs, torch.ones_like(inputs), reduction="none"
-    )
+    # ce(x, 1) - ce(x, 0) = -x, so only the points of a target differ from an empty mask
     neg = F.binary_cross_entropy_with_logits(
         inputs, torch.zeros_like(inputs), reduction="none"
     )
-    loss = torch.einsum("nc,mc->nm", pos, targets) + torch.einsum(
-        "nc,mc->nm", neg, (1 - targets)
-    )
+    loss = neg.sum(-1)[:, None] - segment_sum(inputs, ids, num_targets)
 
     return loss / hw
 
@@ -112,16 +111,15 @@ class HungarianMatcher(nn.Module):
             gamma = 4.0
             
             out_mask = outputs["pred_masks"][b]  # [num_queries, H_pred, W_pred] 
-            # gt masks are already padded when preparing target
-            tgt_mask = targets[b]["masks"].to(out_mask) 
+            # gt masks are sparse, the target of every point
+            tgt_point_ids = targets[b]["ids"].to(out_mask.device)
             
             with autocast(enabled=False):
                 out_mask = out_mask.float()
-                tgt_mask = tgt_mask.float().transpose(0,1)
                 # Compute the focal loss between masks
-                cost_mask = batch_sigmoid_ce_loss_jit(out_mask, tgt_mask)
+                cost_mask = batch_sigmoid_ce_loss_jit(out_mask, tgt_point_ids, len(tgt_ids))
                 # Compute the dice loss betwen masks
-                cost_dice = batch_dice_loss_jit(out_mask, tgt_mask)
+                cost_dice = batch_dice_loss_jit(out_mask, tgt_point_ids, len(tgt_ids))
                 iou = (1-cost_dice) / (1+cost_dice + 1e-8)
                 _out_prob = out_prob[:, tgt_ids] * iou
                 neg_cost_class = (1 - alpha) * (_out_prob ** gamma) * (-(1 - _out_prob + 1e-5).log())
@@ -169,7 +167,8 @@ class HungarianMatcher(nn.Module):
             targets: This is a list of targets (len(targets) = batch_size), where each target is a dict containing:
                  "labels": Tensor of dim [num_target_boxes] (where num_target_boxes is the number of ground-truth
                            objects in the target) containing the class labels
-                 "masks": Tensor of dim [num_target_boxes, H_gt, W_gt] containing the target masks
+                 "ids": Tensor of dim [num_points] containing the target of every point (-1 for none),
+                        the sparse form of the target masks
 
         Returns:
             A list of size batch_size, containing tuples of (index_i, index_j) where:
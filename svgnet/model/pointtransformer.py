@@ -8,48 +8,57 @@ class Model(nn.Module):
         super().__init__()
         block = PointTransformerBlock
         num_block = [2, 3, 4, 6, 3]
-        self.in_planes = cfg.in_channels
+        # 2 runs on the (x, y) of the drawings only, in_channels still counts x, y and z
+        self.coord_dims = cfg.get("coord_dims", 3)
+        self.in_planes = cfg.in_channels - 3 + self.coord_dims
         self.planes = [32*2, 64*2, 128*2, 256*2, 512*2]
         share_planes = 8
         stride, nsample = [1, 4, 4, 4, 4], [16, 16, 16, 16, 16]
+        # sampling of enc2 to enc5, see TransitionDown
+        sampling = cfg.get("sampling", ["fps"] * 4)
+        assert len(sampling) == 4, "model.sampling needs one strategy per strided stage (enc2 to enc5)"
         self.enc1 = self._make_enc(block, self.planes[0], num_block[0], share_planes, stride=stride[0],
                                    nsample=nsample[0])  # N/1
         self.enc2 = self._make_enc(block, self.planes[1], num_block[1], share_planes, stride=stride[1],
-                                   nsample=nsample[1], num_sector=4)  # N/4
+                                   nsample=nsample[1], num_sector=4, sampling=sampling[0])  # N/4
         self.enc3 = self._make_enc(block, self.planes[2], num_block[2], share_planes, stride=stride[2],
-                                   nsample=nsample[2])  # N/16
+                                   nsample=nsample[2], sampling=sampling[1])  # N/16
         self.enc4 = self._make_enc(block, self.planes[3], num_block[3], share_planes, stride=stride[3],
-                                   nsample=nsample[3])  # N/64
+                                   nsample=nsample[3], sampling=sampling[2])  # N/64
         self.enc5 = self._make_enc(block, self.planes[4], num_block[4], share_planes, stride=stride[4],
-                                   nsample=nsample[4])  # N/256
+                                   nsample=nsample[4], sampling=sampling[3])  # N/256
         self.dec5 = self._make_dec(block, self.planes[4], 2, share_planes, nsample=nsample[4], is_head=True)  # transform p5
         self.dec4 = self._make_dec(block, self.planes[3], 2, share_planes, nsample=nsample[3])  # fusion p5 and p4
         self.dec3 = self._make_dec(block, self.planes[2], 2, share_planes, nsample=nsample[2])  # fusion p4 and p3
         self.dec2 = self._make_dec(block, self.planes[1], 2, share_planes, nsample=nsample[1])  # fusion p3 and p2
         self.dec1 = self._make_dec(block, self.planes[0], 2, share_planes, nsample=nsample[0])  # fusion p2 and p1
         
-    def _make_enc(self, block, planes, blocks, share_planes=8, stride=1, nsample=16, num_sector=1):
-        layers = [TransitionDown(self.in_planes, planes * block.expansion, stride, nsample, num_sector)]
+    def _make_enc(self, block, planes, blocks, share_planes=8, stride=1, nsample=16, num_sector=1, sampling="fps"):
+        layers = [TransitionDown(self.in_planes, planes * block.expansion, stride, nsample, num_sector,
+                                 coord_dims=self.coord_dims, sampling=sampling)]
         self.in_planes = planes * block.expansion
         for _ in range(1, blocks):
-            layers.append(block(self.in_planes, self.in_planes, share_planes, nsample=nsample))
+            layers.append(block(self.in_planes, self.in_planes, share_planes, nsample=nsample,
+                                coord_dims=self.coord_dims))
         return nn.Sequential(*layers)
 
     def _make_dec(self, block, planes, blocks, share_planes=8, nsample=16, is_head=False):
         layers = [TransitionUp(self.in_planes, None if is_head else planes * block.expansion)]
         self.in_planes = planes * block.expansion
         for _ in range(1, blocks):
-            layers.append(block(self.in_planes, self.in_planes, share_planes, nsample=nsample))
+            layers.append(block(self.in_planes, self.in_planes, share_planes, nsample=nsample,
+                                coord_dims=self.coord_dims))
         return nn.Sequential(*layers)
 
     def forward(self, stage_list):
         
-        p0 = stage_list["inputs"]["p_out"] # (n, 3)
+        p0 = stage_list["inputs"]["p_out"] # (n, coord_dims)
         x0 = stage_list["inputs"]["f_out"] # (n, c), 
         o0 = stage_list["inputs"]["offset"]#  (b)
-        x0 = p0 if self.in_planes == 3 else torch.cat((p0, x0), 1)
+        knn_idx0 = stage_list["inputs"].get("knn_idx") # (n, nsample), precomputed neighbors or None
+        x0 = p0 if self.in_planes == self.coord_dims else torch.cat((p0, x0), 1)
         [p1, x1, o1] = self.enc1[0]([p0, x0, o0])
-        p1, x1, o1, knn_idx1 = self.enc1[1:]([p1, x1, o1,None])
+        p1, x1, o1, knn_idx1 = self.enc1[1:]([p1, x1, o1,knn_idx0])
         [p2, x2, o2], idx2 = self.enc2[0]([p1, x1, o1])
         p2, x2, o2,knn_idx2  = self.enc2[1:]([p2, x2, o2, None])
         [p3, x3, o3], idx3 = self.enc3[0]([p2, x2, o2])
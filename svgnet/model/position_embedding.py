@@ -11,14 +11,14 @@ import numpy as np
 
 def shift_scale_points(pred_xyz, src_range, dst_range=None):
     """
-    pred_xyz: B x N x 3
-    src_range: [[B x 3], [B x 3]] - min and max XYZ coords
-    dst_range: [[B x 3], [B x 3]] - min and max XYZ coords
+    pred_xyz: B x N x D
+    src_range: [[B x D], [B x D]] - min and max coords
+    dst_range: [[B x D], [B x D]] - min and max coords
     """
     if dst_range is None:
         dst_range = [
-            torch.zeros((src_range[0].shape[0], 3), device=src_range[0].device),
-            torch.ones((src_range[0].shape[0], 3), device=src_range[0].device),
+            torch.zeros(src_range[0].shape, device=src_range[0].device),
+            torch.ones(src_range[0].shape, device=src_range[0].device),
         ]
 
     if pred_xyz.ndim == 4:
@@ -4,6 +4,8 @@ import torch.distributed as dist
 import torch.nn as nn
 import torch.nn.functional as F
 
+from modules.pointops.functions import pointops
+from ..data.targets import instance_targets
 from ..util import cuda_cast
 from .pointtransformer import Model as PointT
 #from .pointnet2 import Model as PointT
@@ -17,6 +19,10 @@ class SVGNet(nn.Module):
         super().__init__()
         self.criterion = criterion
 
+        # knn over a grid for large drawings, brute force is quadratic in their primitives
+        pointops.set_grid_knn(cfg.get("knn_grid_min_points", 0))
+        # 2 drops z, which every dataset sets to 0, and runs the model on (x, y)
+        self.coord_dims = cfg.get("coord_dims", 3)
         # NOTE backbone
         self.backbone = PointT(cfg)
         self.decoder = Decoder(cfg,self.backbone.planes)
@@ -28,40 +34,24 @@ class SVGNet(nn.Module):
         
     def forward(self, batch,return_loss=True):
         coords,feats,semantic_labels,offsets,lengths = batch[:5]
-        return self._forward(coords,feats,offsets,semantic_labels,lengths,return_loss=return_loss)
+        # optional inputs built by the loader: precomputed neighbors (svg2) and instance targets
+        extra = batch[5] if len(batch) > 5 and isinstance(batch[5], dict) else {}
+        return self._forward(coords,feats,offsets,semantic_labels,lengths,neighbors=extra.get("knn_idx"),
+                             targets=extra.get("targets"),return_loss=return_loss)
      
-    def prepare_targets(self,semantic_labels,bg_ind=-1,bg_sem=35):
-        
-        instance_ids = semantic_labels[:,1].cpu().numpy()
-        semantic_ids = semantic_labels[:,0].cpu().numpy()
-        
-        keys = []
-        for sem_id,ins_id in zip(semantic_ids,
-                             instance_ids):
-            if (sem_id,ins_id) not in keys:
-                keys.append((sem_id,ins_id))
-    
-        cls_targets,mask_targets = [], []
-        svg_len = semantic_ids.shape[0]
-
-        for (sem_id,ins_id) in keys:
-            if sem_id==35 and ins_id==-1: continue # background
-
-            tensor_mask = torch.zeros(svg_len)
-            ind1 = np.where(semantic_ids==sem_id)[0]
-            ind2 = np.where(instance_ids==ins_id)[0]
-            ind = list(set(ind1).intersection(ind2))
-            tensor_mask[ind] = 1
-            cls_targets.append(sem_id)
-            mask_targets.append(tensor_mask.unsqueeze(1))
-
-        cls_targets = torch.tensor(cls_targets) if cls_targets else torch.tensor([35])
-        mask_targets = torch.cat(mask_targets,dim=1) if mask_targets else torch.zeros(svg_len,1)
+    def prepare_targets(self,semantic_labels,targets=None,bg_ind=-1,bg_sem=35):
         
+        if targets is None:
+            targets = instance_targets(semantic_labels, bg_sem, bg_ind)
+        cls_targets = targets["labels"].to(semantic_labels.device, non_blocking=True)
+        point_ids = targets["ids"].to(semantic_labels.device, non_blocking=True)
+        if cls_targets.shape[0] == 0:
+            cls_targets = cls_targets.new_tensor([bg_sem]) # a single empty target
         
+        # masks are sparse: the target of every point, -1 for the background
         return [{
-            "labels": cls_targets.to(semantic_labels.device),
-            "masks": mask_targets.to(semantic_labels.device),
+            "labels": cls_targets,
+            "ids": point_ids,
 
         }]
 
@@ -73,11 +63,13 @@ class SVGNet(nn.Module):
         offsets,
         semantic_labels,
         lengths,
+        neighbors=None,
+        targets=None,
         return_loss=True
     ):
-    
-        stage_list={'inputs': {'p_out':coords,"f_out":feats,"offset":offsets},"semantic_labels":semantic_labels[:,0]}
-        targets = self.prepare_targets(semantic_labels)
+        coords = coords[:, :self.coord_dims].contiguous()
+        stage_list={'inputs': {'p_out':coords,"f_out":feats,"offset":offsets,"knn_idx":neighbors},"semantic_labels":semantic_labels[:,0]}
+        targets = self.prepare_targets(semantic_labels, targets)
         stage_list.update({"tgt":targets})
         
         stage_list = self.backbone(stage_list)
@@ -170,7 +162,7 @@ class SVGNet(nn.Module):
                 current_segment_id += 1
                 #print(pred_class, pred_score)
                 results.append({
-                    "masks": mask.cpu().numpy(),
+                    "points": torch.nonzero(mask).squeeze(1).cpu().numpy(),
                     "labels": pred_class,
                     "scores": pred_score
                 })
@@ -2,7 +2,9 @@ import torch
 from torch import distributed as dist
 
 import functools
+import inspect
 import os
+import re
 from collections import OrderedDict
 from math import cos, pi
 from .dist import get_dist_info, master_only
@@ -114,8 +116,47 @@ def weights_to_cpu(state_dict):
     return state_dict_cpu
 
 
+def get_rng_states():
+    """RNG states of every rank, gathered on all of them."""
+    state = {"python": random.getstate(), "numpy": np.random.get_state(), "torch": torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    _, world_size = get_dist_info()
+    if world_size == 1:
+        return [state]
+    states = [None] * world_size
+    dist.all_gather_object(states, state)
+    return states
+
+
+def set_rng_states(states):
+    rank, world_size = get_dist_info()
+    if len(states) != world_size:
+        return False
+    state = states[rank]
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+    return True
+
+
+def _save_atomic(checkpoint, f):
+    # a preempted save leaves the previous file intact
+    torch.save(checkpoint, f + ".tmp")
+    os.replace(f + ".tmp", f)
+
+
 @master_only
-def checkpoint_save(epoch, model, optimizer, work_dir, save_freq=16, best=False):
+def checkpoint_save(epoch, model, optimizer, work_dir, save_freq=16, best=False, train_state=None, iteration=None):
+    """Saves the model and optimizer of an epoch.
+
+    ``train_state`` (GradScaler, best metric, RNG states, seed) is saved along
+    so a resumed run continues exactly. With ``iteration``, the epoch is still
+    running: only latest.pth is written, and resuming from it restarts the
+    epoch at the batch after ``iteration``.
+    """
     if hasattr(model, "module"):
         model = model.module
 
@@ -124,14 +165,19 @@ def checkpoint_save(epoch, model, optimizer, work_dir, save_freq=16, best=False)
         torch.save(checkpoint, f"{work_dir}/best.pth")
         return
 
-    f = os.path.join(work_dir, f"epoch_{epoch}.pth")
     checkpoint = {"net": weights_to_cpu(model.state_dict()), "optimizer": optimizer.state_dict(), "epoch": epoch}
-    torch.save(checkpoint, f)
-
+    if train_state is not None:
+        checkpoint.update(train_state)
     f_latest = os.path.join(work_dir, "latest.pth")
-    if os.path.exists(f_latest):
-        os.remove(f"{work_dir}/latest.pth")
-    torch.save(checkpoint, f_latest)
+    if iteration is not None:
+        # epoch counts the finished epochs
+        checkpoint.update(epoch=epoch - 1, iter=iteration)
+        _save_atomic(checkpoint, f_latest)
+        return
+
+    f = os.path.join(work_dir, f"epoch_{epoch}.pth")
+    torch.save(checkpoint, f)
+    _save_atomic(checkpoint, f_latest)
 
     # os.system(f"cd {work_dir}; ln -s {osp.basename(f)} latest.pth")
 
@@ -143,13 +189,45 @@ def checkpoint_save(epoch, model, optimizer, work_dir, save_freq=16, best=False)
             os.remove(f)
 
 
+# weights applied to the coordinates, x, y, z first on the input axis
+COORD_WEIGHTS = re.compile(r"(linear_p\.0\.weight|enc\d\.0\.linear\.weight|pos_enc\.gauss_B)$")
+
+
+def drop_z_weights(src_state_dict, target_state_dict):
+    """Slices the z inputs out of the coordinate weights of a checkpoint of the 3D
+    model for the model with coord_dims 2. z is 0 in every drawing, these
+    weights never contributed, so the outputs stay the same. Returns the
+    converted keys."""
+    converted = []
+    for k, v in list(src_state_dict.items()):
+        if k not in target_state_dict or not COORD_WEIGHTS.search(k):
+            continue
+        shape = target_state_dict[k].shape
+        dims = [dim for dim in range(v.dim()) if v.dim() == len(shape) and v.shape[dim] != shape[dim]]
+        if len(dims) != 1 or v.shape[dims[0]] != shape[dims[0]] + 1:
+            continue
+        dim = dims[0]
+        src_state_dict[k] = torch.cat([v.narrow(dim, 0, 2), v.narrow(dim, 3, v.shape[dim] - 3)], dim)
+        converted.append(k)
+    return converted
+
+
+def _load(f, **kwargs):
+    """torch.load of a checkpoint, which holds more than tensors (RNG states, metrics)."""
+    # weights_only appeared in torch 1.13 and defaults to True from torch 2.6
+    if "weights_only" in inspect.signature(torch.load).parameters:
+        kwargs["weights_only"] = False
+    return torch.load(f, **kwargs)
+
+
 def load_checkpoint(checkpoint, logger, model, optimizer=None, strict=False):
     if hasattr(model, "module"):
         model = model.module
     device = torch.cuda.current_device()
-    state_dict = torch.load(checkpoint, map_location=lambda storage, loc: storage.cuda(device))
+    state_dict = _load(checkpoint, map_location=lambda storage, loc: storage.cuda(device))
     src_state_dict = state_dict["net"]
     target_state_dict = model.state_dict()
+    converted_keys = drop_z_weights(src_state_dict, target_state_dict)
     skip_keys = []
     # skip mismatch size tensors in case of pretraining
     for k in src_state_dict.keys():
@@ -160,6 +238,8 @@ def load_checkpoint(checkpoint, logger, model, optimizer=None, strict=False):
     for k in skip_keys:
         del src_state_dict[k]
     missing_keys, unexpected_keys = model.load_state_dict(src_state_dict, strict=strict)
+    if converted_keys:
+        logger.info(f'dropped z from the coordinate weights of the source state_dict: {", ".join(converted_keys)}')
     if skip_keys:
         logger.info(f'removed keys in source state_dict due to size mismatch: {", ".join(skip_keys)}')
     if missing_keys:
@@ -179,6 +259,25 @@ def load_checkpoint(checkpoint, logger, model, optimizer=None, strict=False):
     return epoch + 1
 
 
+def load_train_state(checkpoint, logger, scaler=None):
+    """Restores what ``checkpoint_save`` saved besides the model and optimizer.
+
+    Sets the GradScaler and the RNG states of this rank, and returns a dict
+    with "iter", the batches of the epoch already trained (0 at the end of an
+    epoch), "best_metric" and "seed" (None for older checkpoints).
+    """
+    state_dict = _load(checkpoint, map_location="cpu")
+    if scaler is not None and "scaler" in state_dict:
+        scaler.load_state_dict(state_dict["scaler"])
+    if "rng_states" in state_dict and not set_rng_states(state_dict["rng_states"]):
+        logger.info("RNG states not restored, the checkpoint was saved with another number of GPUs")
+    return {
+        "iter": state_dict.get("iter", 0),
+        "best_metric": state_dict.get("best_metric", 0),
+        "seed": state_dict.get("seed"),
+    }
+
+
 def get_max_memory():
     mem = torch.cuda.max_memory_allocated()
     mem_mb = torch.tensor([int(mem) // (1024 * 1024)], dtype=torch.int, device="cuda")
@@ -11,7 +11,7 @@ import os
 import os.path as osp
 import time
 from functools import partial
-from svgnet.data import build_dataloader, build_dataset
+from svgnet.data import DevicePrefetcher, build_dataloader, build_dataset
 from svgnet.evaluation import PointWiseEval,InstanceEval
 from svgnet.model.svgnet import SVGNet as svgnet
 from svgnet.util  import get_root_logger, init_dist, load_checkpoint
@@ -91,6 +91,10 @@ def main():
     
     mean_time = np.array(time_arr).mean()
     logger.info(f"Average run time: {mean_time:.4f}")
+    if isinstance(dataloader, DevicePrefetcher):
+        stats = dataloader.stats()
+        logger.info(f"Prefetch: load {stats['load_time']:.4f}s, wait {stats['wait_time']:.4f}s, "
+                    f"saved {stats['saved_time']:.4f}s per step")
 
     # save output
     if not args.out:
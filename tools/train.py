@@ -6,13 +6,14 @@ from munch import Munch
 from torch.nn.parallel import DistributedDataParallel
 import torch.distributed as dist
 import argparse
+import contextlib
 import datetime
 import os
 import os.path as osp
 import shutil
 import time
 
-from svgnet.data import build_dataloader, build_dataset
+from svgnet.data import DevicePrefetcher, build_batch_aug, build_dataloader, build_dataset
 from svgnet.model.svgnet import SVGNet as svgnet
 from svgnet.model.criterion import SetCriterion
 from svgnet.model.matcher import HungarianMatcher
@@ -25,12 +26,14 @@ from svgnet.util import (
     cosine_lr_after_step,
     get_dist_info,
     get_max_memory,
+    get_rng_states,
     get_root_logger,
     init_dist,
     is_main_process,
     is_multiple,
     is_power2,
     load_checkpoint,
+    load_train_state,
     set_seed,
     get_scheduler,
     build_new_optimizer
@@ -54,40 +57,87 @@ def get_args():
     return args
 
 
-def train(epoch, model, optimizer, scheduler, scaler, train_loader, cfg, logger, writer):
+def train_state(scaler, cfg):
+    """What a resumed run needs besides the model and optimizer, see checkpoint_save."""
+    return {"scaler": scaler.state_dict(), "best_metric": best_metric, "rng_states": get_rng_states(), "seed": cfg.seed}
+
+
+def train(epoch, model, optimizer, scheduler, scaler, train_loader, cfg, logger, writer, batch_aug=None, start_iter=0):
     model.train()
     iter_time = AverageMeter(True)
     data_time = AverageMeter(True)
     meter_dict = {}
     end = time.time()
 
-    if train_loader.sampler is not None and cfg.dist:
-        train_loader.sampler.set_epoch(epoch)
+    for sampler in (train_loader.sampler, train_loader.batch_sampler):
+        if hasattr(sampler, "set_epoch"):
+            sampler.set_epoch(epoch)
+    if start_iter > 0:
+        # resume the epoch after the batches trained before the checkpoint
+        train_loader.batch_sampler.skip(start_iter)
 
-    for i, batch in enumerate(train_loader, start=1):
+    # with budget batches, step once batch_size drawings per GPU were accumulated
+    accumulate = cfg.get("grad_accumulation", False) and cfg.dataloader.train.get("max_points", 0) > 0
+    _, world_size = get_dist_info()
+    target_samples, accumulated = cfg.dataloader.train.batch_size * world_size, 0
+    points_meter = AverageMeter()
+    prefetcher = train_loader if isinstance(train_loader, DevicePrefetcher) else None
+    if prefetcher is not None:
+        prefetcher.reset_stats()
+    optimizer.zero_grad()
+
+    # saved at the first optimizer step checkpoint_iters batches after the last save, steps
+    # are irregular with gradient accumulation and the state is only whole after one
+    checkpoint_iters, last_save = cfg.get("checkpoint_iters", 0), start_iter
+    for i, batch in enumerate(train_loader, start=start_iter + 1):
+        if batch_aug is not None:
+            batch = batch_aug(batch)
         data_time.update(time.time() - end)
+        num_samples = len(batch[3])
+        points_meter.update(batch[0].shape[0])
 
         if scheduler is None:
             cosine_lr_after_step(optimizer, cfg.optimizer.lr, epoch - 1, cfg.step_epoch, cfg.epochs)
-        with torch.cuda.amp.autocast(enabled=cfg.fp16):
-            _,loss, log_vars = model(batch)
-
-        # meter_dict
-        for k, v in log_vars.items():
-            if k not in meter_dict.keys() and k != "placeholder":
-                meter_dict[k] = AverageMeter()
-            meter_dict[k].update(v)
-        
-        
-        # backward  
-        optimizer.zero_grad()
-        scaler.scale(loss).backward()
-        scaler.step(optimizer)
-        scaler.update()
+
+        step = True
+        if accumulate:
+            samples = torch.tensor(num_samples, device=torch.cuda.current_device())
+            if cfg.dist:
+                dist.all_reduce(samples)
+            accumulated += samples.item()
+            step = accumulated >= target_samples or i == len(train_loader)
+        # DDP only averages the gradients over the GPUs in the backward of a step
+        sync = contextlib.nullcontext() if step or not hasattr(model, "no_sync") else model.no_sync()
+
+        with sync:
+            with torch.cuda.amp.autocast(enabled=cfg.fp16):
+                _,loss, log_vars = model(batch)
+
+            # meter_dict
+            for k, v in log_vars.items():
+                if k not in meter_dict.keys() and k != "placeholder":
+                    meter_dict[k] = AverageMeter()
+                meter_dict[k].update(v)
+
+            if accumulate:
+                # weight each batch by its drawings, the step then averages over target_samples drawings
+                loss = loss * num_samples / cfg.dataloader.train.batch_size
+
+            # backward
+            scaler.scale(loss).backward()
         for name, param in model.named_parameters():
             if param.grad is None:
                 print(name)
-        
+        if step:
+            scaler.step(optimizer)
+            scaler.update()
+            optimizer.zero_grad()
+            accumulated = 0
+            if checkpoint_iters > 0 and i - last_save >= checkpoint_iters and i < len(train_loader):
+                checkpoint_save(epoch, model, optimizer, cfg.work_dir, cfg.save_freq,
+                                train_state=train_state(scaler, cfg), iteration=i)
+                last_save = i
+
         # time and print
         remain_iter = len(train_loader) * (cfg.epochs - epoch + 1) - i
         iter_time.update(time.time() - end)
@@ -100,15 +150,24 @@ def train(epoch, model, optimizer, scheduler, scaler, train_loader, cfg, logger,
             log_str = f"Epoch [{epoch}/{cfg.epochs}][{i}/{len(train_loader)}]  "
             log_str += (
                 f"lr: {lr:.2g}, eta: {remain_time}, mem: {get_max_memory()}, "
-                f"data_time: {data_time.val:.2f}, iter_time: {iter_time.val:.2f}"
+                f"data_time: {data_time.val:.2f}, iter_time: {iter_time.val:.2f}, "
+                f"points: {points_meter.val} (avg {points_meter.avg:.0f})"
             )
+            if prefetcher is not None:
+                log_str += f", prefetch_saved: {prefetcher.stats()['saved_time']:.3f}"
             for k, v in meter_dict.items():
                 log_str += f", {k}: {v.val:.4f}"
             logger.info(log_str)
     writer.add_scalar("train/learning_rate", lr, epoch)
+    writer.add_scalar("train/batch_points", points_meter.avg, epoch)
+    if prefetcher is not None:
+        stats = prefetcher.stats()
+        logger.info(f"Prefetch: load {stats['load_time']:.3f}s, wait {stats['wait_time']:.3f}s, "
+                    f"saved {stats['saved_time']:.3f}s per step")
+        writer.add_scalar("train/prefetch_saved_time", stats["saved_time"], epoch)
     for k, v in meter_dict.items():
         writer.add_scalar(f"train/{k}", v.avg, epoch)
-    checkpoint_save(epoch, model, optimizer, cfg.work_dir, cfg.save_freq)
+    checkpoint_save(epoch, model, optimizer, cfg.work_dir, cfg.save_freq, train_state=train_state(scaler, cfg))
 
 
 def validate(epoch, model, optimizer, val_loader, cfg, logger, writer):
@@ -171,6 +230,7 @@ def main():
         rank = init_dist()
     set_seed(args.seed + rank)    
     cfg.dist = args.dist
+    cfg.seed = args.seed
     
 
     # work_dir & logger
@@ -227,6 +287,7 @@ def main():
 
     # data
     train_set = build_dataset(cfg.data.train, logger)
+    batch_aug = build_batch_aug(cfg.data.train)
     val_set = build_dataset(cfg.data.test, logger)
 
     train_loader = build_dataloader(args,train_set, training=True, dist=args.dist, **cfg.dataloader.train)
@@ -245,24 +306,30 @@ def main():
     scheduler = None
     
     # pretrain, resume
-    start_epoch = 1
+    global best_metric
+    best_metric = 0
+    start_epoch, start_iter = 1, 0
     if args.resume:
         logger.info(f"Resume from {args.resume}")
         start_epoch = load_checkpoint(args.resume, logger, model, optimizer=optimizer)
+        state = load_train_state(args.resume, logger, scaler)
+        start_iter, best_metric = state["iter"], state["best_metric"]
+        if state["seed"] is not None and state["seed"] != args.seed:
+            logger.info(f"Checkpoint saved with --seed {state['seed']}, the resumed epoch gets other batches")
+        if start_iter > 0:
+            logger.info(f"Resume epoch {start_epoch} at iteration {start_iter}")
     elif cfg.pretrain:
         logger.info(f"Load pretrain from {cfg.pretrain}")
         load_checkpoint(cfg.pretrain, logger, model)
 
-    global best_metric
-    best_metric = 0
-
     # if is_main_process():
     #     validate(0, model, optimizer, val_loader, cfg, logger, writer)
 
     # train and val
     logger.info("Training")
     for epoch in range(start_epoch, cfg.epochs + 1):
-        train(epoch, model, optimizer, scheduler, scaler, train_loader, cfg, logger, writer)
+        train(epoch, model, optimizer, scheduler, scaler, train_loader, cfg, logger, writer, batch_aug,
+              start_iter if epoch == start_epoch else 0)
         if scheduler is not None:scheduler.step()
         validate(epoch, model, optimizer, val_loader, cfg, logger, writer)
         writer.flush()
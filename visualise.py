@@ -1,6 +1,5 @@
 import argparse
 import glob
-from itertools import chain
 import json
 import math
 import os
@@ -22,6 +21,7 @@ from svgnet.model.svgnet import SVGNet as svgnet
 from svgnet.util import get_root_logger, init_dist, load_checkpoint
 from svgnet.data import build_dataloader, build_dataset
 from svgnet.data.svg import SVG_CATEGORIES
+from svgnet.data.svg_tree import iter_primitives
 
 """
 Buggy code for visualisation, as per the github issue: https://github.com/nicehuster/SymPoint/issues/4
@@ -63,52 +63,47 @@ def get_args():
     args = parser.parse_args()
     return args
 
-def reconstruct_svg(svg_file, estimated_contents, output_folder):
+def reconstruct_svg(svg_file, estimated_contents, output_folder, prim_ids=None):
     """Modifies an SVG file by adding semantic and instance IDs to its elements.
     
     Args:
         svg_file (str): Path to the original SVG file.
         estimated_contents (list): List of dictionaries containing instance and semantic IDs for elements.
         output_folder (str): Directory to save the modified SVG file.
+        prim_ids (array, optional): primIds of the parsed drawing, mapping each row of
+            estimated_contents to the element it was parsed from. Rows follow the
+            element order when not given.
     """
     tree = ET.parse(svg_file) # Reads the SVG file into a tree structure
     root = tree.getroot() # Gets the root element of the SVG
-    ns = root.tag[:-3] # Extracts XML namespace from root tag
-    id = 0
+    if prim_ids is None:
+        prim_ids = range(len(estimated_contents))
+    rows = {int(prim_idx): row for row, prim_idx in enumerate(prim_ids) if row < len(estimated_contents)}
 
     #to_remove = []
     #keep_labels = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 33, 34]
     #keep_labels = list(map(str, keep_labels))
 
-    for g in root.iter(ns + "g"):  # Iterates through all <g> (group) elements in the SVG
-        # Looks for path, circle and ellipse
-        for _path in chain(
-            g.iter(ns + "path"), 
-            g.iter(ns + "circle"), 
-            g.iter(ns + "ellipse")
-        ):
-            try:
-                path_repre = parse_path(_path.attrib['d'])
-                _ = path_repre[0].__class__.__name__
-            except:
-                continue
+    # Same traversal as parse_svg, so prim_idx identifies the same element
+    for prim_idx, _path, _, _ in iter_primitives(root):
+        if prim_idx not in rows:
+            continue  # skipped by parse_svg
+        row = rows[prim_idx]
             
-            # Adds semantic and instance IDs to each element
-            _path.attrib["semanticId"] = str(estimated_contents[id]["semanticId"])
-            _path.attrib["instanceId"] = str(estimated_contents[id]["instanceId"])
-            
-                
-            # Colors the element based on its semantic ID
-            #if estimated_contents[id]["semanticId"] == 0:
-            #    _path.attrib["stroke"] = "rgb(0,0,0)"  # Default to black, ID 0
-            #else:
-            #    color = category2color[estimated_contents[id]["semanticId"]]
-            #    _path.attrib["stroke"] = f'rgb({color[0]},{color[1]},{color[2]})'
-            
-    #        if not(_path.attrib["semanticId"]  in keep_labels):
-    #            to_remove.append(_path)
+        # Adds semantic and instance IDs to each element
+        _path.attrib["semanticId"] = str(estimated_contents[row]["semanticId"])
+        _path.attrib["instanceId"] = str(estimated_contents[row]["instanceId"])
+        
             
-            id += 1
+        # Colors the element based on its semantic ID
+        #if estimated_contents[row]["semanticId"] == 0:
+        #    _path.attrib["stroke"] = "rgb(0,0,0)"  # Default to black, ID 0
+        #else:
+        #    color = category2color[estimated_contents[row]["semanticId"]]
+        #    _path.attrib["stroke"] = f'rgb({color[0]},{color[1]},{color[2]})'
+        
+#        if not(_path.attrib["semanticId"]  in keep_labels):
+#            to_remove.append(_path)
 
     print("building parent map")
     parent_map = {c:p for p in root.iter() for c in p}
@@ -143,6 +138,8 @@ def process():
         args, val_set, training=False, dist=False,
     )
     print("Exited dataloader in visualise.py")
+    # index of every drawing of the test set, to load its primIds
+    drawing_index = {name: idx for idx, name in enumerate(val_set.data_list)}
         # Sets up evaluation metrics
     instance_eval = InstanceEval(
         num_classes=cfg.model.semantic_classes, ignore_label=35, gpu_num=1
@@ -163,7 +160,7 @@ def process():
             
             svg_file = os.path.join(
                 "./dataset/test/test/svg_gt",
-                os.path.basename(json_file).replace("json", "svg"),
+                os.path.splitext(os.path.basename(json_file))[0] + ".svg",
             )
 
             
@@ -182,7 +179,7 @@ def process():
                     continue
                 
                 # Prepares estimated contents for each element
-                num = max(len(instance["masks"]) for instance in instances)
+                num = batch[0].shape[0]
                 estimated_contents = [
                     {
                         "instanceId": 0,
@@ -202,14 +199,15 @@ def process():
                         continue
                     
                     # Updates estimated contents with instance information
-                    for i in np.where(instance["masks"])[0]:
+                    for i in instance["points"]:
                         estimated_contents[i] = {
                             "instanceId": index + 1,
                             "semanticId": instance["labels"] + 1,
                         }
                 
                 # Calls reconstruct_svg to save modified SVG
-                reconstruct_svg(svg_file, estimated_contents, args.out)
+                prim_ids = val_set.drawings.load(drawing_index[json_file])["primIds"]
+                reconstruct_svg(svg_file, estimated_contents, args.out, prim_ids)
 
 if __name__ == "__main__":
     process()